@@ -1,3 +1,82 @@
 from django.contrib import admin
+from django.core.paginator import Paginator
+from django.db import connection
+from django.utils.functional import cached_property
 
-# Register your models here.
+from core.display import flight_number_labels, flight_number_prefetch
+from core.models import Arrival, ArrivalStatus, Departure, DepartureStatus
+
+
+class EstimatedCountPaginator(Paginator):
+    # COUNT(*) over InnoDB scans the whole table, the statistics estimate is free and close enough for paging
+    @cached_property
+    def count(self):
+        query = self.object_list.query
+        if connection.vendor == 'mysql' and not query.where:
+            with connection.cursor() as cursor:
+                cursor.execute(
+                    'SELECT TABLE_ROWS FROM information_schema.TABLES WHERE TABLE_SCHEMA = DATABASE() AND TABLE_NAME = %s',
+                    [self.object_list.model._meta.db_table]
+                )
+                row = cursor.fetchone()
+            if row and row[0]:
+                return row[0]
+        return super().count
+
+
+class LargeTableAdmin(admin.ModelAdmin):
+    paginator = EstimatedCountPaginator
+    show_full_result_count = False
+    ordering = ['-pk']
+
+
+class FlightAdmin(LargeTableAdmin):
+    list_display = ['id', 'schedule', 'flight_numbers', 'status', 'is_cargo']
+    raw_id_fields = ['latest_status']
+
+    def get_queryset(self, request):
+        return super().get_queryset(request).prefetch_related(flight_number_prefetch(self.model))
+
+    def flight_numbers(self, obj):
+        return ', '.join(flight_number_labels(obj))
+
+    def status(self, obj):
+        return obj.latest_status.status if obj.latest_status else None
+
+
+@admin.register(Departure)
+class DepartureAdmin(FlightAdmin):
+    list_display = FlightAdmin.list_display + ['terminal', 'gate']
+    list_select_related = ['latest_status', 'terminal', 'gate']
+
+
+@admin.register(Arrival)
+class ArrivalAdmin(FlightAdmin):
+    list_display = FlightAdmin.list_display + ['stand', 'hall', 'baggage_reclaim']
+    list_select_related = ['latest_status', 'stand', 'hall', 'baggage_reclaim']
+
+
+class StatusAdmin(LargeTableAdmin):
+    list_display = ['id', 'flight', 'status_code', 'status', 'created']
+    flight_field = None
+
+    def get_queryset(self, request):
+        model = self.model._meta.get_field(self.flight_field).related_model
+        return super().get_queryset(request).prefetch_related(flight_number_prefetch(model, self.flight_field + '__'))
+
+    def flight(self, obj):
+        return getattr(obj, self.flight_field)
+
+
+@admin.register(DepartureStatus)
+class DepartureStatusAdmin(StatusAdmin):
+    flight_field = 'departure'
+    list_select_related = ['departure']
+    raw_id_fields = ['departure']
+
+
+@admin.register(ArrivalStatus)
+class ArrivalStatusAdmin(StatusAdmin):
+    flight_field = 'arrival'
+    list_select_related = ['arrival']
+    raw_id_fields = ['arrival']
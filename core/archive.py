@@ -0,0 +1,200 @@
+import json
+import os
+from datetime import datetime, time, timedelta
+
+import pyarrow as pa
+import pyarrow.dataset as ds
+import pyarrow.parquet as pq
+from django.db.models import Prefetch
+from django.utils import timezone
+
+from core.models import (
+    Arrival, ArrivalFlightNumber, ArrivalStatus, Departure, DepartureFlightNumber, DepartureStatus
+)
+from fr.models import FrLog
+
+FLIGHTS = 'flights'
+STATUSES = 'statuses'
+POSITIONS = 'positions'
+WATERMARK = '_watermark.json'
+ROW_GROUP = 50000
+
+PARTITIONS = {
+    FLIGHTS: pa.schema([('direction', pa.string()), ('date', pa.string())]),
+    STATUSES: pa.schema([('direction', pa.string()), ('date', pa.string())]),
+    POSITIONS: pa.schema([('date', pa.string())]),
+}
+
+TIMESTAMP = pa.timestamp('us', tz='UTC')
+SCHEMAS = {
+    FLIGHTS: pa.schema([
+        ('id', pa.int64()), ('schedule', TIMESTAMP), ('actual', TIMESTAMP), ('is_cargo', pa.bool_()),
+        ('flight_numbers', pa.list_(pa.string())), ('airlines', pa.list_(pa.string())),
+        ('airports', pa.list_(pa.string())), ('status_code', pa.string()), ('status', pa.string()),
+        ('terminal', pa.string()), ('gate', pa.string()), ('stand', pa.string()), ('hall', pa.string()),
+        ('baggage_reclaim', pa.string()),
+    ]),
+    STATUSES: pa.schema([
+        ('flight_id', pa.int64()), ('status_code', pa.string()), ('status', pa.string()), ('created', TIMESTAMP),
+    ]),
+    POSITIONS: pa.schema([
+        ('id', pa.int64()), ('timestamp', TIMESTAMP), ('registration', pa.string()), ('flight', pa.string()),
+        ('callsign', pa.string()), ('model', pa.string()), ('origin', pa.string()), ('destination', pa.string()),
+        ('latitude', pa.float64()), ('longitude', pa.float64()), ('bearing', pa.int32()), ('altitude', pa.int32()),
+        ('vertical_speed', pa.int32()), ('speed', pa.int32()), ('squawk', pa.string()), ('radar', pa.string()),
+        ('mode_s_code', pa.string()),
+    ]),
+}
+
+
+class Archive:
+    def __init__(self, root):
+        self.root = root
+
+    @property
+    def watermark(self):
+        path = os.path.join(self.root, WATERMARK)
+        if not os.path.exists(path):
+            return None
+        with open(path) as f:
+            return datetime.strptime(json.load(f)['date'], '%Y-%m-%d').date()
+
+    @watermark.setter
+    def watermark(self, day):
+        os.makedirs(self.root, exist_ok=True)
+        path = os.path.join(self.root, WATERMARK)
+        with open(path + '.tmp', 'w') as f:
+            json.dump({'date': day.isoformat()}, f)
+        os.replace(path + '.tmp', path)
+
+    def pending_days(self, until=None):
+        until = until or timezone.localtime().date() - timedelta(days=1)
+        start = self.watermark
+        if start is None:
+            firsts = [
+                Departure.objects.order_by('schedule_date').values_list('schedule_date', flat=True).first(),
+                Arrival.objects.order_by('schedule_date').values_list('schedule_date', flat=True).first(),
+            ]
+            first_log = FrLog.objects.order_by('timestamp').values_list('timestamp', flat=True).first()
+            if first_log:
+                firsts.append(timezone.localtime(first_log).date())
+            firsts = [d for d in firsts if d]
+            if not firsts:
+                return []
+            start = min(firsts) - timedelta(days=1)
+        days = []
+        day = start + timedelta(days=1)
+        while day <= until:
+            days.append(day)
+            day += timedelta(days=1)
+        return days
+
+    def export_day(self, day):
+        # Rows are streamed out of the database and written ROW_GROUP at a time, a day is never held in memory
+        counts = {}
+        for direction, model, link_model, place, status_model, dimensions in [
+            ('departure', Departure, DepartureFlightNumber, 'destination', DepartureStatus, ['terminal', 'gate']),
+            ('arrival', Arrival, ArrivalFlightNumber, 'origin', ArrivalStatus, ['stand', 'hall', 'baggage_reclaim']),
+        ]:
+            fk = model._meta.model_name
+            ids = model.objects.filter(schedule_date=day).order_by('pk').values_list('pk', flat=True).iterator()
+            flights = self.flights_columns(model, link_model, place, dimensions, ids)
+            counts[FLIGHTS] = counts.get(FLIGHTS, 0) + self.write(FLIGHTS, day, flights, direction)
+
+            statuses = status_model.objects.filter(**{fk + '__schedule_date': day}).order_by(fk, 'created', 'pk')
+            statuses = self.columns(STATUSES, statuses.values_list(fk, 'status_code', 'status', 'created').iterator())
+            counts[STATUSES] = counts.get(STATUSES, 0) + self.write(STATUSES, day, statuses, direction)
+
+        start = timezone.make_aware(datetime.combine(day, time()))
+        positions = FrLog.objects.filter(timestamp__gte=start, timestamp__lt=start + timedelta(days=1)).order_by(
+            'registration', 'timestamp')
+        counts[POSITIONS] = self.write(POSITIONS, day, self.columns(POSITIONS, positions.values_list(*SCHEMAS[POSITIONS].names).iterator()))
+        return counts
+
+    def flights_columns(self, model, link_model, place, dimensions, ids):
+        # iterator() skips prefetch_related, so flights are loaded and prefetched a row group of ids at a time
+        for chunk in _chunks(ids):
+            flights = model.objects.filter(pk__in=chunk).order_by('pk').select_related('latest_status', *dimensions).prefetch_related(
+                Prefetch(link_model._meta.model_name + '_set',
+                         queryset=link_model.objects.select_related('flight_number__airline').order_by('order')),
+                place + 's',
+            )
+            table = {f: [] for f in SCHEMAS[FLIGHTS].names}
+            for flight in flights:
+                links = getattr(flight, link_model._meta.model_name + '_set').all()
+                table['id'].append(flight.pk)
+                table['schedule'].append(flight.schedule)
+                table['actual'].append(flight.actual)
+                table['is_cargo'].append(flight.is_cargo)
+                table['flight_numbers'].append(['{} {}'.format(l.flight_number.airline_letters, l.flight_number.number)
+                                                for l in links])
+                table['airlines'].append([l.flight_number.airline.icao for l in links])
+                table['airports'].append([a.iata for a in getattr(flight, place + 's').all()])
+                table['status_code'].append(flight.latest_status.status_code if flight.latest_status else None)
+                table['status'].append(flight.latest_status.status if flight.latest_status else None)
+                for d in ['terminal', 'gate', 'stand', 'hall', 'baggage_reclaim']:
+                    value = getattr(flight, d, None)
+                    table[d].append(value.name if value else None)
+            yield table
+
+    def columns(self, name, rows):
+        for chunk in _chunks(rows):
+            table = {f: [] for f in SCHEMAS[name].names}
+            columns = list(table.values())
+            for values in chunk:
+                for column, v in zip(columns, values):
+                    column.append(v)
+            yield table
+
+    def write(self, dataset, day, tables, direction=None):
+        parts = [dataset] + (['direction=' + direction] if direction else []) + ['date=' + day.isoformat()]
+        directory = os.path.join(self.root, *parts)
+        os.makedirs(directory, exist_ok=True)
+        path = os.path.join(directory, 'part-0.parquet')
+        rows = 0
+        writer = pq.ParquetWriter(path + '.tmp', SCHEMAS[dataset])
+        try:
+            for table in tables:
+                table = pa.table(table, schema=SCHEMAS[dataset])
+                writer.write_table(table)
+                rows += table.num_rows
+        finally:
+            writer.close()
+        os.replace(path + '.tmp', path)
+        return rows
+
+    def dataset(self, name):
+        return ds.dataset(os.path.join(self.root, name), format='parquet',
+                          schema=pa.schema(list(SCHEMAS[name]) + list(PARTITIONS[name])),
+                          partitioning=ds.partitioning(PARTITIONS[name], flavor='hive'))
+
+    def read(self, name, start=None, end=None, direction=None, columns=None):
+        expression = None
+        for condition in [
+            ds.field('date') >= start.isoformat() if start else None,
+            ds.field('date') <= end.isoformat() if end else None,
+            ds.field('direction') == direction if direction else None,
+        ]:
+            if condition is not None:
+                expression = condition if expression is None else expression & condition
+        return self.dataset(name).to_table(columns=columns, filter=expression)
+
+    def flights(self, start=None, end=None, direction=None, columns=None):
+        return self.read(FLIGHTS, start, end, direction, columns)
+
+    def statuses(self, start=None, end=None, direction=None, columns=None):
+        return self.read(STATUSES, start, end, direction, columns)
+
+    def positions(self, start=None, end=None, columns=None):
+        return self.read(POSITIONS, start, end, columns=columns)
+
+
+def _chunks(rows):
+    chunk = []
+    for row in rows:
+        chunk.append(row)
+        if len(chunk) >= ROW_GROUP:
+            yield chunk
+            chunk = []
+    if chunk:
+        yield chunk
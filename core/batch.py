@@ -0,0 +1,101 @@
+import time
+
+from django.db import DatabaseError, transaction
+
+from core import metrics
+from core.cache import dimensions
+
+
+class TransactionBatch:
+    def __init__(self, size=0, cycle=None):
+        # size is in flights (or whatever units the caller passes), 0 commits only when the batch is closed
+        self.size = size
+        self.cycle = cycle
+        self.atomic = None
+        self.journal = None
+        self.started = None
+        self.pending = 0
+        self.undo = []
+        self.commits = 0
+        self.rollbacks = 0
+        self.latencies = []
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        if exc_type is None:
+            self.commit()
+        elif self.atomic is not None:
+            atomic, self.atomic = self.atomic, None
+            atomic.__exit__(exc_type, exc, tb)
+            self.rolled_back()
+        return False
+
+    def _cycle(self):
+        return self.cycle or metrics.current()
+
+    def run(self, func, *args, units=1, undo=None, **kwargs):
+        if self.atomic is None:
+            self.atomic = transaction.atomic()
+            self.atomic.__enter__()
+            self.journal = dimensions.journal()
+            self.started = time.perf_counter()
+        journal = dimensions.journal()
+        try:
+            with transaction.atomic():
+                result = func(*args, **kwargs)
+        except Exception:
+            # Only this unit is rolled back to its savepoint, the rest of the batch carries on
+            if self._cycle():
+                self._cycle().count('savepoint_rollbacks')
+            dimensions.close(journal, evict=True)
+            raise
+        dimensions.close(journal)
+        if undo is not None:
+            self.undo.append(undo)
+        self.pending += units
+        if self.size and self.pending >= self.size:
+            self.commit()
+        return result
+
+    def commit(self):
+        if self.atomic is None:
+            return True
+        atomic, self.atomic = self.atomic, None
+        pending, self.pending = self.pending, 0
+        start = time.perf_counter()
+        try:
+            atomic.__exit__(None, None, None)
+        except DatabaseError as e:
+            print('Rolled back a batch of {} after a failed commit: {!r}'.format(pending, e))
+            if self._cycle():
+                self._cycle().error(e)
+            self.rolled_back()
+            return False
+        now = time.perf_counter()
+        dimensions.close(self.journal)
+        self.journal = None
+        self.undo = []
+        self.commits += 1
+        self.latencies.append(now - self.started)
+        cycle = self._cycle()
+        if cycle:
+            cycle.count('commits')
+            cycle.count('batched', pending)
+            cycle.time('commit', now - start)
+            cycle.time('batch', now - self.started)
+        return True
+
+    def rolled_back(self):
+        # Rows created in the batch, dimension rows included, are gone and the callers' bookkeeping has to follow
+        self.rollbacks += 1
+        self.pending = 0
+        if self._cycle():
+            self._cycle().count('rollbacks')
+        if self.journal is not None:
+            dimensions.close(self.journal, evict=True)
+            self.journal = None
+        undo, self.undo = self.undo, []
+        for func in undo:
+            func()
@@ -0,0 +1,167 @@
+import threading
+
+from django.db import IntegrityError, transaction
+from django.db.models.signals import post_delete, post_save
+
+
+class DimensionCache:
+    # Entries are stored as field values and handed out as fresh instances, so threads never share a model object.
+    # Other threads only see an entry once the transaction that cached it has committed; until then it lives in
+    # the journals of the thread that cached it.
+    def __init__(self):
+        self.enabled = False
+        self.hits = 0
+        self.misses = 0
+        self._keys = {}
+        self._fields = {}
+        self._entries = {}
+        self._lock = threading.RLock()
+        self._local = threading.local()
+
+    def register(self, model, *fields):
+        self._keys[model] = fields
+        self._fields[model] = [f.attname for f in model._meta.concrete_fields]
+        self._entries[model] = {}
+        post_save.connect(self._saved, sender=model, weak=False)
+        post_delete.connect(self._deleted, sender=model, weak=False)
+
+    def enable(self, preload=True):
+        self.enabled = True
+        if preload:
+            self.preload()
+
+    def disable(self):
+        self.enabled = False
+        self.clear()
+
+    def clear(self):
+        with self._lock:
+            self.forget()
+            self.hits = 0
+            self.misses = 0
+
+    def forget(self):
+        with self._lock:
+            for model in self._entries:
+                self._entries[model] = {}
+
+    def journal(self):
+        # Holds what this thread caches until it is closed, so a rollback can evict just those entries
+        journal = {}
+        self._journals().append(journal)
+        return journal
+
+    def close(self, journal, evict=False):
+        journals = self._journals()
+        del journals[next(i for i, j in enumerate(journals) if j is journal)]
+        if evict:
+            for (model, key), values in journal.items():
+                for outer in journals:
+                    if outer.get((model, key)) is values:
+                        del outer[model, key]
+
+    def _journals(self):
+        if not hasattr(self._local, 'journals'):
+            self._local.journals = []
+        return self._local.journals
+
+    def key(self, model, obj):
+        return tuple(getattr(obj, field) for field in self._keys[model])
+
+    def preload(self, *models):
+        for model in models or list(self._keys):
+            entries = {}
+            for obj in model.objects.order_by('-pk'):
+                entries[self.key(model, obj)] = self._values(model, obj)
+            transaction.on_commit(lambda model=model, entries=entries: self._replace(model, entries))
+
+    def peek(self, model, key):
+        if not self.enabled:
+            return None
+        values = self._lookup(model, key)
+        with self._lock:
+            if values is None:
+                self.misses += 1
+                return None
+            self.hits += 1
+        return model.from_db(None, self._fields[model], values)
+
+    def add(self, model, obj, replace=False):
+        if self.enabled:
+            self._publish(model, self.key(model, obj), self._values(model, obj), replace)
+
+    def get(self, model, key, load):
+        if not self.enabled:
+            return load()
+        obj = self.peek(model, key)
+        if obj is None:
+            try:
+                with transaction.atomic():
+                    obj = load()
+            except IntegrityError:
+                # Another process created the row between our lookup and insert.
+                obj = load()
+            self._publish(model, key, self._values(model, obj), True)
+        return obj
+
+    def stats(self):
+        with self._lock:
+            return {
+                'hits': self.hits,
+                'misses': self.misses,
+                'size': sum(len(_) for _ in self._entries.values()),
+            }
+
+    def _lookup(self, model, key):
+        journals = self._journals()
+        # What an open journal holds is also in the outermost one
+        if journals and (model, key) in journals[0]:
+            return journals[0][model, key]
+        with self._lock:
+            return self._entries[model].get(key)
+
+    def _pk(self, model, values):
+        return values[self._fields[model].index(model._meta.pk.attname)]
+
+    def _values(self, model, obj):
+        return tuple(getattr(obj, field) for field in self._fields[model])
+
+    def _publish(self, model, key, values, replace):
+        for journal in self._journals():
+            if replace or (model, key) not in journal:
+                journal[model, key] = values
+        # Runs straight away outside a transaction, is dropped if the savepoint it was cached in rolls back
+        transaction.on_commit(lambda: self._store(model, key, values, replace))
+
+    def _store(self, model, key, values, replace):
+        with self._lock:
+            if replace:
+                self._entries[model][key] = values
+            else:
+                self._entries[model].setdefault(key, values)
+
+    def _replace(self, model, entries):
+        with self._lock:
+            self._entries[model] = entries
+
+    def _saved(self, sender, instance, created, **kwargs):
+        if not self.enabled:
+            return
+        key = self.key(sender, instance)
+        cached = self._lookup(sender, key)
+        if cached is None and created or cached is not None and self._pk(sender, cached) == instance.pk:
+            self._publish(sender, key, self._values(sender, instance), True)
+
+    def _deleted(self, sender, instance, **kwargs):
+        if not self.enabled:
+            return
+        key = self.key(sender, instance)
+        for journal in self._journals():
+            journal.pop((sender, key), None)
+        with self._lock:
+            entries = self._entries[sender]
+            if key in entries and self._pk(sender, entries[key]) == instance.pk:
+                del entries[key]
+
+
+dimensions = DimensionCache()
@@ -0,0 +1,44 @@
+from django.db.models import Prefetch, prefetch_related_objects
+
+from core.models import Arrival, ArrivalFlightNumber, Departure, DepartureFlightNumber
+
+LINKS = {
+    Departure: DepartureFlightNumber,
+    Arrival: ArrivalFlightNumber,
+}
+
+
+def flight_number_prefetch(model, prefix=''):
+    link_model = LINKS[model]
+    return Prefetch(
+        prefix + link_model._meta.model_name + '_set',
+        queryset=link_model.objects.select_related('flight_number__airline').order_by('order'),
+        to_attr='flight_number_links'
+    )
+
+
+def load_flight_numbers(flights):
+    # One query per model for the whole batch instead of one per flight and flight number
+    by_model = {}
+    for flight in flights:
+        if flight.pk and not hasattr(flight, 'flight_number_links'):
+            by_model.setdefault(type(flight), []).append(flight)
+    for model, items in by_model.items():
+        prefetch_related_objects(items, flight_number_prefetch(model))
+    return flights
+
+
+def flight_number_labels(flight):
+    if flight.pk is None:
+        return []
+    if not hasattr(flight, 'flight_number_links'):
+        load_flight_numbers([flight])
+    return [str(link.flight_number) for link in flight.flight_number_links]
+
+
+def describe(flight):
+    return '{}: {} {}'.format(
+        'DEP' if isinstance(flight, Departure) else 'ARR',
+        flight.schedule.strftime('%m/%d %H:%M'),
+        ', '.join(flight_number_labels(flight))
+    )
@@ -0,0 +1,185 @@
+import json
+import queue
+import threading
+
+from django.conf import settings
+from django.core.serializers.json import DjangoJSONEncoder
+from django.db.models import prefetch_related_objects
+from django.utils.module_loading import import_string
+
+from core import metrics
+from core.display import flight_number_labels, load_flight_numbers
+from core.models import Departure, DepartureStatus
+
+DEFAULT_BROKER = {'BACKEND': 'core.events.InProcessBroker', 'OPTIONS': {}}
+
+
+class InProcessSubscription:
+    def __init__(self, broker, maxsize):
+        self.broker = broker
+        self.queue = queue.Queue(maxsize)
+
+    def put(self, event):
+        # A slow client loses its oldest events rather than blocking the poller
+        while True:
+            try:
+                self.queue.put_nowait(event)
+                return
+            except queue.Full:
+                try:
+                    self.queue.get_nowait()
+                except queue.Empty:
+                    pass
+
+    def get(self, timeout=None):
+        try:
+            return self.queue.get(timeout=timeout)
+        except queue.Empty:
+            return None
+
+    def close(self):
+        self.broker.unsubscribe(self)
+
+
+class InProcessBroker:
+    def __init__(self, maxsize=1000):
+        self.maxsize = maxsize
+        self.subscriptions = set()
+        self.lock = threading.Lock()
+
+    def has_subscribers(self):
+        return bool(self.subscriptions)
+
+    def publish(self, event):
+        with self.lock:
+            subscriptions = list(self.subscriptions)
+        for subscription in subscriptions:
+            subscription.put(event)
+
+    def subscribe(self):
+        subscription = InProcessSubscription(self, self.maxsize)
+        with self.lock:
+            self.subscriptions.add(subscription)
+        return subscription
+
+    def unsubscribe(self, subscription):
+        with self.lock:
+            self.subscriptions.discard(subscription)
+
+
+class RedisSubscription:
+    def __init__(self, pubsub, channel):
+        self.pubsub = pubsub
+        self.pubsub.subscribe(channel)
+
+    def get(self, timeout=None):
+        message = self.pubsub.get_message(ignore_subscribe_messages=True, timeout=timeout or 0)
+        if message is None or message['type'] != 'message':
+            return None
+        return json.loads(message['data'])
+
+    def close(self):
+        self.pubsub.close()
+
+
+class RedisBroker:
+    def __init__(self, url='redis://localhost:6379/0', channel='hkia:statuses'):
+        import redis
+        self.redis = redis.Redis.from_url(url)
+        self.channel = channel
+
+    def has_subscribers(self):
+        return True
+
+    def publish(self, event):
+        self.redis.publish(self.channel, json.dumps(event, cls=DjangoJSONEncoder))
+
+    def subscribe(self):
+        return RedisSubscription(self.redis.pubsub(), self.channel)
+
+
+_broker = None
+_broker_lock = threading.Lock()
+
+
+def get_broker():
+    global _broker
+    with _broker_lock:
+        if _broker is None:
+            config = getattr(settings, 'STATUS_BROKER', DEFAULT_BROKER)
+            _broker = import_string(config['BACKEND'])(**config.get('OPTIONS', {}))
+        return _broker
+
+
+def status_event(status):
+    if isinstance(status, DepartureStatus):
+        direction, flight = 'departure', status.departure
+    else:
+        direction, flight = 'arrival', status.arrival
+    links = flight.flight_number_links
+    if isinstance(flight, Departure):
+        terminal = flight.terminal.name if flight.terminal_id else None
+    else:
+        airline = links[0].flight_number.airline if links else None
+        terminal = airline.terminal.name if airline and airline.terminal_id else None
+    return {
+        'id': '{}-{}'.format(direction, status.pk),
+        'direction': direction,
+        'flight_id': flight.pk,
+        'flight': flight_number_labels(flight),
+        'airline': [link.flight_number.airline.icao for link in links],
+        'terminal': terminal,
+        'schedule': flight.schedule.isoformat(),
+        'status': status.status,
+        'statusCode': status.status_code,
+        'created': status.created.isoformat() if status.created else None,
+    }
+
+
+def check_broker():
+    # Pollers running as their own process reach /api/stream/ clients only through a shared broker
+    if isinstance(get_broker(), InProcessBroker):
+        print('Status events go to an in-process broker, web clients in other processes will not see them. '
+              'Set REDIS_URL to publish them through Redis')
+
+
+def publish_statuses(statuses):
+    # Runs after the statuses have committed, a broker that is down must not fail the poller
+    try:
+        return _publish_statuses(statuses)
+    except Exception as e:
+        print('Failed publishing {} status event(s): {!r}'.format(len(statuses), e))
+        metrics.count('publish_errors')
+        return []
+
+
+def _publish_statuses(statuses):
+    broker = get_broker()
+    if not statuses or not broker.has_subscribers():
+        return []
+    flights = [s.departure if isinstance(s, DepartureStatus) else s.arrival for s in statuses]
+    load_flight_numbers(flights)
+    departures = [f for f in flights if isinstance(f, Departure)]
+    if departures:
+        prefetch_related_objects(departures, 'terminal')
+    airlines = [link.flight_number.airline for f in flights if not isinstance(f, Departure) for link in f.flight_number_links[:1]]
+    if airlines:
+        prefetch_related_objects(airlines, 'terminal')
+    events = [status_event(s) for s in statuses]
+    for event in events:
+        broker.publish(event)
+    return events
+
+
+def matches(event, filters):
+    if filters.get('direction') and event['direction'] not in filters['direction']:
+        return False
+    if filters.get('flight') and not set(event['flight']) & set(filters['flight']):
+        return False
+    if filters.get('airline'):
+        letters = set(f.split(' ')[0] for f in event['flight'])
+        if not (set(event['airline']) | letters) & set(filters['airline']):
+            return False
+    if filters.get('terminal') and event['terminal'] not in filters['terminal']:
+        return False
+    return True
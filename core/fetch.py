@@ -0,0 +1,87 @@
+import random
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from urllib.parse import urlsplit
+
+import requests
+from requests.adapters import HTTPAdapter
+
+
+class Fetcher:
+    def __init__(self, max_workers=8, per_host=4, timeout=10, retries=5, backoff=0.5, max_backoff=30, headers=None):
+        self.timeout = timeout
+        self.retries = retries
+        self.backoff = backoff
+        self.max_backoff = max_backoff
+        self.per_host = per_host
+        self.retried = 0
+
+        self.session = requests.Session()
+        if headers:
+            self.session.headers.update(headers)
+        adapter = HTTPAdapter(pool_connections=max_workers, pool_maxsize=max_workers)
+        self.session.mount('https://', adapter)
+        self.session.mount('http://', adapter)
+
+        self.executor = ThreadPoolExecutor(max_workers=max_workers)
+        self._hosts = {}
+        self._hosts_lock = threading.Lock()
+
+    def _host_slot(self, url):
+        host = urlsplit(url).netloc
+        with self._hosts_lock:
+            if host not in self._hosts:
+                self._hosts[host] = threading.BoundedSemaphore(self.per_host)
+            return self._hosts[host]
+
+    def delay(self, attempt):
+        # Full jitter: uniform over [0, min(cap, base * 2^attempt)]
+        return random.uniform(0, min(self.max_backoff, self.backoff * 2 ** attempt))
+
+    def get(self, url, **kwargs):
+        kwargs.setdefault('timeout', self.timeout)
+        attempt = 0
+        while True:
+            try:
+                with self._host_slot(url):
+                    r = self.session.get(url, **kwargs)
+                r.raise_for_status()
+                return r
+            except requests.RequestException as e:
+                if self.retries is not None and attempt >= self.retries:
+                    raise
+                wait = self.delay(attempt)
+                with self._hosts_lock:
+                    self.retried += 1
+                print('Problem fetching {} ({}), retrying in {:.1f}s'.format(url, e, wait))
+                time.sleep(wait)
+                attempt += 1
+
+    def json(self, url, **kwargs):
+        return self.get(url, **kwargs).json()
+
+    def timed_json(self, url, parse=None, **kwargs):
+        # (data, seconds until the response headers, seconds reading and decoding the body)
+        start = time.perf_counter()
+        r = self.get(url, stream=parse is not None, **kwargs)
+        fetched = time.perf_counter()
+        try:
+            data = parse(r) if parse else r.json()
+        finally:
+            r.close()
+        return data, fetched - start, time.perf_counter() - fetched
+
+    def submit(self, url, **kwargs):
+        return self.executor.submit(self.json, url, **kwargs)
+
+    def submit_timed(self, url, parse=None, **kwargs):
+        return self.executor.submit(self.timed_json, url, parse, **kwargs)
+
+    def map(self, urls, **kwargs):
+        futures = [self.submit(url, **kwargs) for url in urls]
+        return [f.result() for f in futures]
+
+    def close(self):
+        self.executor.shutdown(wait=False)
+        self.session.close()
@@ -0,0 +1,52 @@
+import hashlib
+import json
+import os
+
+
+class FlightFingerprints:
+    def __init__(self, path=None):
+        self.path = path
+        self.previous = {}
+        self.current = {}
+        self.processed = 0
+        self.skipped = 0
+        if path and os.path.exists(path):
+            with open(path) as f:
+                self.previous = json.load(f)
+
+    @classmethod
+    def hash_flight(cls, flight):
+        return hashlib.md5(json.dumps(flight, sort_keys=True).encode('utf-8')).hexdigest()
+
+    @classmethod
+    def key(cls, date, arrival, cargo, flight):
+        flight_no = flight['flight'][0]
+        return '|'.join([date, 'A' if arrival else 'D', 'C' if cargo else 'P',
+                         flight_no['airline'], flight_no['no'].split(' ')[-1]])
+
+    def changed(self, date, arrival, cargo, flights):
+        result = []
+        for flight in flights:
+            key = self.key(date, arrival, cargo, flight)
+            hash = self.hash_flight(flight)
+            self.current[key] = hash
+            if self.previous.get(key) == hash:
+                self.skipped += 1
+            else:
+                self.processed += 1
+                result.append(flight)
+        return result
+
+    def forget(self, date, arrival, cargo, flight):
+        self.current.pop(self.key(date, arrival, cargo, flight), None)
+
+    def rotate(self):
+        self.previous = self.current
+        self.current = {}
+        self.processed = 0
+        self.skipped = 0
+        if self.path:
+            tmp = self.path + '.tmp'
+            with open(tmp, 'w') as f:
+                json.dump(self.previous, f)
+            os.replace(tmp, self.path)
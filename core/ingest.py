@@ -0,0 +1,346 @@
+import re
+
+from dateutil.parser import parse
+from django.db import connection, transaction
+from django.utils import timezone
+
+from core import metrics
+from core.cache import dimensions
+from core.display import load_flight_numbers
+from core.models import (
+    Airline, Airport, Aisle, Arrival, ArrivalFlightNumber, ArrivalOrigin, ArrivalStatus, BaggageReclaim, Departure,
+    DepartureAisle, DepartureDestination, DepartureFlightNumber, DepartureStatus, FlightNumber, Gate, Hall, Stand,
+    Terminal, status_update_callback
+)
+
+
+def resolve_names(model, names, field='name'):
+    found = {}
+    missing = set()
+    for name in set(n for n in names if n):
+        obj = dimensions.peek(model, (name,))
+        if obj is None:
+            missing.add(name)
+        else:
+            found[name] = obj
+    if not missing:
+        return found
+
+    loaded = {}
+    for obj in model.objects.filter(**{field + '__in': missing}).order_by('pk'):
+        loaded.setdefault(getattr(obj, field), obj)
+    to_create = missing - set(loaded)
+    if to_create:
+        model.objects.bulk_create([model(**{field: n}) for n in to_create], ignore_conflicts=True)
+        for obj in model.objects.filter(**{field + '__in': to_create}).order_by('pk'):
+            loaded.setdefault(getattr(obj, field), obj)
+    for obj in loaded.values():
+        dimensions.add(model, obj)
+    found.update(loaded)
+    return found
+
+
+def resolve_flight_numbers(flight_nos):
+    letters_by_icao = {}
+    for flight_no in flight_nos:
+        letters_by_icao.setdefault(flight_no['airline'], flight_no['no'].split(' ')[0])
+    if not letters_by_icao:
+        return {}
+
+    airlines = {}
+    for icao in letters_by_icao:
+        airline = dimensions.peek(Airline, (icao,))
+        if airline is not None:
+            airlines[icao] = airline
+    missing = set(letters_by_icao) - set(airlines)
+    if missing:
+        loaded = {a.icao: a for a in Airline.objects.filter(icao__in=missing)}
+        to_create = [Airline(icao=icao, iata=letters_by_icao[icao], name=icao) for icao in missing if icao not in loaded]
+        if to_create:
+            Airline.objects.bulk_create(to_create, ignore_conflicts=True)
+            loaded = {a.icao: a for a in Airline.objects.filter(icao__in=missing)}
+        for airline in loaded.values():
+            dimensions.add(Airline, airline)
+        airlines.update(loaded)
+    without_iata = []
+    for airline in airlines.values():
+        if airline.iata is None:
+            airline.iata = letters_by_icao[airline.icao]
+            airline.last_updated = timezone.now()
+            without_iata.append(airline)
+    if without_iata:
+        Airline.objects.bulk_update(without_iata, ['iata', 'last_updated'])
+        for airline in without_iata:
+            dimensions.add(Airline, airline, replace=True)
+
+    wanted = {}
+    for flight_no in flight_nos:
+        letters, number = flight_no['no'].split(' ')[:2]
+        wanted.setdefault((flight_no['airline'], number), letters)
+
+    found = {}
+    for icao, number in wanted:
+        flight_number = dimensions.peek(FlightNumber, (airlines[icao].pk, number))
+        if flight_number is not None:
+            found[icao, number] = flight_number
+    if len(found) == len(wanted):
+        return found
+
+    airlines_by_id = {a.pk: a for a in airlines.values()}
+
+    def _load():
+        numbers = FlightNumber.objects.filter(
+            airline__in=airlines.values(), number__in=set(n for (_, n) in wanted if (_, n) not in found)
+        ).order_by('pk')
+        for flight_number in numbers:
+            flight_number.airline = airlines_by_id[flight_number.airline_id]
+            key = (flight_number.airline.icao, flight_number.number)
+            if key in wanted and key not in found:
+                found[key] = flight_number
+                dimensions.add(FlightNumber, flight_number)
+
+    _load()
+    missing = [
+        FlightNumber(airline=airlines[icao], number=number, airline_letters=letters,
+                     number_ordering=int(re.search(r'(\d+)', number).group(1)))
+        for (icao, number), letters in wanted.items() if (icao, number) not in found
+    ]
+    if missing:
+        FlightNumber.objects.bulk_create(missing)
+        _load()
+    return found
+
+
+class FlightIngestor:
+    model = None
+    flight_number_model = None
+    place_model = None
+    place_field = None
+    place_key = None
+    status_model = None
+    final_status_code = None
+    dimensions = ()
+
+    def __init__(self, date, is_cargo=False):
+        self.date = date
+        self.is_cargo = is_cargo
+        self.fk = self.model._meta.model_name
+
+    def ingest(self, flights, print_it=False):
+        existing = self.load_existing(flights)
+        latest = {}
+        for parent in existing.values():
+            if parent.latest_status_id:
+                latest[id(parent)] = (parent.latest_status.status, parent.latest_status.status_code)
+
+        parents = []
+        records = {}
+        pending = []
+        for flight in flights:
+            key = self.key(flight['flight'][0])
+            parent = existing.get(key)
+            if parent is None:
+                parent = self.model()
+                records[id(parent)] = self.record(parent, flight, created=True)
+                for flight_no in flight['flight']:
+                    existing.setdefault(self.key(flight_no), parent)
+            record = records.setdefault(id(parent), self.record(parent, flight))
+            parents.append(parent)
+
+            if record['latest_code'] == self.final_status_code:
+                metrics.count('flights_final')
+                continue
+            pending.append((parent, flight))
+
+            status = flight.get('status')
+            status_code = flight.get('statusCode')
+            last = latest.get(id(parent))
+            if status and (not last or last != (status, status_code)):
+                record['statuses'].append((status, status_code))
+                latest[id(parent)] = (status, status_code)
+                record['latest_code'] = status_code
+
+        if not pending:
+            return parents
+
+        dims = {}
+        for field, model, json_key in self.dimensions:
+            dims[field] = resolve_names(model, (f.get(json_key) for p, f in pending if getattr(p, field + '_id') is None))
+        aisles = resolve_names(Aisle, (a for _, f in pending for a in self.aisles(f)))
+        created = [p for p in _unique(p for p, _ in pending) if records[id(p)]['created']]
+        flight_numbers = resolve_flight_numbers([n for p in created for n in records[id(p)]['flight']['flight']])
+        places = resolve_names(Airport, (c for p in created for c in records[id(p)]['flight'].get(self.place_key)),
+                               field='iata')
+
+        updated = []
+        for parent, flight in pending:
+            before = self.snapshot(parent)
+            for field, _, json_key in self.dimensions:
+                name = flight.get(json_key)
+                if getattr(parent, field + '_id') is None and name:
+                    setattr(parent, field, dims[field][name])
+            parent.schedule = timezone.make_aware(parse(self.date + ' ' + flight.get('time')))
+            parent.schedule_date = parent.schedule.date()
+            parent.is_cargo = self.is_cargo
+            records[id(parent)]['aisles'].update(self.aisles(flight))
+            if parent.pk and self.snapshot(parent) != before:
+                updated.append(parent)
+
+        with transaction.atomic():
+            self.save_created(created)
+
+            links = []
+            for parent in created:
+                flight = records[id(parent)]['flight']
+                seen = set()
+                for i, flight_no in enumerate(flight.get('flight'), start=1):
+                    flight_number = flight_numbers[self.key(flight_no)]
+                    if flight_number.pk not in seen:
+                        seen.add(flight_number.pk)
+                        links.append(self.flight_number_model(
+                            **{self.fk: parent, 'flight_number': flight_number, 'order': i,
+                               'schedule_date': parent.schedule_date}))
+            self.flight_number_model.objects.bulk_create(links, ignore_conflicts=True)
+
+            self.place_model.objects.bulk_create([
+                self.place_model(**{self.fk: parent, self.place_field: places[code]})
+                for parent in created for code in dict.fromkeys(records[id(parent)]['flight'].get(self.place_key))
+            ], ignore_conflicts=True)
+
+            self.save_aisles([(p, aisles[a]) for p in _unique(p for p, _ in pending) for a in records[id(p)]['aisles']])
+
+            statuses = [
+                self.status_model(**{self.fk: parent, 'status': status, 'status_code': status_code})
+                for parent in _unique(p for p, _ in pending)
+                for status, status_code in records[id(parent)]['statuses']
+            ]
+            self.status_model.objects.bulk_create(statuses)
+            if statuses:
+                new = {}
+                for status in statuses:
+                    new.setdefault(id(getattr(status, self.fk)), []).append(status)
+                changed = _unique(getattr(s, self.fk) for s in statuses)
+                # Only PostgreSQL hands back ids from bulk_create, elsewhere the new rows are the newest of their flight
+                ids = {}
+                for pk, parent_id in (self.status_model.objects.filter(**{self.fk + '__in': changed})
+                                      .order_by('pk').values_list('pk', self.fk)):
+                    ids.setdefault(parent_id, []).append(pk)
+                for parent in changed:
+                    for status, pk in zip(new[id(parent)], ids[parent.pk][-len(new[id(parent)]):]):
+                        status.pk = pk
+                    parent.latest_status_id = new[id(parent)][-1].pk
+                    updated.append(parent)
+                # Published with their ids, which clients resume and deduplicate by
+                transaction.on_commit(lambda: status_update_callback(statuses))
+
+            if updated:
+                self.model.objects.bulk_update(
+                    _unique(updated), ['schedule', 'schedule_date', 'is_cargo', 'latest_status'] + [d[0] for d in self.dimensions])
+
+        metrics.count('flights_created', len(created))
+        metrics.count('flights_updated', len(_unique(updated)))
+        metrics.count('statuses_created', len(statuses))
+
+        if print_it:
+            load_flight_numbers(_unique(getattr(s, self.fk) for s in statuses))
+            for status in statuses:
+                print(status)
+
+        return parents
+
+    def record(self, parent, flight, created=False):
+        return {
+            'created': created,
+            'flight': flight,
+            'aisles': set(),
+            'statuses': [],
+            'latest_code': parent.latest_status.status_code if parent.latest_status_id else None,
+        }
+
+    def key(self, flight_no):
+        return flight_no['airline'], flight_no['no'].split(' ')[-1]
+
+    def aisles(self, flight):
+        return []
+
+    def snapshot(self, parent):
+        return [parent.schedule, parent.schedule_date, parent.is_cargo] + [getattr(parent, d[0] + '_id') for d in self.dimensions]
+
+    def lookup(self, keys):
+        return self.flight_number_model.objects.filter(
+            schedule_date=self.date,
+            flight_number__airline__icao__in=set(k[0] for k in keys),
+            flight_number__number__in=set(k[1] for k in keys),
+        )
+
+    def load_existing(self, flights):
+        keys = set(self.key(flight['flight'][0]) for flight in flights)
+        if not keys:
+            return {}
+        links = self.lookup(keys).select_related(self.fk + '__latest_status', 'flight_number__airline').order_by('pk')
+
+        existing = {}
+        parents = {}
+        for link in links:
+            parent = parents.setdefault(getattr(link, self.fk + '_id'), getattr(link, self.fk))
+            existing.setdefault((link.flight_number.airline.icao, link.flight_number.number), parent)
+        return existing
+
+    def save_created(self, created):
+        if connection.features.can_return_ids_from_bulk_insert:
+            self.model.objects.bulk_create(created)
+        else:
+            # Not bulk: MySQL returns no ids from a multi-row INSERT and flights have no natural key to read them
+            # back by, so each new flight is one INSERT. Everything hanging off them is still bulk.
+            for parent in created:
+                parent.save()
+
+    def save_aisles(self, aisles):
+        pass
+
+
+class DepartureIngestor(FlightIngestor):
+    model = Departure
+    flight_number_model = DepartureFlightNumber
+    place_model = DepartureDestination
+    place_field = 'destination'
+    place_key = 'destination'
+    status_model = DepartureStatus
+    final_status_code = 'DA'
+    dimensions = (
+        ('terminal', Terminal, 'terminal'),
+        ('gate', Gate, 'gate'),
+    )
+
+    def aisles(self, flight):
+        return list(flight.get('aisle', ''))
+
+    def save_aisles(self, aisles):
+        DepartureAisle.objects.bulk_create([
+            DepartureAisle(departure=departure, aisle=aisle) for departure, aisle in aisles
+        ], ignore_conflicts=True)
+
+
+class ArrivalIngestor(FlightIngestor):
+    model = Arrival
+    flight_number_model = ArrivalFlightNumber
+    place_model = ArrivalOrigin
+    place_field = 'origin'
+    place_key = 'origin'
+    status_model = ArrivalStatus
+    final_status_code = 'ON'
+    dimensions = (
+        ('stand', Stand, 'stand'),
+        ('hall', Hall, 'hall'),
+        ('baggage_reclaim', BaggageReclaim, 'baggage'),
+    )
+
+
+def _unique(items):
+    seen = set()
+    result = []
+    for item in items:
+        if id(item) not in seen:
+            seen.add(id(item))
+            result.append(item)
+    return result
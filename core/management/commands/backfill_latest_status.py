@@ -0,0 +1,45 @@
+from django.core.management.base import BaseCommand, CommandError
+from django.db.models import F, OuterRef, Q, Subquery
+
+from core.models import Departure, DepartureStatus, Arrival, ArrivalStatus
+
+
+class Command(BaseCommand):
+    help = 'Backfill and verify Departure/Arrival.latest_status against their status history'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--verify', action='store_true', help='Only report stale rows, exit non-zero if any')
+        parser.add_argument('--batch-size', type=int, default=1000)
+
+    def handle(self, *args, **options):
+        stale_total = 0
+        for model, status_model, fk in [(Departure, DepartureStatus, 'departure'), (Arrival, ArrivalStatus, 'arrival')]:
+            latest = status_model.objects.filter(**{fk: OuterRef('pk')}).order_by('-created', '-pk').values('pk')[:1]
+            # Pointing at an older status, missing although there are statuses, or set although there are none
+            stale = model.objects.annotate(expected=Subquery(latest)).filter(
+                Q(expected__isnull=False, latest_status__isnull=True) |
+                Q(expected__isnull=True, latest_status__isnull=False) |
+                Q(expected__isnull=False, latest_status__isnull=False) & ~Q(latest_status=F('expected'))
+            ).values_list('pk', 'expected')
+
+            if options['verify']:
+                count = stale.count()
+                stale_total += count
+                print('{}: {} rows with a stale latest_status'.format(model.__name__, count))
+                continue
+
+            fixed = 0
+            batch = []
+            for pk, expected in stale.iterator():
+                batch.append(model(pk=pk, latest_status_id=expected))
+                if len(batch) >= options['batch_size']:
+                    model.objects.bulk_update(batch, ['latest_status'])
+                    fixed += len(batch)
+                    batch = []
+            if batch:
+                model.objects.bulk_update(batch, ['latest_status'])
+                fixed += len(batch)
+            print('{}: fixed {} rows'.format(model.__name__, fixed))
+
+        if stale_total:
+            raise CommandError('{} rows have a stale latest_status'.format(stale_total))
@@ -0,0 +1,272 @@
+import contextlib
+import glob
+import io
+import json
+import math
+import os
+import time
+
+from django.core.management import call_command
+from django.core.management.base import BaseCommand, CommandError
+from django.db import connection
+from django.test.utils import setup_databases, teardown_databases
+
+from core.batch import TransactionBatch
+from core.cache import dimensions
+from core.fetch import Fetcher
+from core.metrics import Cycle
+from core.mockfeeds import MockFeeds
+from core.models import Arrival, Departure
+from core.pollers import (
+    PERMUTATIONS, STATUS_URL, ReferencePoller, StatusPoller, fetch_permutations, keyed_flights, status_date
+)
+from core.streaming import read_days
+from fr.columnar import feed_items, feed_rows, tracked_feeds
+from fr.models import FrLog
+from fr.pollers import FEED_HEADERS, FEED_URL, FrPoller
+
+SOURCES = {
+    'statuses': lambda: fetch_permutations(Fetcher(), STATUS_URL, status_date(), Cycle('statuses'), parse=read_days),
+    'fr': lambda: Fetcher(max_workers=1, headers=FEED_HEADERS).json(FEED_URL),
+    'reference': lambda: ReferencePoller().fetch(Cycle('reference')),
+}
+# Seconds between recorded cycles, generated cycles step the mock clock by the same
+INTERVALS = {'statuses': 30, 'fr': 5, 'reference': 0}
+# Generated fixtures start from a fixed clock so every run of --generate writes the same files
+GENERATED_AT = 1527552000
+
+
+def generated_sources(feeds):
+    # The same shapes SOURCES records, built straight from the mock feeds without going over HTTP
+    def statuses(now):
+        date = time.strftime('%Y-%m-%d', time.gmtime(now - 24 * 60 * 60))
+        return [
+            (cargo, arrival, [{'date': d['date'], 'list': d['list']} for d in
+                              feeds.flights(date, cargo == 'true', arrival == 'true', span=2, now=now)])
+            for cargo, arrival in PERMUTATIONS
+        ]
+
+    return {
+        'statuses': statuses,
+        'fr': feeds.feed,
+        'reference': lambda now: [feeds.airline_data(), feeds.airport_list(), feeds.airline_list()],
+    }
+
+
+def status_flights(cycle):
+    return sum(len(d['list']) for _, _, data in cycle for d in data)
+
+
+def reference_items(cycle):
+    data, airports, airlines = cycle
+    return sum(len(data[k]) for k in ['airline-lounge', 'ground-handling-agent', 'airline']) + len(airports) + len(airlines)
+
+
+def call(batch, func, *args, **kwargs):
+    if batch is None:
+        return func(*args, **kwargs)
+    return batch.run(func, *args, **kwargs)
+
+
+def ingest_per_row(cycle, batch=None):
+    for cargo, arrival, data in cycle:
+        cls = Arrival if arrival == 'true' else Departure
+        for d in data:
+            for flight in d['list']:
+                call(batch, cls.create_or_update_from_json, d['date'], flight, is_cargo=cargo == 'true')
+
+
+def ingest_bulk(cycle, batch=None):
+    for cargo, arrival, data in cycle:
+        cls = Arrival if arrival == 'true' else Departure
+        for d in data:
+            call(batch, cls.bulk_create_or_update_from_json, d['date'], d['list'], is_cargo=cargo == 'true')
+
+
+def fr_per_row(cycle, batch=None):
+    for feed in tracked_feeds(feed_rows(cycle)):
+        call(batch, FrLog.create_from_feed, FrLog.fingerprint_feed(feed), feed)
+
+
+# name: (fixture source, poller factory or None, cycle function, items in a cycle)
+SCENARIOS = {
+    'statuses-per-row': ('statuses', None, ingest_per_row, status_flights),
+    'statuses-bulk': ('statuses', None, ingest_bulk, status_flights),
+    'statuses-poller': ('statuses', StatusPoller, None, status_flights),
+    'reference': ('reference', ReferencePoller, None, reference_items),
+    'fr-per-row': ('fr', None, fr_per_row, lambda cycle: len(feed_rows(cycle))),
+    'fr-poller': ('fr', FrPoller, None, lambda cycle: len(feed_rows(cycle))),
+}
+
+
+def percentile(values, p):
+    values = sorted(values)
+    if not values:
+        return 0
+    return values[max(0, math.ceil(p / 100 * len(values)) - 1)]
+
+
+class QueryCounter:
+    def __init__(self):
+        self.count = 0
+
+    def __call__(self, execute, sql, params, many, context):
+        self.count += 1
+        return execute(sql, params, many, context)
+
+
+class Command(BaseCommand):
+    help = 'Replay recorded HKIA and FR24 responses against a throwaway database and report ingest throughput'
+
+    def add_arguments(self, parser):
+        parser.add_argument('fixtures', help='Directory with statuses/, fr/ and reference/ recordings, made by --record or --generate')
+        parser.add_argument('--record', type=int, metavar='CYCLES',
+                            help='Record this many cycles of each live feed into the fixtures directory and exit')
+        parser.add_argument('--generate', type=int, metavar='CYCLES',
+                            help='Write this many cycles of each mock feed into the fixtures directory and exit, '
+                                 'for running the benchmark offline')
+        parser.add_argument('--flights-per-day', type=int, default=1200, help='Flights per day in generated fixtures')
+        parser.add_argument('--aircraft', type=int, default=2000, help='Aircraft in every generated FR24 feed')
+        parser.add_argument('--scenario', action='append', choices=sorted(SCENARIOS))
+        parser.add_argument('--output', help='Write results as JSON')
+        parser.add_argument('--compare', help='Results JSON of an earlier run to check for regressions')
+        parser.add_argument('--threshold', type=float, default=20, help='Allowed change in percent before a regression')
+        parser.add_argument('--batch-size', type=int,
+                            help='Run each cycle in transaction batches of this many flights, 0 for one per cycle. '
+                                 'Without it the per-row scenarios run in autocommit')
+
+    def handle(self, *args, **options):
+        if options['record']:
+            return self.record(options['fixtures'], options['record'])
+        if options['generate']:
+            feeds = MockFeeds(flights_per_day=options['flights_per_day'], aircraft=options['aircraft'])
+            return self.generate(options['fixtures'], options['generate'], feeds)
+
+        scenarios = options['scenario'] or sorted(SCENARIOS)
+        fixtures = {}
+        for name in scenarios:
+            source = SCENARIOS[name][0]
+            if source not in fixtures:
+                fixtures[source] = self.load(options['fixtures'], source)
+
+        old_config = setup_databases(verbosity=0, interactive=False, keepdb=False)
+        try:
+            results = {}
+            for name in scenarios:
+                if not fixtures[SCENARIOS[name][0]]:
+                    print('{}: no {} fixtures, skipped'.format(name, SCENARIOS[name][0]))
+                    continue
+                results[name] = self.run(name, fixtures[SCENARIOS[name][0]], options['batch_size'])
+        finally:
+            teardown_databases(old_config, verbosity=0)
+
+        print('{:<18} {:>6} {:>8} {:>10} {:>11} {:>9} {:>9} {:>8} {:>9}'.format(
+            'scenario', 'cycles', 'items', 'items/s', 'queries/item', 'p50 ms', 'p99 ms', 'commits', 'batch ms'))
+        for name, r in results.items():
+            print('{:<18} {cycles:>6} {items:>8} {items_per_second:>10.1f} {queries_per_item:>11.2f} {p50:>9.1f} {p99:>9.1f} '
+                  '{commits:>8} {batch:>9.1f}'.format(
+                      name, **dict(r, p50=r['p50'] * 1000, p99=r['p99'] * 1000, batch=r['batch_seconds'] * 1000)))
+
+        report = {'database': connection.vendor, 'fixtures': options['fixtures'], 'created': time.time(), 'scenarios': results}
+        if options['output']:
+            with open(options['output'], 'w') as f:
+                json.dump(report, f, indent=2)
+        if options['compare']:
+            with open(options['compare']) as f:
+                self.compare(json.load(f), report, options['threshold'])
+
+    def load(self, root, source):
+        cycles = []
+        for path in sorted(glob.glob(os.path.join(root, source, '*.json'))):
+            with open(path) as f:
+                cycles.append(json.load(f))
+        return cycles
+
+    def save(self, root, source, i, data):
+        os.makedirs(os.path.join(root, source), exist_ok=True)
+        with open(os.path.join(root, source, '{:04d}.json'.format(i)), 'w') as f:
+            json.dump(data, f)
+
+    def record(self, root, cycles):
+        for source, fetch in SOURCES.items():
+            for i in range(1 if source == 'reference' else cycles):
+                self.save(root, source, i, fetch())
+                print('Recorded {} cycle {}'.format(source, i))
+                if i < cycles - 1:
+                    time.sleep(INTERVALS[source])
+
+    def generate(self, root, cycles, feeds):
+        for source, fetch in generated_sources(feeds).items():
+            for i in range(1 if source == 'reference' else cycles):
+                self.save(root, source, i, fetch(GENERATED_AT + i * INTERVALS[source]))
+            print('Generated {} {} cycle(s)'.format(1 if source == 'reference' else cycles, source))
+
+    def run(self, name, cycles, batch_size=None):
+        source, poller_class, func, items = SCENARIOS[name]
+        call_command('flush', interactive=False, verbosity=0)
+        dimensions.clear()
+        dimensions.enable()
+        totals = Cycle(name)
+        if poller_class:
+            poller = poller_class()
+            if hasattr(poller, 'batch_size') and batch_size is not None:
+                poller.batch_size = batch_size
+            if source == 'fr':
+                func = lambda cycle: poller.process(iter(feed_items(cycle)), totals)
+            elif source == 'statuses':
+                func = lambda cycle: poller.process([
+                    (cargo, arrival, keyed_flights(cargo, arrival, ((d['date'], f) for d in data for f in d['list'])))
+                    for cargo, arrival, data in cycle
+                ], totals)
+            else:
+                func = lambda cycle: poller.process(cycle, totals)
+
+        counter = QueryCounter()
+        latencies = []
+        total_items = 0
+        with connection.execute_wrapper(counter), contextlib.redirect_stdout(io.StringIO()):
+            for cycle in cycles:
+                start = time.perf_counter()
+                if batch_size is None or poller_class:
+                    func(cycle)
+                else:
+                    with TransactionBatch(batch_size, totals) as batch:
+                        func(cycle, batch)
+                latencies.append(time.perf_counter() - start)
+                total_items += items(cycle)
+        dimensions.disable()
+
+        seconds = sum(latencies)
+        return {
+            'cycles': len(cycles),
+            'items': total_items,
+            'seconds': seconds,
+            'items_per_second': total_items / seconds if seconds else 0,
+            'queries': counter.count,
+            'queries_per_item': counter.count / total_items if total_items else 0,
+            'p50': percentile(latencies, 50),
+            'p99': percentile(latencies, 99),
+            'commits': totals.counts['commits'],
+            'batch_seconds': totals.timings['batch'] / totals.counts['commits'] if totals.counts['commits'] else 0,
+        }
+
+    def compare(self, baseline, report, threshold):
+        regressions = []
+        print('\nCompared with {} run of {}:'.format(baseline['database'], time.ctime(baseline['created'])))
+        for name, r in report['scenarios'].items():
+            old = baseline['scenarios'].get(name)
+            if not old:
+                continue
+            changes = []
+            # Higher is better for throughput, lower is better for the rest
+            for metric, worse_if_higher in [('items_per_second', False), ('queries_per_item', True), ('p50', True), ('p99', True)]:
+                if not old[metric]:
+                    continue
+                change = (r[metric] - old[metric]) / old[metric] * 100
+                regressed = change > threshold if worse_if_higher else change < -threshold
+                changes.append('{} {:+.1f}%{}'.format(metric, change, ' REGRESSION' if regressed else ''))
+                if regressed:
+                    regressions.append('{} {}'.format(name, metric))
+            print('{:<18} {}'.format(name, ', '.join(changes)))
+        if regressions:
+            raise CommandError('{} regression(s): {}'.format(len(regressions), ', '.join(regressions)))
@@ -0,0 +1,26 @@
+import time
+from dateutil.parser import parse
+
+from django.core.management.base import BaseCommand
+
+from core.archive import Archive
+
+
+class Command(BaseCommand):
+    help = 'Export closed days of flights, statuses and FR positions to a partitioned Parquet archive'
+
+    def add_arguments(self, parser):
+        parser.add_argument('root', help='Archive directory')
+        parser.add_argument('--until', help='Last day to export (YYYY-MM-DD), defaults to yesterday')
+
+    def handle(self, *args, **options):
+        archive = Archive(options['root'])
+        until = parse(options['until']).date() if options['until'] else None
+        days = archive.pending_days(until)
+        print('Exporting {} days after watermark {}'.format(len(days), archive.watermark))
+        for day in days:
+            start = time.time()
+            counts = archive.export_day(day)
+            archive.watermark = day
+            print('Exported {} in {:.1f}s: {}'.format(
+                day, time.time() - start, ', '.join('{} {}'.format(v, k) for k, v in sorted(counts.items()))))
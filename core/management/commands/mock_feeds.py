@@ -0,0 +1,34 @@
+from django.core.management.base import BaseCommand
+
+from core.mockfeeds import MockFeeds, serve
+
+
+class Command(BaseCommand):
+    help = 'Serve synthetic HKIA and FR24 feeds locally, for load testing the pollers without the internet'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--host', default='127.0.0.1')
+        parser.add_argument('--port', type=int, default=8080)
+        parser.add_argument('--flights-per-day', type=int, default=1200, help='Flights per day across all four feeds')
+        parser.add_argument('--cargo-share', type=float, default=0.25)
+        parser.add_argument('--aircraft', type=int, default=2000, help='Aircraft in every FR24 feed')
+        parser.add_argument('--churn', type=float, default=0.05, help='Share of flights whose status changes every minute')
+        parser.add_argument('--airlines', type=int, default=150)
+        parser.add_argument('--airports', type=int, default=400)
+        parser.add_argument('--latency', type=float, default=0, help='Mean seconds before each response')
+        parser.add_argument('--error-rate', type=float, default=0,
+                            help='Share of requests answered with a 500, a 503 or a body cut off halfway')
+        parser.add_argument('--seed', type=int, default=0)
+
+    def handle(self, *args, **options):
+        feeds = MockFeeds(options['flights_per_day'], options['aircraft'], options['churn'], options['cargo_share'],
+                          options['airlines'], options['airports'], options['seed'])
+        server = serve(feeds, options['host'], options['port'], options['latency'], options['error_rate'])
+        url = 'http://{}:{}'.format(*server.server_address[:2])
+        print('Serving mock feeds on {0}, run the pollers with HKIA_BASE_URL={0} FR24_BASE_URL={0}'.format(url))
+        try:
+            server.serve_forever()
+        except KeyboardInterrupt:
+            pass
+        finally:
+            server.server_close()
@@ -0,0 +1,43 @@
+from datetime import datetime
+
+from django.core.management.base import BaseCommand, CommandError
+
+from core.metrics import Registry
+from core.pipeline import OVERFLOW_POLICIES, Pipeline
+from core.pollers import StatusPoller
+from core.rawfeeds import RawFeedArchive, ReplayPoller
+from fr.pollers import FrPoller
+
+
+def timestamp(value):
+    return datetime.strptime(value, '%Y-%m-%dT%H:%M').timestamp()
+
+
+class Command(BaseCommand):
+    help = 'Feed raw responses kept with --archive-raw back through update_statuses or update_fr_data'
+
+    def add_arguments(self, parser):
+        parser.add_argument('archive', help='Directory given to --archive-raw')
+        parser.add_argument('--job', choices=['fr', 'statuses'], required=True)
+        parser.add_argument('--speed', type=float, default=1, help='Multiple of the recorded pace, 0 for as fast as possible')
+        parser.add_argument('--since', type=timestamp, help='Local time as YYYY-MM-DDTHH:MM')
+        parser.add_argument('--until', type=timestamp, help='Local time as YYYY-MM-DDTHH:MM')
+        parser.add_argument('--batch-size', type=int, default=0, help='Flights per transaction, 0 for one transaction per feed permutation')
+        parser.add_argument('--queue-size', type=int, default=2, help='Parsed snapshots allowed to wait for the writer')
+        parser.add_argument('--overflow', choices=OVERFLOW_POLICIES, default='block',
+                            help='block writes every archived cycle, the others behave like the live pollers under load')
+        parser.add_argument('--metrics-file', help='Append per-cycle metrics as JSON lines')
+        parser.add_argument('--metrics-port', type=int, help='Serve Prometheus metrics on this port')
+
+    def handle(self, *args, **options):
+        if options['speed'] < 0:
+            raise CommandError('--speed cannot be negative')
+        registry = Registry(options['metrics_file'])
+        if options['metrics_port']:
+            registry.serve(options['metrics_port'])
+        poller = StatusPoller(batch_size=options['batch_size']) if options['job'] == 'statuses' else FrPoller()
+        replay = ReplayPoller(poller, RawFeedArchive(options['archive']), options['speed'], options['since'], options['until'])
+        print('Replaying {} {} cycle(s) at {}'.format(
+            replay.total, options['job'], '{}x'.format(options['speed']) if options['speed'] else 'full speed'))
+        Pipeline(replay, 0, options['queue_size'], options['overflow'], metrics=registry).run()
+        print('Replayed {} cycle(s)'.format(replay.replayed))
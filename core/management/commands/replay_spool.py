@@ -0,0 +1,31 @@
+from django.core.management.base import BaseCommand
+
+from core.pipeline import Pipeline
+from core.pollers import StatusPoller
+from core.spool import Spool
+from fr.pollers import FrPoller
+
+POLLERS = {
+    'statuses': StatusPoller,
+    'fr': FrPoller,
+}
+
+
+class Command(BaseCommand):
+    help = 'Write the snapshots left in an update_statuses or update_fr_data spool to the database and exit'
+
+    def add_arguments(self, parser):
+        parser.add_argument('spool', help='Spool directory')
+        parser.add_argument('--job', choices=sorted(POLLERS), required=True, help='Poller that filled the spool')
+        parser.add_argument('--merge', type=int, default=1,
+                            help='Snapshots merged into one write, newest value per flight or aircraft, 1 replays every snapshot')
+
+    def handle(self, *args, **options):
+        spool = Spool(options['spool'])
+        print('Replaying {records} snapshot(s), {bytes} bytes, oldest from {oldest_age:.0f}s ago'.format(**spool.backlog()))
+        pipeline = Pipeline(POLLERS[options['job']](), 0, spool=spool, spool_merge=options['merge'])
+        try:
+            pipeline.drain(until_empty=True)
+        except KeyboardInterrupt:
+            pass
+        print('Replayed {}, {} left'.format(spool.replayed, spool.pending))
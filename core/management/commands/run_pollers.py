@@ -0,0 +1,36 @@
+from django.core.management.base import BaseCommand
+
+from core.events import check_broker
+from core.metrics import Registry
+from core.pollers import ReferencePoller, StatusPoller
+from core.scheduler import Scheduler
+from fr.pollers import FrPoller
+
+
+class Command(BaseCommand):
+    help = 'Run the status, FR24 and reference data pollers on one fixed-rate scheduler'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--fingerprints', help='File to persist flight fingerprints between runs')
+        parser.add_argument('--statuses-interval', type=float, default=30)
+        parser.add_argument('--fr-interval', type=float, default=5)
+        parser.add_argument('--reference-interval', type=float, default=24 * 60 * 60)
+        parser.add_argument('--batch-size', type=int, default=0, help='Flights per transaction, 0 for one transaction per feed permutation')
+        parser.add_argument('--db-workers', type=int, default=2, help='Threads, and so DB connections, used for writes')
+        parser.add_argument('--skip', action='append', choices=['statuses', 'fr', 'reference'], default=[])
+        parser.add_argument('--metrics-file', help='Append per-cycle metrics as JSON lines')
+        parser.add_argument('--metrics-port', type=int, help='Serve Prometheus metrics on this port')
+
+    def handle(self, *args, **options):
+        check_broker()
+        registry = Registry(options['metrics_file'])
+        if options['metrics_port']:
+            registry.serve(options['metrics_port'])
+        scheduler = Scheduler(db_workers=options['db_workers'], metrics=registry)
+        if 'statuses' not in options['skip']:
+            scheduler.add(StatusPoller(options['fingerprints'], options['batch_size']), options['statuses_interval'])
+        if 'fr' not in options['skip']:
+            scheduler.add(FrPoller(), options['fr_interval'])
+        if 'reference' not in options['skip']:
+            scheduler.add(ReferencePoller(), options['reference_interval'])
+        scheduler.run()
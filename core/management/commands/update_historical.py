@@ -1,42 +1,147 @@
 import time
+from functools import partial
+from itertools import groupby
+from operator import itemgetter
+from multiprocessing import Pool
 from dateutil.parser import parse
 from datetime import timedelta
 
 import pytz
-from itertools import product
 
 from django.core.management.base import BaseCommand
+from django.db import connections
 from django.utils import timezone
-import requests
 
-from core.models import Departure, Arrival
+from core.batch import TransactionBatch
+from core.cache import dimensions
+from core.fetch import Fetcher
+from core.metrics import Cycle, Registry
+from core.pollers import HKIA_BASE_URL, PERMUTATIONS
+from core.streaming import batches, iter_flights
+from core.models import Departure, Arrival, BackfillCheckpoint
+
+URL = HKIA_BASE_URL + '/flightinfo-rest/rest/flights?span=1&date={}&lang=en&cargo={}&arrival={}'
+
+fetcher = None
+
+
+def init_worker():
+    global fetcher
+    connections.close_all()
+    dimensions.enable()
+    fetcher = Fetcher()
+
+
+def fetch(url):
+    start = time.perf_counter()
+    r = fetcher.get(url, stream=True)
+    return r, time.perf_counter() - start
+
+
+def backfill_date(date, batch_size=0):
+    try:
+        return _backfill_date(date, batch_size)
+    except Exception as e:
+        # Whatever a day raises fails only that day, the pool carries on and the day is retried on the next run
+        print('Failed {}: {!r}'.format(date, e))
+        cycle = Cycle('historical')
+        cycle.error(e)
+        cycle.set(date=date, duration=0)
+        return date, 0, 1, 0, cycle.as_dict()
+
+
+def _backfill_date(date, batch_size=0):
+    start = time.time()
+    flights = 0
+    errors = 0
+    cycle = Cycle('historical')
+    futures = [fetcher.executor.submit(fetch, URL.format(date, cargo, arrival)) for cargo, arrival in PERMUTATIONS]
+    for (cargo, arrival), future in zip(PERMUTATIONS, futures):
+        feed = '{}_{}'.format('cargo' if cargo == 'true' else 'passenger', 'arrival' if arrival == 'true' else 'departure')
+        try:
+            r, fetch_time = future.result()
+        except Exception as e:
+            print('Failed fetching {} cargo={} arrival={}: {}'.format(date, cargo, arrival, e))
+            cycle.error(e)
+            errors += 1
+            continue
+        cycle.time('fetch_' + feed, fetch_time)
+        cls = Arrival if arrival == 'true' else Departure
+
+        # Flights are parsed off the socket as they are ingested, a day is never held in memory
+        try:
+            with cycle.activate(), cycle.timer('process_' + feed), TransactionBatch(batch_size, cycle) as batch:
+                for day, pairs in groupby(iter_flights(r), key=itemgetter(0)):
+                    for chunk in batches((flight for _, flight in pairs), batch_size or None):
+                        flights += len(chunk)
+                        try:
+                            batch.run(cls.bulk_create_or_update_from_json, day, chunk, is_cargo=cargo == 'true', units=len(chunk))
+                        except Exception as e:
+                            cycle.error(e)
+                            for flight in chunk:
+                                try:
+                                    batch.run(cls.create_or_update_from_json, day, flight, is_cargo=cargo == 'true')
+                                except Exception as e:
+                                    print('Failed {} {}: {!r}'.format(day, flight.get('flight'), e))
+                                    cycle.error(e)
+                                    errors += 1
+        except Exception as e:
+            # The response broke off or did not parse, what was read of it is rolled back with the batch
+            print('Failed reading {} cargo={} arrival={}: {!r}'.format(date, cargo, arrival, e))
+            cycle.error(e)
+            errors += 1
+        finally:
+            r.close()
+        errors += batch.rollbacks
+
+    duration = time.time() - start
+    if not errors:
+        BackfillCheckpoint.objects.update_or_create(date=date, defaults={'flights': flights, 'duration': duration})
+    cycle.set(date=date, duration=duration)
+    return date, flights, errors, duration, cycle.as_dict()
 
 
 class Command(BaseCommand):
-    help = 'Create choose one question'
+    help = 'Backfill historical flights for a date range, resuming from completed day checkpoints'
 
+    def add_arguments(self, parser):
+        parser.add_argument('--start', default='2018-04-08', help='First date to backfill (YYYY-MM-DD)')
+        parser.add_argument('--end', help='Last date to backfill (YYYY-MM-DD), defaults to yesterday')
+        parser.add_argument('--workers', type=int, default=4, help='Number of worker processes')
+        parser.add_argument('--batch-size', type=int, default=0, help='Flights per transaction, 0 for one transaction per feed permutation')
+        parser.add_argument('--force', action='store_true', help='Re-ingest days that already have a checkpoint')
+        parser.add_argument('--metrics-file', help='Append per-day metrics as JSON lines')
+        parser.add_argument('--metrics-port', type=int, help='Serve Prometheus metrics on this port')
 
     def handle(self, *args, **options):
+        tz = pytz.timezone('Asia/Manila')
+        _date = parse(options['start']).date()
+        end = parse(options['end']).date() if options['end'] else timezone.now().astimezone(tz).date() - timedelta(days=1)
 
-        _date = parse('2018-04-08').astimezone(pytz.timezone('Asia/Manila'))
+        done = set()
+        if not options['force']:
+            done = set(BackfillCheckpoint.objects.filter(date__range=(_date, end)).values_list('date', flat=True))
 
-        while _date.date() != timezone.now().astimezone(pytz.timezone('Asia/Manila')).date():
-            start = time.time()
-            url = 'https://www.hongkongairport.com/flightinfo-rest/rest/flights?span=1&date={}&lang=en&cargo={}&arrival={}'
-            perms = product(['true', 'false'], ['true', 'false'])
-            date = _date.strftime('%Y-%m-%d')
+        dates = []
+        while _date <= end:
+            if _date not in done:
+                dates.append(_date.strftime('%Y-%m-%d'))
             _date += timedelta(days=1)
-            print('Fetching for date {}'.format(date))
-            for cargo, arrival in perms:
-                data = requests.get(url.format(date, cargo, arrival)).json()
-                cls = Arrival if arrival == 'true' else Departure
-
-                for d in data:
-                    date = d['date']
-                    for flight in d['list']:
-                        try:
-                            cls.create_or_update_from_json(date, flight, is_cargo=cargo == 'true')
-                        except:
-                            pass
-            end = time.time()
-            print('Finished {} in {}s'.format(date, end - start))
+        print('Backfilling {} days ({} already done)'.format(len(dates), len(done)))
+
+        # Workers must open their own connections rather than inherit ours.
+        connections.close_all()
+        registry = Registry(options['metrics_file'])
+        if options['metrics_port']:
+            registry.serve(options['metrics_port'])
+        start = time.time()
+        days = 0
+        total_flights = 0
+        with Pool(max(options['workers'], 1), initializer=init_worker) as pool:
+            for date, flights, errors, duration, cycle in pool.imap_unordered(partial(backfill_date, batch_size=options['batch_size']), dates):
+                registry.record(cycle)
+                days += 1
+                total_flights += flights
+                elapsed = time.time() - start
+                print('Finished {} in {:.1f}s with {} flights, {} errors, {} commits ({:.1f} days/min, {:.1f} flights/s)'.format(
+                    date, duration, flights, errors, cycle['counts'].get('commits', 0), days / elapsed * 60, total_flights / elapsed))
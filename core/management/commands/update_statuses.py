@@ -1,43 +1,42 @@
-import time
-import pytz
-from itertools import product
-from datetime import timedelta
-
 from django.core.management.base import BaseCommand
-from django.utils import timezone
-import requests
 
-from core.models import Departure, Arrival
+from core.events import check_broker
+from core.metrics import Registry
+from core.pipeline import OVERFLOW_POLICIES, Pipeline
+from core.pollers import StatusPoller
+from core.rawfeeds import RawFeedArchive
+from core.spool import Spool
 
 
 class Command(BaseCommand):
-    help = 'Create choose one question'
-
+    help = 'Poll HKIA flight statuses every 30s'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--fingerprints', help='File to persist flight fingerprints between runs')
+        parser.add_argument('--interval', type=float, default=30)
+        parser.add_argument('--batch-size', type=int, default=0, help='Flights per transaction, 0 for one transaction per feed permutation')
+        parser.add_argument('--queue-size', type=int, default=2, help='Parsed snapshots allowed to wait for the writer')
+        parser.add_argument('--overflow', choices=OVERFLOW_POLICIES, default='coalesce',
+                            help='What to do when the writer falls behind and the queue is full')
+        parser.add_argument('--spool', metavar='DIR', help='Write-ahead spool for snapshots, written to the database from there')
+        parser.add_argument('--spool-max-mb', type=int, default=512)
+        parser.add_argument('--spool-max-age', type=float, default=24, help='Hours')
+        parser.add_argument('--spool-merge', type=int, default=1,
+                            help='Spooled snapshots merged into one write when catching up, 1 writes every snapshot')
+        parser.add_argument('--archive-raw', metavar='DIR', help='Keep every raw response, compressed and deduplicated, for replay_raw_feeds')
+        parser.add_argument('--metrics-file', help='Append per-cycle metrics as JSON lines')
+        parser.add_argument('--metrics-port', type=int, help='Serve Prometheus metrics on this port')
 
     def handle(self, *args, **options):
-        while True:
-            start = time.time()
-
-            url = 'https://www.hongkongairport.com/flightinfo-rest/rest/flights?span=2&date={}&lang=en&cargo={}&arrival={}'
-            perms = product(['true', 'false'], ['true', 'false'])
-            for cargo, arrival in perms:
-                date = (timezone.now().astimezone(pytz.timezone('Asia/Manila')) - timedelta(days=1)).strftime('%Y-%m-%d')
-                while True:
-                    data = requests.get(url.format(date, cargo, arrival))
-                    if data.status_code == 200:
-                        data = data.json()
-                        break
-                    time.sleep(1)
-
-                cls = Arrival if arrival == 'true' else Departure
-
-                for d in data:
-                    date = d['date']
-                    for flight in d['list']:
-                        try:
-                            cls.create_or_update_from_json(date, flight, is_cargo=cargo == 'true', print_it=True)
-                        except:
-                            pass
-            end = time.time()
-            print('Done in {}s'.format(end - start))
-            time.sleep(30 - (30 % (end - start)))
\ No newline at end of file
+        check_broker()
+        registry = Registry(options['metrics_file'])
+        if options['metrics_port']:
+            registry.serve(options['metrics_port'])
+        spool = None
+        if options['spool']:
+            spool = Spool(options['spool'], options['spool_max_mb'] * 1024 * 1024, options['spool_max_age'] * 60 * 60)
+            print('Spool has {records} snapshot(s) waiting, {bytes} bytes'.format(**spool.backlog()))
+        archive = RawFeedArchive(options['archive_raw']) if options['archive_raw'] else None
+        poller = StatusPoller(options['fingerprints'], options['batch_size'], archive)
+        Pipeline(poller, options['interval'], options['queue_size'], options['overflow'], metrics=registry, spool=spool,
+                 spool_merge=options['spool_merge']).run()
@@ -0,0 +1,194 @@
+import json
+import threading
+import time
+from collections import Counter
+from contextlib import contextmanager
+from http.server import BaseHTTPRequestHandler, HTTPServer
+from socketserver import ThreadingMixIn
+
+from django.db import connection
+
+_local = threading.local()
+
+
+class _Server(ThreadingMixIn, HTTPServer):
+    daemon_threads = True
+
+
+class Cycle:
+    def __init__(self, job):
+        self.job = job
+        self.started = time.time()
+        self.timings = Counter()
+        self.counts = Counter()
+        self.errors = Counter()
+        self.queries = 0
+        self.query_time = 0
+        self.values = {}
+        self._lock = threading.Lock()
+
+    def time(self, name, seconds):
+        with self._lock:
+            self.timings[name] += seconds
+
+    @contextmanager
+    def timer(self, name):
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.time(name, time.perf_counter() - start)
+
+    def count(self, name, n=1):
+        with self._lock:
+            self.counts[name] += n
+
+    def error(self, e):
+        with self._lock:
+            self.errors[type(e).__name__] += 1
+
+    def set(self, **values):
+        self.values.update(values)
+
+    def _execute(self, execute, sql, params, many, context):
+        start = time.perf_counter()
+        try:
+            return execute(sql, params, many, context)
+        finally:
+            self.queries += 1
+            self.query_time += time.perf_counter() - start
+
+    @contextmanager
+    def activate(self):
+        # Makes this the cycle that count()/error() report to and times every query on this thread's connection
+        previous = getattr(_local, 'cycle', None)
+        _local.cycle = self
+        try:
+            with connection.execute_wrapper(self._execute):
+                yield self
+        finally:
+            _local.cycle = previous
+
+    def as_dict(self):
+        return dict(self.values, **{
+            'job': self.job,
+            'started': self.started,
+            'timings': dict(self.timings),
+            'counts': dict(self.counts),
+            'errors': dict(self.errors),
+            'queries': self.queries,
+            'query_time': self.query_time,
+        })
+
+
+def current():
+    return getattr(_local, 'cycle', None)
+
+
+def count(name, n=1):
+    cycle = current()
+    if cycle is not None and n:
+        cycle.count(name, n)
+
+
+def error(e):
+    cycle = current()
+    if cycle is not None:
+        cycle.error(e)
+
+
+def _escape(value):
+    return str(value).replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n')
+
+
+class Registry:
+    def __init__(self, path=None):
+        self.path = path
+        self.last = {}
+        self.totals = {}
+        self.collectors = []
+        self._lock = threading.Lock()
+
+    def record(self, cycle):
+        with self._lock:
+            self.last[cycle['job']] = cycle
+            totals = self.totals.setdefault(cycle['job'], {
+                'cycles': 0, 'missed': 0, 'queries': 0, 'query_time': 0, 'counts': Counter(), 'errors': Counter()})
+            totals['cycles'] += 1
+            totals['missed'] += cycle.get('missed', 0)
+            totals['queries'] += cycle['queries']
+            totals['query_time'] += cycle['query_time']
+            totals['counts'].update(cycle['counts'])
+            totals['errors'].update(cycle['errors'])
+            if self.path:
+                with open(self.path, 'a') as f:
+                    f.write(json.dumps(cycle, sort_keys=True) + '\n')
+
+    def collect(self, func):
+        # func returns extra (name, type, help, samples) metrics at render time
+        self.collectors.append(func)
+
+    def render(self):
+        families = {}
+
+        def metric(name, kind, help, samples):
+            # A family reported by several collectors, like pipelines sharing a registry, is written out once
+            families.setdefault(name, (kind, help, []))[2].extend(samples)
+
+        with self._lock:
+            last = sorted(self.last.items())
+            totals = sorted(self.totals.items())
+            metric('cycles_total', 'counter', 'Completed cycles', [([('job', j)], t['cycles']) for j, t in totals])
+            metric('cycle_missed_ticks_total', 'counter', 'Scheduled runs skipped because a cycle overran',
+                   [([('job', j)], t['missed']) for j, t in totals])
+            metric('db_queries_total', 'counter', 'Database queries', [([('job', j)], t['queries']) for j, t in totals])
+            metric('db_query_seconds_total', 'counter', 'Time spent in database queries',
+                   [([('job', j)], t['query_time']) for j, t in totals])
+            metric('rows_total', 'counter', 'Rows by outcome',
+                   [([('job', j), ('kind', k)], v) for j, t in totals for k, v in sorted(t['counts'].items())])
+            metric('errors_total', 'counter', 'Errors by exception type',
+                   [([('job', j), ('type', k)], v) for j, t in totals for k, v in sorted(t['errors'].items())])
+            metric('last_cycle_timestamp_seconds', 'gauge', 'Start of the last completed cycle',
+                   [([('job', j)], c['started']) for j, c in last])
+            metric('last_cycle_seconds', 'gauge', 'Duration of the last cycle',
+                   [([('job', j)], c.get('duration', 0)) for j, c in last])
+            metric('last_cycle_lag_seconds', 'gauge', 'How late the last cycle started',
+                   [([('job', j)], c.get('lag', 0)) for j, c in last])
+            metric('last_cycle_overrun', 'gauge', '1 if the last cycle ran past its next deadline',
+                   [([('job', j)], 1 if c.get('missed') else 0) for j, c in last])
+            metric('last_cycle_stage_seconds', 'gauge', 'Time per stage of the last cycle',
+                   [([('job', j), ('stage', s)], v) for j, c in last for s, v in sorted(c['timings'].items())])
+        for func in self.collectors:
+            for args in func():
+                metric(*args)
+
+        lines = []
+        for name, (kind, help, samples) in families.items():
+            lines.append('# HELP hkia_{} {}'.format(name, help))
+            lines.append('# TYPE hkia_{} {}'.format(name, kind))
+            for labels, value in samples:
+                labels = ','.join('{}="{}"'.format(k, _escape(v)) for k, v in labels)
+                lines.append('hkia_{}{} {}'.format(name, '{' + labels + '}' if labels else '', repr(float(value))))
+        return '\n'.join(lines) + '\n'
+
+    def serve(self, port, host=''):
+        registry = self
+
+        class Handler(BaseHTTPRequestHandler):
+            def do_GET(self):
+                if self.path.split('?')[0] != '/metrics':
+                    self.send_error(404)
+                    return
+                body = registry.render().encode()
+                self.send_response(200)
+                self.send_header('Content-Type', 'text/plain; version=0.0.4')
+                self.send_header('Content-Length', str(len(body)))
+                self.end_headers()
+                self.wfile.write(body)
+
+            def log_message(self, *args):
+                pass
+
+        server = _Server((host, port), Handler)
+        threading.Thread(target=server.serve_forever, daemon=True).start()
+        return server
@@ -0,0 +1,26 @@
+# Generated by Django 2.2.28 on 2026-10-18 10:13
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('core', '0027_auto_20180529_1717'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='BackfillCheckpoint',
+            fields=[
+                ('id', models.AutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('date', models.DateField(unique=True)),
+                ('flights', models.IntegerField(default=0)),
+                ('duration', models.FloatField(default=0)),
+                ('completed', models.DateTimeField(auto_now=True)),
+            ],
+            options={
+                'db_table': 'backfill_checkpoint',
+            },
+        ),
+    ]
@@ -0,0 +1,68 @@
+# Generated by Django 2.2.28 on 2026-10-18 10:15
+
+from django.db import migrations, models
+from django.db.models import OuterRef, Subquery
+from django.utils import timezone
+
+
+def populate_schedule_date(apps, schema_editor):
+    for model_name, link_name, fk in [('Departure', 'DepartureFlightNumber', 'departure'),
+                                      ('Arrival', 'ArrivalFlightNumber', 'arrival')]:
+        model = apps.get_model('core', model_name)
+        link = apps.get_model('core', link_name)
+
+        batch = []
+        for pk, schedule in model.objects.filter(schedule_date=None).values_list('pk', 'schedule').iterator():
+            batch.append(model(pk=pk, schedule_date=timezone.localtime(schedule).date()))
+            if len(batch) >= 1000:
+                model.objects.bulk_update(batch, ['schedule_date'])
+                batch = []
+        if batch:
+            model.objects.bulk_update(batch, ['schedule_date'])
+
+        link.objects.filter(schedule_date=None).update(
+            schedule_date=Subquery(model.objects.filter(pk=OuterRef(fk)).values('schedule_date')[:1])
+        )
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('core', '0028_backfillcheckpoint'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='arrival',
+            name='schedule_date',
+            field=models.DateField(blank=True, db_index=True, null=True),
+        ),
+        migrations.AddField(
+            model_name='arrivalflightnumber',
+            name='schedule_date',
+            field=models.DateField(blank=True, null=True),
+        ),
+        migrations.AddField(
+            model_name='departure',
+            name='schedule_date',
+            field=models.DateField(blank=True, db_index=True, null=True),
+        ),
+        migrations.AddField(
+            model_name='departureflightnumber',
+            name='schedule_date',
+            field=models.DateField(blank=True, null=True),
+        ),
+        migrations.RunPython(populate_schedule_date, migrations.RunPython.noop),
+        migrations.AddIndex(
+            model_name='arrivalflightnumber',
+            index=models.Index(fields=['flight_number', 'schedule_date'], name='arrival_fli_flight__cee953_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='departureflightnumber',
+            index=models.Index(fields=['flight_number', 'schedule_date'], name='departure_f_flight__07ea31_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='flightnumber',
+            index=models.Index(fields=['airline', 'number'], name='flight_numb_airline_1834fb_idx'),
+        ),
+    ]
@@ -0,0 +1,258 @@
+import gzip
+import json
+import math
+import random
+import string
+import threading
+import time
+from datetime import datetime, timedelta
+from http.server import BaseHTTPRequestHandler, HTTPServer
+from socketserver import ThreadingMixIn
+from urllib.parse import parse_qs, urlsplit
+
+# Airlines the pollers and trackers care about come first, the rest are made up
+KNOWN_AIRLINES = [
+    ('CPA', 'CX', 'Cathay Pacific'), ('HDA', 'KA', 'Cathay Dragon'), ('PAL', 'PR', 'Philippine Airlines'),
+    ('CEB', '5J', 'Cebu Pacific'), ('APG', 'Z2', 'Philippines AirAsia'), ('SIA', 'SQ', 'Singapore Airlines'),
+    ('UAE', 'EK', 'Emirates'), ('HKE', 'UO', 'Hong Kong Express'), ('CRK', 'HX', 'Hong Kong Airlines'),
+]
+KNOWN_AIRPORTS = ['HKG', 'MNL', 'CEB', 'MFM', 'DVO', 'SIN', 'BKK', 'TPE', 'NRT', 'ICN', 'PEK', 'PVG', 'SYD', 'DXB', 'LHR']
+DEPARTURE_STATUSES = [('', ''), ('BOR', 'Boarding'), ('GCL', 'Gate Closed'), ('DEP', 'Dep {}'), ('DEL', 'Delayed')]
+ARRIVAL_STATUSES = [('', ''), ('EST', 'Est at {}'), ('LAN', 'Landed {}'), ('ATG', 'At gate {}'), ('DEL', 'Delayed')]
+# south, west, north, east of the FR24 zone the poller asks for
+FEED_BOUNDS = (2.58, 99.27, 26.85, 134.69)
+HKG = (22.31, 113.91)
+
+
+def _code(rnd, n):
+    return ''.join(rnd.choice(string.ascii_uppercase) for _ in range(n))
+
+
+class MockFeeds:
+    # Synthetic HKIA and FR24 payloads, a pure function of the seed and the clock so any number of servers agree
+    def __init__(self, flights_per_day=1200, aircraft=2000, churn=0.05, cargo_share=0.25, airlines=150, airports=400, seed=0):
+        self.flights_per_day = flights_per_day
+        self.aircraft = aircraft
+        # Share of flights whose status changes every minute
+        self.churn = churn
+        self.cargo_share = cargo_share
+        self.seed = seed
+        rnd = random.Random(seed)
+        self.airlines = list(KNOWN_AIRLINES)
+        icao = {a[0] for a in self.airlines}
+        while len(self.airlines) < max(airlines, len(KNOWN_AIRLINES)):
+            code = _code(rnd, 3)
+            if code not in icao:
+                icao.add(code)
+                self.airlines.append((code, _code(rnd, 2), 'Airline ' + code))
+        self.airports = list(KNOWN_AIRPORTS)
+        codes = set(self.airports)
+        while len(self.airports) < max(airports, len(KNOWN_AIRPORTS)):
+            code = _code(rnd, 3)
+            if code not in codes:
+                codes.add(code)
+                self.airports.append(code)
+        self._days = {}
+        self._fleet = None
+        self._lock = threading.Lock()
+
+    def _random(self, *key):
+        return random.Random('/'.join(str(k) for k in (self.seed,) + key))
+
+    def _schedule(self, date, cargo, arrival):
+        key = date, cargo, arrival
+        with self._lock:
+            if key in self._days:
+                return self._days[key]
+        rnd = self._random(*key)
+        share = self.cargo_share if cargo else 1 - self.cargo_share
+        n = int(round(self.flights_per_day * share / 2))
+        flights = []
+        for i in range(n):
+            minute = i * 1440 // max(n, 1)
+            numbers = []
+            for j in range(1 + (0 if cargo else rnd.choice([0, 0, 1, 2]))):
+                icao, iata, _ = rnd.choice(self.airlines[:30] if j == 0 else self.airlines)
+                numbers.append({'no': '{} {}'.format(iata, rnd.randint(1, 9999)), 'airline': icao})
+            places = rnd.sample(self.airports[1:], rnd.choice([1, 1, 1, 2]))
+            flight = {'time': '{:02d}:{:02d}'.format(minute // 60, minute % 60), 'flight': numbers}
+            if arrival:
+                flight.update(origin=places, stand=rnd.choice(['', 'N{}'.format(rnd.randint(1, 70))]),
+                              hall=rnd.choice(['', 'A', 'B']), baggage=rnd.choice(['', str(rnd.randint(1, 16))]))
+            else:
+                flight.update(destination=places, terminal=rnd.choice(['T1', 'T1', 'T1', 'T2']),
+                              aisle=rnd.choice(['', 'A', 'BC', 'H', 'JK']), gate=str(rnd.randint(1, 80)))
+            flights.append((flight, minute, rnd.random()))
+        with self._lock:
+            self._days[key] = flights
+            # Only the days being asked for are kept
+            while len(self._days) > 32:
+                self._days.pop(next(iter(self._days)))
+        return flights
+
+    def flights(self, date, cargo, arrival, span=1, now=None):
+        now = time.time() if now is None else now
+        statuses = ARRIVAL_STATUSES if arrival else DEPARTURE_STATUSES
+        days = []
+        start = datetime.strptime(date, '%Y-%m-%d')
+        for d in range(span):
+            day = (start + timedelta(days=d)).strftime('%Y-%m-%d')
+            flights = []
+            for flight, minute, phase in self._schedule(day, cargo, arrival):
+                step = int(now / 60 * self.churn + phase * len(statuses))
+                code, status = statuses[step % len(statuses)]
+                at = (minute + 5 * (step % 7)) % 1440
+                flights.append(dict(flight, statusCode=code, status=status.format('{:02d}:{:02d}'.format(at // 60, at % 60))))
+            days.append({'date': day, 'arrival': arrival, 'cargo': cargo, 'list': flights})
+        return days
+
+    def airline_data(self):
+        rnd = self._random('reference')
+        lounges = {
+            'lounge-{}'.format(i): {
+                'name': 'Lounge {}'.format(i), 'opening-hour': '05:30 - 00:30', 'location': 'Level 6, near Gate {}'.format(i * 3),
+                'remark': '', 'telephone': [{'phone': '2{:07d}'.format(rnd.randrange(10 ** 7))}],
+                'fax': [{'fax': '2{:07d}'.format(rnd.randrange(10 ** 7))}] if i % 2 else [],
+            } for i in range(1, 31)
+        }
+        agents = {'gha-{}'.format(i): {'name': 'gha{}'.format(i), 'fullname': 'Ground Handler {}'.format(i)} for i in range(1, 9)}
+        airlines = {}
+        for icao, iata, name in self.airlines:
+            airlines[icao] = {
+                'icao-3': icao, 'iata-2': iata, 'name': name, 'all-names': [name, name + ' (TC)', name + ' (SC)'],
+                'website-url': 'https://{}.example.com'.format(icao.lower()), 'terminal': rnd.choice(['T1', 'T1', 'T2']),
+                'enquiry': [{'phone': '2{:07d}'.format(rnd.randrange(10 ** 7))}], 'reservations': [],
+                'ground-handling-agent': [rnd.choice(['gha{}'.format(i) for i in range(1, 9)])],
+                'aisle': rnd.sample('ABCDEFGHJK', rnd.randint(0, 2)), 'transfer': rnd.sample(['E1', 'E2', 'W1', 'NA'], rnd.randint(0, 2)),
+                'airline-lounge': rnd.sample(sorted(lounges), rnd.randint(0, 2)),
+            }
+        return {'airline-lounge': lounges, 'ground-handling-agent': agents, 'airline': airlines}
+
+    def airport_list(self):
+        rnd = self._random('airports')
+        return [{'code': code, 'description': ['Airport ' + code, code + ' (TC)', code + ' (SC)'],
+                 'country': rnd.choice(['HK', 'PH', 'SG', 'JP', 'CN', None])} for code in self.airports]
+
+    def airline_list(self):
+        return [{'code': icao, 'description': [name, name + ' (TC)', name + ' (SC)']} for icao, _, name in self.airlines]
+
+    def _aircraft(self):
+        with self._lock:
+            if self._fleet is None:
+                self._fleet = self._make_fleet()
+        return self._fleet
+
+    def _make_fleet(self):
+        rnd = self._random('fleet')
+        fleet = []
+        for i in range(self.aircraft):
+            icao, iata, _ = rnd.choice(self.airlines)
+            # About a third fly to or from a tracked airport like they do in the real zone
+            origin, destination = rnd.sample(self.airports, 2)
+            if rnd.random() < 0.3:
+                origin, destination = rnd.choice([(origin, 'HKG'), ('HKG', destination), (origin, 'MNL')])
+            number = rnd.randint(1, 9999)
+            fleet.append({
+                'mode_s_code': '{:06X}'.format(rnd.randrange(16 ** 6)), 'model': rnd.choice(['A333', 'A359', 'B77W', 'A321', 'B738']),
+                'registration': 'B-' + ''.join(string.ascii_uppercase[i // 26 ** k % 26] for k in range(4)), 'origin': origin, 'destination': destination,
+                'flight': '{}{}'.format(iata, number), 'callsign': '{}{}'.format(icao, number), 'squawk': '{:04d}'.format(rnd.randint(0, 7777)),
+                'radar': 'T-VHHH{}'.format(rnd.randint(1, 9)), 'latitude': rnd.uniform(FEED_BOUNDS[0], FEED_BOUNDS[2]),
+                'longitude': rnd.uniform(FEED_BOUNDS[1], FEED_BOUNDS[3]), 'bearing': rnd.randrange(360),
+                'speed': rnd.randint(420, 520), 'period': rnd.uniform(60, 240), 'offset': rnd.random(),
+            })
+        return fleet
+
+    def feed(self, now=None):
+        now = time.time() if now is None else now
+        south, west, north, east = FEED_BOUNDS
+        data = {'full_count': self.aircraft, 'version': 4}
+        for i, a in enumerate(self._aircraft()):
+            # climb, cruise, descent and time on the ground over each aircraft's own period
+            phase = (now / 60 / a['period'] + a['offset']) % 1
+            if phase < 0.1:
+                altitude, vertical_speed, speed = int(35000 * phase / 0.1), 1500, a['speed'] * 2 // 3
+            elif phase < 0.8:
+                altitude, vertical_speed, speed = 35000, 0, a['speed']
+            elif phase < 0.9:
+                altitude, vertical_speed, speed = int(35000 * (0.9 - phase) / 0.1), -1500, a['speed'] * 2 // 3
+            else:
+                altitude, vertical_speed, speed = 0, 0, 0
+            # Parked aircraft stay put, so their rows fingerprint the same from one feed to the next
+            flown = min(phase, 0.9) * a['period'] * 60 * a['speed'] / 3600 / 60
+            bearing = math.radians(a['bearing'])
+            latitude = south + (a['latitude'] - south + flown * math.cos(bearing)) % (north - south)
+            longitude = west + (a['longitude'] - west + flown * math.sin(bearing)) % (east - west)
+            if altitude == 0 and 'HKG' in (a['origin'], a['destination']):
+                latitude, longitude = HKG
+            data['{:08x}'.format(0x10000000 + i)] = [
+                a['mode_s_code'], round(latitude, 4), round(longitude, 4), a['bearing'], altitude, speed, a['squawk'],
+                a['radar'], a['model'], a['registration'], int(now) - i % 10, a['origin'], a['destination'], a['flight'],
+                int(altitude == 0), vertical_speed, a['callsign'], 0,
+            ]
+        data['stats'] = {'total': {'ads-b': self.aircraft}, 'visible': {'ads-b': self.aircraft}}
+        return data
+
+    def respond(self, path, query):
+        # (payload, or None for an unknown path)
+        if path.endswith('/flightinfo-rest/rest/flights'):
+            return self.flights(query['date'], query.get('cargo') == 'true', query.get('arrival') == 'true',
+                                int(query.get('span', 1)))
+        if path.endswith('/flightinfo-rest/rest/airports'):
+            return self.airport_list()
+        if path.endswith('/flightinfo-rest/rest/airlines'):
+            return self.airline_list()
+        if path.endswith('/airline_en.json'):
+            return self.airline_data()
+        if path.endswith('/feed.js'):
+            return self.feed()
+        return None
+
+
+class _Server(ThreadingMixIn, HTTPServer):
+    daemon_threads = True
+
+
+class MockHandler(BaseHTTPRequestHandler):
+    feeds = None
+    latency = 0
+    error_rate = 0
+
+    def log_message(self, *args):
+        pass
+
+    def do_GET(self):
+        start = time.perf_counter()
+        url = urlsplit(self.path)
+        if self.latency:
+            time.sleep(random.uniform(0.5, 1.5) * self.latency)
+        fault = random.choice(['500', '503', 'truncated']) if random.random() < self.error_rate else None
+        if fault in ['500', '503']:
+            self.send_error(int(fault))
+            print('GET {} {}'.format(url.path, fault))
+            return
+        payload = self.feeds.respond(url.path, {k: v[0] for k, v in parse_qs(url.query).items()})
+        if payload is None:
+            self.send_error(404)
+            return
+        body = json.dumps(payload, separators=(',', ':')).encode()
+        gzipped = 'gzip' in self.headers.get('Accept-Encoding', '')
+        if gzipped:
+            body = gzip.compress(body, 5)
+        self.send_response(200)
+        self.send_header('Content-Type', 'application/json')
+        self.send_header('Content-Length', str(len(body)))
+        if gzipped:
+            self.send_header('Content-Encoding', 'gzip')
+        self.end_headers()
+        if fault:
+            # The connection drops halfway through the body
+            self.wfile.write(body[:len(body) // 2])
+            self.close_connection = True
+        else:
+            self.wfile.write(body)
+        print('GET {} {} bytes{} in {:.2f}s'.format(url.path, len(body), ', truncated' if fault else '', time.perf_counter() - start))
+
+
+def serve(feeds, host='127.0.0.1', port=8080, latency=0, error_rate=0):
+    handler = type('Handler', (MockHandler,), {'feeds': feeds, 'latency': latency, 'error_rate': error_rate})
+    return _Server((host, port), handler)
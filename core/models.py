@@ -1,9 +1,13 @@
 import re
 
 from dateutil.parser import parse
-from django.db import models
+from django.db import models, transaction
+from django.db.models import Max, Prefetch, Q
 from django.utils import timezone
 
+from core import metrics
+from core.cache import dimensions
+
 
 class ShortNamedModel(models.Model):
     class Meta:
@@ -43,12 +47,14 @@ class Airport(NamedModel, ChineseNamedModel):
 
     @classmethod
     def get_by_iata(cls, iata):
-        airport = cls.objects.filter(iata=iata).first()
-        if not airport:
-            airport = cls()
-            airport.iata = iata
-            airport.save()
-        return airport
+        def load():
+            airport = cls.objects.filter(iata=iata).first()
+            if not airport:
+                airport = cls()
+                airport.iata = iata
+                airport.save()
+            return airport
+        return dimensions.get(cls, (iata,), load)
 
 
     @classmethod
@@ -76,15 +82,17 @@ class Terminal(ShortNamedModel):
     full_name = models.CharField(max_length=255, blank=True, null=True)
 
     def __str__(self):
-        return self.slug
+        return self.name
 
     @classmethod
     def get_terminal(cls, t):
-        terminal = cls.objects.filter(name=t).first()
-        if not terminal:
-            terminal = cls(name=t)
-            terminal.save()
-        return terminal
+        def load():
+            terminal = cls.objects.filter(name=t).first()
+            if not terminal:
+                terminal = cls(name=t)
+                terminal.save()
+            return terminal
+        return dimensions.get(cls, (t,), load)
 
 
 class Airline(NamedModel, ChineseNamedModel):
@@ -178,7 +186,7 @@ class Airline(NamedModel, ChineseNamedModel):
 
         for t in json.get('transfer', []):
             if t and t not in ['NA']:
-                transfer_desk = TransferDesk.get_transfer_desk(a)
+                transfer_desk = TransferDesk.get_transfer_desk(t)
                 AirlineTransferDesk.objects.get_or_create(airline=airline, transfer_desk=transfer_desk)
 
 
@@ -203,11 +211,13 @@ class Aisle(ShortNamedModel):
 
     @classmethod
     def get_aisle(cls, aisle):
-        a = cls.objects.filter(name=aisle).first()
-        if not a:
-            a = cls(name=aisle)
-            a.save()
-        return a
+        def load():
+            a = cls.objects.filter(name=aisle).first()
+            if not a:
+                a = cls(name=aisle)
+                a.save()
+            return a
+        return dimensions.get(cls, (aisle,), load)
 
 
 class AirlineAisle(models.Model):
@@ -358,6 +368,7 @@ class GroundHandling(NamedModel):
 class FlightNumber(models.Model):
     class Meta:
         db_table = 'flight_number'
+        indexes = [models.Index(fields=['airline', 'number'])]
 
     airline = models.ForeignKey('Airline', on_delete=models.CASCADE)
     airline_letters = models.CharField(max_length=2, db_index=True)
@@ -370,25 +381,32 @@ class FlightNumber(models.Model):
     def get_flight(cls, flight_no):
         flight_no_str = flight_no['no']
         flight_no_str = flight_no_str.split(' ')
-        airline = Airline.objects.filter(icao=flight_no['airline']).first()
-        if not airline:
-            airline = Airline(icao=flight_no['airline'], iata=flight_no_str[0])
-            airline.name = airline.icao
-            airline.save()
+
+        def load_airline():
+            airline = Airline.objects.filter(icao=flight_no['airline']).first()
+            if not airline:
+                airline = Airline(icao=flight_no['airline'], iata=flight_no_str[0])
+                airline.name = airline.icao
+                airline.save()
+            return airline
+        airline = dimensions.get(Airline, (flight_no['airline'],), load_airline)
         if airline.iata is None:
             airline.iata = flight_no_str[0]
             airline.save()
         number = flight_no_str[1]
-        flight_number = cls.objects.filter(airline=airline, number=number).first()
-        if not flight_number:
-            flight_number = FlightNumber(airline=airline, number=number,
-                                         number_ordering=int(re.search(r'(\d+)', number).group(1)),
-                                         airline_letters=flight_no_str[0])
-            flight_number.save()
-        return flight_number
+
+        def load():
+            flight_number = cls.objects.filter(airline=airline, number=number).first()
+            if not flight_number:
+                flight_number = FlightNumber(airline=airline, number=number,
+                                             number_ordering=int(re.search(r'(\d+)', number).group(1)),
+                                             airline_letters=flight_no_str[0])
+                flight_number.save()
+            return flight_number
+        return dimensions.get(cls, (airline.pk, number), load)
 
     def __str__(self):
-        return '{} {}'.format(self.airline.iata, self.number)
+        return '{} {}'.format(self.airline_letters, self.number)
 
 
 class Gate(ShortNamedModel):
@@ -400,7 +418,7 @@ class Gate(ShortNamedModel):
 
     @classmethod
     def get_gate(cls, gate):
-        return Gate.objects.get_or_create(name=gate)[0]
+        return dimensions.get(cls, (gate,), lambda: Gate.objects.get_or_create(name=gate)[0])
 
 
 class Stand(ShortNamedModel):
@@ -412,7 +430,7 @@ class Stand(ShortNamedModel):
 
     @classmethod
     def get_stand(cls, stand):
-        return Stand.objects.get_or_create(name=stand)[0]
+        return dimensions.get(cls, (stand,), lambda: Stand.objects.get_or_create(name=stand)[0])
 
 
 class BaggageReclaim(ShortNamedModel):
@@ -421,7 +439,8 @@ class BaggageReclaim(ShortNamedModel):
 
     @classmethod
     def get_baggage_reclaim(cls, baggage_reclaim):
-        return BaggageReclaim.objects.get_or_create(name=baggage_reclaim)[0]
+        return dimensions.get(
+            cls, (baggage_reclaim,), lambda: BaggageReclaim.objects.get_or_create(name=baggage_reclaim)[0])
 
 
 class Hall(ShortNamedModel):
@@ -430,7 +449,7 @@ class Hall(ShortNamedModel):
 
     @classmethod
     def get_hall(cls, hall):
-        return Hall.objects.get_or_create(name=hall)[0]
+        return dimensions.get(cls, (hall,), lambda: Hall.objects.get_or_create(name=hall)[0])
 
 
 class Departure(models.Model):
@@ -443,6 +462,7 @@ class Departure(models.Model):
     aisles = models.ManyToManyField('Aisle', through='DepartureAisle')
     gate = models.ForeignKey('Gate', blank=True, null=True, on_delete=models.CASCADE)
     schedule = models.DateTimeField(db_index=True)
+    schedule_date = models.DateField(blank=True, null=True, db_index=True)
     actual = models.DateTimeField(blank=True, null=True)
     latest_status = models.ForeignKey('DepartureStatus', related_name='latest', on_delete=models.CASCADE, blank=True, null=True)
     is_cargo = models.BooleanField(default=False)
@@ -450,14 +470,11 @@ class Departure(models.Model):
     @classmethod
     def create_or_update_from_json(cls, date, json, is_cargo=False, print_it=False):
         created = False
-        departure_flight_number = DepartureFlightNumber.objects.filter(
-            departure__schedule__date=date,
-            flight_number__airline__icao=json['flight'][0]['airline'],
-            flight_number__number=json['flight'][0]['no'].split(' ')[-1]
-        ).select_related('departure__latest_status', 'departure__terminal', 'departure__gate').distinct().first()
+        departure_flight_number = DepartureFlightNumber.lookup(date, json['flight'][0]).select_related('departure__latest_status', 'departure__terminal', 'departure__gate').order_by('pk').first()
         if departure_flight_number:
             departure = departure_flight_number.departure
             if departure.latest_status and departure.latest_status.status_code == 'DA':
+                metrics.count('flights_final')
                 return departure
         else:
             departure = Departure()
@@ -469,15 +486,36 @@ class Departure(models.Model):
         if departure.gate is None and gate:
             departure.gate = Gate.get_gate(gate)
         departure.schedule = timezone.make_aware(parse(date + ' ' + json.get('time')))
+        departure.schedule_date = departure.schedule.date()
         departure.is_cargo = is_cargo
-        departure.save()
+
+        status = json.get('status')
+        status_code = json.get('statusCode')
+        latest_status = departure.latest_status
+        new_status = None
+        if status and (not latest_status or latest_status.status != status or latest_status.status_code != status_code):
+            new_status = DepartureStatus(status_code=status_code, status=status)
+
+        with transaction.atomic():
+            if created:
+                departure.save()
+            if new_status:
+                new_status.departure = departure
+                new_status.save()
+                departure.latest_status = new_status
+            if not created:
+                departure.save()
+            elif new_status:
+                # The status needs the flight's id and the flight points back at the status, so only a new flight
+                # takes a second, pointer-only write
+                departure.save(update_fields=['latest_status'])
         if created:
             for i, flight_no in enumerate(json.get('flight'), start=1):
                 flight_number = FlightNumber.get_flight(flight_no)
                 DepartureFlightNumber.objects.get_or_create(
                     departure=departure,
                     flight_number=flight_number,
-                    defaults={'order': i}
+                    defaults={'order': i, 'schedule_date': departure.schedule_date}
                 )
             for destination in json.get('destination'):
                 destination = Airport.get_by_iata(destination)
@@ -489,37 +527,79 @@ class Departure(models.Model):
             aisle = Aisle.get_aisle(aisle)
             DepartureAisle.objects.get_or_create(departure=departure, aisle=aisle)
 
-        status = json.get('status')
-        status_code = json.get('statusCode')
+        metrics.count('flights_created' if created else 'flights_updated')
+        if new_status:
+            metrics.count('statuses_created')
+            transaction.on_commit(lambda: status_update_callback([new_status]))
+            if print_it:
+                print(new_status)
+        return departure
 
-        latest_status: DepartureStatus = departure.statuses.order_by('-created').first()
-        if status and (not latest_status or latest_status.status != status or latest_status.status_code != status_code):
-                d = DepartureStatus(
-                    departure=departure,
-                    status_code=status_code,
-                    status=status
-                )
-                d.save()
-                departure.latest_status = d
-                departure.save()
-                if print_it:
-                    print(d)
+    @classmethod
+    def bulk_create_or_update_from_json(cls, date, flights, is_cargo=False, print_it=False):
+        from core.ingest import DepartureIngestor
+        return DepartureIngestor(date, is_cargo=is_cargo).ingest(flights, print_it=print_it)
 
-        return departure
+    @classmethod
+    def board(cls, date, terminal=None, airline=None, status=None):
+        flights = cls.objects.filter(schedule_date=date).select_related('latest_status', 'terminal', 'gate').prefetch_related(
+            Prefetch('departureflightnumber_set', queryset=DepartureFlightNumber.objects.select_related('flight_number__airline').order_by('order')),
+            Prefetch('departuredestination_set', queryset=DepartureDestination.objects.select_related('destination').order_by('pk')),
+            Prefetch('aisles', queryset=Aisle.objects.order_by('name')),
+        ).order_by('schedule', 'pk')
+        if terminal:
+            flights = flights.filter(terminal__name=terminal)
+        if airline:
+            flights = flights.filter(pk__in=DepartureFlightNumber.objects.filter(
+                Q(flight_number__airline__icao=airline) | Q(flight_number__airline_letters=airline), schedule_date=date
+            ).values('departure'))
+        if status:
+            flights = flights.filter(latest_status__status_code=status)
+        return flights
+
+    @classmethod
+    def last_changed(cls, date):
+        return DepartureStatus.objects.filter(departure__schedule_date=date).aggregate(last=Max('created'))['last']
+
+    def to_json(self):
+        return {
+            'id': self.pk,
+            'time': timezone.localtime(self.schedule).strftime('%H:%M'),
+            'schedule': self.schedule,
+            'flight': [{'no': '{} {}'.format(f.flight_number.airline_letters, f.flight_number.number),
+                        'airline': f.flight_number.airline.icao} for f in self.departureflightnumber_set.all()],
+            'destination': [d.destination.iata for d in self.departuredestination_set.all()],
+            'terminal': self.terminal.name if self.terminal else None,
+            'aisle': ''.join(a.name for a in self.aisles.all()),
+            'gate': self.gate.name if self.gate else None,
+            'status': self.latest_status.status if self.latest_status else None,
+            'statusCode': self.latest_status.status_code if self.latest_status else None,
+            'cargo': self.is_cargo,
+        }
 
     def __str__(self):
-        text = 'DEP: {} {}'.format(self.schedule.strftime('%m/%d %H:%M'), ", ".join(str(_) for _ in self.flight_numbers.all()))
-        return text
+        from core.display import describe
+        return describe(self)
 
 
 class DepartureFlightNumber(models.Model):
     class Meta:
         db_table = 'departure_flight_number'
         unique_together = ['departure', 'flight_number']
+        indexes = [models.Index(fields=['flight_number', 'schedule_date'])]
 
     departure = models.ForeignKey('Departure', on_delete=models.CASCADE)
     flight_number = models.ForeignKey('FlightNumber', on_delete=models.CASCADE)
     order = models.IntegerField(default=1)
+    schedule_date = models.DateField(blank=True, null=True)
+
+    @classmethod
+    def lookup(cls, date, flight_no):
+        return cls.objects.filter(
+            schedule_date=date,
+            flight_number__airline__icao=flight_no['airline'],
+            flight_number__number=flight_no['no'].split(' ')[-1]
+        )
 
 
 class DepartureAisle(models.Model):
@@ -563,6 +643,7 @@ class Arrival(models.Model):
     baggage_reclaim = models.ForeignKey('BaggageReclaim', related_name='arrivals', on_delete=models.CASCADE, blank=True, null=True)
     hall = models.ForeignKey('Hall', blank=True, null=True, on_delete=models.CASCADE)
     schedule = models.DateTimeField(db_index=True)
+    schedule_date = models.DateField(blank=True, null=True, db_index=True)
     actual = models.DateTimeField(blank=True, null=True)
     latest_status = models.ForeignKey('ArrivalStatus', related_name='latest', on_delete=models.CASCADE, blank=True, null=True)
     is_cargo = models.BooleanField(default=False)
@@ -570,14 +651,11 @@ class Arrival(models.Model):
     @classmethod
     def create_or_update_from_json(cls, date, json, is_cargo=False, print_it=False):
         created = False
-        arrival_flight_number = ArrivalFlightNumber.objects.filter(
-            arrival__schedule__date=date,
-            flight_number__airline__icao=json['flight'][0]['airline'],
-            flight_number__number=json['flight'][0]['no'].split(' ')[-1]
-        ).select_related('arrival__latest_status', 'arrival__hall', 'arrival__stand', 'arrival__baggage_reclaim').distinct().first()
+        arrival_flight_number = ArrivalFlightNumber.lookup(date, json['flight'][0]).select_related('arrival__latest_status', 'arrival__hall', 'arrival__stand', 'arrival__baggage_reclaim').order_by('pk').first()
         if arrival_flight_number:
             arrival = arrival_flight_number.arrival
             if arrival.latest_status and arrival.latest_status.status_code == 'ON':
+                metrics.count('flights_final')
                 return arrival
         else:
             arrival = Arrival()
@@ -592,15 +670,36 @@ class Arrival(models.Model):
         if arrival.baggage_reclaim is None and baggage_reclaim:
             arrival.baggage_reclaim = BaggageReclaim.get_baggage_reclaim(baggage_reclaim)
         arrival.schedule = timezone.make_aware(parse(date + ' ' + json.get('time')))
+        arrival.schedule_date = arrival.schedule.date()
         arrival.is_cargo = is_cargo
-        arrival.save()
+
+        status = json.get('status')
+        status_code = json.get('statusCode')
+        latest_status = arrival.latest_status
+        new_status = None
+        if status and (not latest_status or latest_status.status != status or latest_status.status_code != status_code):
+            new_status = ArrivalStatus(status_code=status_code, status=status)
+
+        with transaction.atomic():
+            if created:
+                arrival.save()
+            if new_status:
+                new_status.arrival = arrival
+                new_status.save()
+                arrival.latest_status = new_status
+            if not created:
+                arrival.save()
+            elif new_status:
+                # The status needs the flight's id and the flight points back at the status, so only a new flight
+                # takes a second, pointer-only write
+                arrival.save(update_fields=['latest_status'])
         if created:
             for i, flight_no in enumerate(json.get('flight'), start=1):
                 flight_number = FlightNumber.get_flight(flight_no)
                 ArrivalFlightNumber.objects.get_or_create(
                     arrival=arrival,
                     flight_number=flight_number,
-                    defaults={'order': i}
+                    defaults={'order': i, 'schedule_date': arrival.schedule_date}
                 )
             for origin in json.get('origin'):
                 origin = Airport.get_by_iata(origin)
@@ -609,36 +708,80 @@ class Arrival(models.Model):
                     origin=origin
                 )
 
-        status = json.get('status')
-        status_code = json.get('statusCode')
-
-        latest_status: ArrivalStatus = arrival.statuses.order_by('-created').first()
-        if status and (not latest_status or latest_status.status != status or latest_status.status_code != status_code):
-                d = ArrivalStatus(
-                    arrival=arrival,
-                    status_code=status_code,
-                    status=status
-                )
-                d.save()
-                arrival.latest_status = d
-                arrival.save()
-                if print_it:
-                    print(d)
+        metrics.count('flights_created' if created else 'flights_updated')
+        if new_status:
+            metrics.count('statuses_created')
+            transaction.on_commit(lambda: status_update_callback([new_status]))
+            if print_it:
+                print(new_status)
         return arrival
 
+    @classmethod
+    def bulk_create_or_update_from_json(cls, date, flights, is_cargo=False, print_it=False):
+        from core.ingest import ArrivalIngestor
+        return ArrivalIngestor(date, is_cargo=is_cargo).ingest(flights, print_it=print_it)
+
+    @classmethod
+    def board(cls, date, terminal=None, airline=None, status=None):
+        flights = cls.objects.filter(schedule_date=date).select_related('latest_status', 'stand', 'hall', 'baggage_reclaim').prefetch_related(
+            Prefetch('arrivalflightnumber_set', queryset=ArrivalFlightNumber.objects.select_related('flight_number__airline').order_by('order')),
+            Prefetch('arrivalorigin_set', queryset=ArrivalOrigin.objects.select_related('origin').order_by('pk')),
+        ).order_by('schedule', 'pk')
+        if terminal:
+            flights = flights.filter(pk__in=ArrivalFlightNumber.objects.filter(
+                flight_number__airline__terminal__name=terminal, schedule_date=date, order=1
+            ).values('arrival'))
+        if airline:
+            flights = flights.filter(pk__in=ArrivalFlightNumber.objects.filter(
+                Q(flight_number__airline__icao=airline) | Q(flight_number__airline_letters=airline), schedule_date=date
+            ).values('arrival'))
+        if status:
+            flights = flights.filter(latest_status__status_code=status)
+        return flights
+
+    @classmethod
+    def last_changed(cls, date):
+        return ArrivalStatus.objects.filter(arrival__schedule_date=date).aggregate(last=Max('created'))['last']
+
+    def to_json(self):
+        return {
+            'id': self.pk,
+            'time': timezone.localtime(self.schedule).strftime('%H:%M'),
+            'schedule': self.schedule,
+            'flight': [{'no': '{} {}'.format(f.flight_number.airline_letters, f.flight_number.number),
+                        'airline': f.flight_number.airline.icao} for f in self.arrivalflightnumber_set.all()],
+            'origin': [o.origin.iata for o in self.arrivalorigin_set.all()],
+            'stand': self.stand.name if self.stand else None,
+            'hall': self.hall.name if self.hall else None,
+            'baggage': self.baggage_reclaim.name if self.baggage_reclaim else None,
+            'status': self.latest_status.status if self.latest_status else None,
+            'statusCode': self.latest_status.status_code if self.latest_status else None,
+            'cargo': self.is_cargo,
+        }
+
     def __str__(self):
-        text = 'ARR: {} {}'.format(self.schedule.strftime('%m/%d %H:%M'), ", ".join(str(_) for _ in self.flight_numbers.all()))
-        return text
+        from core.display import describe
+        return describe(self)
 
 
 class ArrivalFlightNumber(models.Model):
     class Meta:
         db_table = 'arrival_flight_number'
         unique_together = ['arrival', 'flight_number']
+        indexes = [models.Index(fields=['flight_number', 'schedule_date'])]
 
     arrival = models.ForeignKey('Arrival', on_delete=models.CASCADE)
     flight_number = models.ForeignKey('FlightNumber', on_delete=models.CASCADE)
     order = models.IntegerField(default=1)
+    schedule_date = models.DateField(blank=True, null=True)
+
+    @classmethod
+    def lookup(cls, date, flight_no):
+        return cls.objects.filter(
+            schedule_date=date,
+            flight_number__airline__icao=flight_no['airline'],
+            flight_number__number=flight_no['no'].split(' ')[-1]
+        )
 
 
 class ArrivalOrigin(models.Model):
@@ -663,7 +806,32 @@ class ArrivalStatus(models.Model):
         return '{}: {}'.format(self.arrival, self.status)
 
 
-def status_update_callback(status):
-    if status.status_code in ['LA', '']:
-        pass
+class BackfillCheckpoint(models.Model):
+    class Meta:
+        db_table = 'backfill_checkpoint'
+
+    date = models.DateField(unique=True)
+    flights = models.IntegerField(default=0)
+    duration = models.FloatField(default=0)
+    completed = models.DateTimeField(auto_now=True)
+
+    def __str__(self):
+        return '{}: {} flights'.format(self.date, self.flights)
+
+
+dimensions.register(Airport, 'iata')
+dimensions.register(Airline, 'icao')
+dimensions.register(Terminal, 'name')
+dimensions.register(Gate, 'name')
+dimensions.register(Stand, 'name')
+dimensions.register(Hall, 'name')
+dimensions.register(Aisle, 'name')
+dimensions.register(TransferDesk, 'name')
+dimensions.register(BaggageReclaim, 'name')
+dimensions.register(FlightNumber, 'airline_id', 'number')
+
+
+def status_update_callback(statuses):
+    from core.events import publish_statuses
+    publish_statuses(statuses)
 
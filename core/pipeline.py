@@ -0,0 +1,306 @@
+import signal
+import threading
+import time
+from collections import Counter, deque
+
+from django.db import close_old_connections, connection
+
+from core.metrics import Cycle
+
+OVERFLOW_POLICIES = ['block', 'drop-oldest', 'coalesce']
+# Errors that mean the database, not the data, is the problem, so a spooled snapshot is kept for a retry
+CONNECTION_ERRORS = ['OperationalError', 'InterfaceError']
+MAX_BACKOFF = 60
+
+
+class Closed(Exception):
+    pass
+
+
+class SnapshotQueue:
+    def __init__(self, name, maxsize=1, overflow='block'):
+        self.name = name
+        self.maxsize = maxsize
+        self.overflow = overflow
+        self.items = deque()
+        self.dropped = 0
+        self.coalesced = 0
+        self.max_depth = 0
+        self.closed = False
+        self._cond = threading.Condition()
+
+    def depth(self):
+        return len(self.items)
+
+    def put(self, cycle, snapshot):
+        with self._cond:
+            while len(self.items) >= self.maxsize and not self.closed:
+                if self.overflow == 'block':
+                    # Backpressure, the producer waits for the consumer
+                    self._cond.wait()
+                elif self.overflow == 'drop-oldest':
+                    old_cycle, _ = self.items.popleft()
+                    self.dropped += 1
+                    cycle.count('snapshots_dropped', 1 + old_cycle.counts['snapshots_dropped'])
+                else:
+                    # Merge into the newest waiting snapshot, keyed per flight so the newest value wins
+                    old_cycle, old = self.items.pop()
+                    old.update(snapshot)
+                    snapshot = old
+                    self.coalesced += 1
+                    cycle.count('snapshots_coalesced', 1 + old_cycle.counts['snapshots_coalesced'])
+            if self.closed:
+                raise Closed()
+            self.items.append((cycle, snapshot))
+            self.max_depth = max(self.max_depth, len(self.items))
+            self._cond.notify_all()
+
+    def get(self):
+        with self._cond:
+            while not self.items and not self.closed:
+                self._cond.wait()
+            if not self.items:
+                raise Closed()
+            item = self.items.popleft()
+            self._cond.notify_all()
+            return item
+
+    def close(self):
+        with self._cond:
+            self.closed = True
+            self._cond.notify_all()
+
+
+class Pipeline:
+    # fetch -> parse/normalize -> write, each on its own thread so a slow database write never delays the next fetch
+    stages = ['fetch', 'parse', 'write']
+
+    def __init__(self, poller, interval, queue_size=2, overflow='coalesce', metrics=None, spool=None, spool_merge=1):
+        self.poller = poller
+        self.spool = spool
+        # Spooled snapshots merged into one write, 1 replays every snapshot as it was fetched
+        self.spool_merge = spool_merge
+        self.name = poller.name
+        self.interval = interval
+        self.metrics = metrics
+        # Raw responses may still be streaming off the socket, so they are never merged or dropped
+        self.fetched = SnapshotQueue('fetched', 1, 'block')
+        self.normalized = SnapshotQueue('normalized', queue_size, overflow)
+        self.counts = {stage: Counter() for stage in self.stages}
+        self.started = time.time()
+        self.stopping = threading.Event()
+        if metrics:
+            metrics.collect(self.samples)
+
+    def done(self, stage, started, items=None):
+        counts = self.counts[stage]
+        counts['snapshots'] += 1
+        counts['busy'] += time.perf_counter() - started
+        if items is not None:
+            counts['items'] += items
+
+    def fetch_loop(self):
+        deadline = time.monotonic()
+        while not self.stopping.is_set():
+            lag = time.monotonic() - deadline
+            cycle = Cycle(self.name)
+            cycle.set(lag=lag, interval=self.interval)
+            started = time.perf_counter()
+            try:
+                with cycle.timer('fetch_stage'):
+                    data = self.poller.fetch(cycle)
+                self.done('fetch', started)
+                with cycle.timer('fetch_blocked'):
+                    self.fetched.put(cycle, data)
+            except Closed:
+                # Also raised by a poller that has nothing left to fetch, what was fetched still gets written
+                self.fetched.close()
+                return
+            except Exception as e:
+                cycle.error(e)
+                self.counts['fetch']['failures'] += 1
+                self.finish(cycle, 'fetch failed: {!r}'.format(e))
+
+            deadline += self.interval
+            now = time.monotonic()
+            if self.interval and now > deadline:
+                missed = int((now - deadline) // self.interval) + 1
+                self.counts['fetch']['missed'] += missed
+                cycle.set(missed=missed)
+                deadline += missed * self.interval
+            self.stopping.wait(max(0, deadline - time.monotonic()))
+
+    def parse_loop(self):
+        while True:
+            try:
+                cycle, data = self.fetched.get()
+            except Closed:
+                return
+            started = time.perf_counter()
+            try:
+                with cycle.timer('parse_stage'):
+                    snapshot = self.poller.normalize(data, cycle)
+                self.done('parse', started, len(snapshot))
+                with cycle.timer('parse_blocked'):
+                    if self.spool:
+                        self.spool.append(cycle.started, dict(cycle.as_dict(), snapshot=snapshot))
+                    else:
+                        self.normalized.put(cycle, snapshot)
+            except Closed:
+                return
+            except Exception as e:
+                cycle.error(e)
+                self.counts['parse']['failures'] += 1
+                self.finish(cycle, 'parse failed: {!r}'.format(e))
+
+    def write_loop(self):
+        if self.spool:
+            return self.drain()
+        while True:
+            try:
+                cycle, snapshot = self.normalized.get()
+            except Closed:
+                return
+            self.write(cycle, snapshot)
+
+    def write(self, cycle, snapshot):
+        # True unless the database itself failed
+        started = time.perf_counter()
+        before = sum(cycle.errors[e] for e in CONNECTION_ERRORS)
+        close_old_connections()
+        try:
+            connection.ensure_connection()
+            with cycle.activate(), cycle.timer('write_stage'):
+                summary = self.poller.write(snapshot, cycle)
+        except Exception as e:
+            cycle.error(e)
+            self.counts['write']['failures'] += 1
+            summary = 'write failed: {!r}'.format(e)
+        finally:
+            close_old_connections()
+        self.done('write', started, len(snapshot))
+        self.finish(cycle, summary)
+        return sum(cycle.errors[e] for e in CONNECTION_ERRORS) == before
+
+    def restore(self, records):
+        # Spooled snapshots in order, merged per flight or aircraft when more than one is written at once
+        cycle = Cycle(self.name)
+        snapshot = {}
+        for _, _, record in records:
+            snapshot.update(record['snapshot'])
+        last = records[-1][2]
+        cycle.started = last['started']
+        cycle.timings.update(last['timings'])
+        cycle.counts.update(last['counts'])
+        cycle.errors.update(last['errors'])
+        cycle.set(**{k: last[k] for k in ['lag', 'interval', 'missed'] if k in last})
+        if len(records) > 1:
+            cycle.count('snapshots_coalesced', len(records) - 1)
+        return cycle, snapshot
+
+    def drain(self, until_empty=False):
+        # The spool is replayed in order and a record is only acknowledged once its write went through,
+        # so a slow or missing database only grows the backlog and never holds up fetching
+        backoff = 1
+        while not self.normalized.closed:
+            if not self.spool.wait(1):
+                if until_empty:
+                    return
+                continue
+            records = self.spool.read(self.spool_merge)
+            if not records:
+                continue
+            cycle, snapshot = self.restore(records)
+            if self.write(cycle, snapshot):
+                self.spool.ack(records[-1][0], len(records))
+                backoff = 1
+            else:
+                print('[{}] database unavailable, {} snapshot(s) spooled, retrying in {}s'.format(
+                    self.name, self.spool.pending, backoff))
+                self.stopping.wait(backoff)
+                backoff = min(backoff * 2, MAX_BACKOFF)
+
+    def finish(self, cycle, summary):
+        duration = time.time() - cycle.started
+        cycle.set(duration=duration)
+        merged = cycle.counts['snapshots_coalesced'] + cycle.counts['snapshots_dropped']
+        print('[{}] {} in {:.2f}s{} (queued: {} fetched, {} {})'.format(
+            self.name, summary, duration, ', {} snapshot(s) merged or dropped'.format(merged) if merged else '',
+            self.fetched.depth(), self.spool.pending if self.spool else self.normalized.depth(),
+            'spooled' if self.spool else 'normalized'))
+        if self.metrics:
+            self.metrics.record(cycle.as_dict())
+
+    def stats(self):
+        elapsed = max(time.time() - self.started, 1e-9)
+        stats = {}
+        for stage in self.stages:
+            counts = self.counts[stage]
+            stats[stage] = dict(counts, per_second=counts['items' if stage != 'fetch' else 'snapshots'] / elapsed)
+        for queue in [self.fetched, self.normalized]:
+            stats[queue.name] = {'depth': queue.depth(), 'max_depth': queue.max_depth,
+                                 'dropped': queue.dropped, 'coalesced': queue.coalesced}
+        if self.spool:
+            stats['spool'] = self.spool.backlog()
+        return stats
+
+    def samples(self):
+        job = [('job', self.name)]
+        queues = [self.fetched, self.normalized]
+        samples = []
+        if self.spool:
+            backlog = self.spool.backlog()
+            samples = [
+                ('spool_backlog_snapshots', 'gauge', 'Snapshots spooled but not yet written', [(job, backlog['records'])]),
+                ('spool_backlog_bytes', 'gauge', 'Size of the unwritten part of the spool', [(job, backlog['bytes'])]),
+                ('spool_oldest_age_seconds', 'gauge', 'Age of the oldest unwritten snapshot', [(job, backlog['oldest_age'])]),
+                ('spool_dropped_total', 'counter', 'Spooled snapshots dropped by the size or age bound', [(job, backlog['dropped'])]),
+                ('spool_corrupt_total', 'counter', 'Torn or corrupt spool frames skipped', [(job, backlog['corrupt'])]),
+            ]
+        return samples + [
+            ('pipeline_queue_depth', 'gauge', 'Snapshots waiting between stages',
+             [(job + [('queue', q.name)], q.depth()) for q in queues]),
+            ('pipeline_queue_max_depth', 'gauge', 'Most snapshots ever waiting between stages',
+             [(job + [('queue', q.name)], q.max_depth) for q in queues]),
+            ('pipeline_queue_overflow_total', 'counter', 'Snapshots merged or dropped because a queue was full',
+             [(job + [('queue', q.name), ('policy', 'coalesce')], q.coalesced) for q in queues] +
+             [(job + [('queue', q.name), ('policy', 'drop-oldest')], q.dropped) for q in queues]),
+            ('pipeline_stage_snapshots_total', 'counter', 'Snapshots handled per stage',
+             [(job + [('stage', s)], self.counts[s]['snapshots']) for s in self.stages]),
+            ('pipeline_stage_items_total', 'counter', 'Flights handled per stage',
+             [(job + [('stage', s)], self.counts[s]['items']) for s in self.stages[1:]]),
+            ('pipeline_stage_busy_seconds_total', 'counter', 'Time each stage spent working rather than waiting',
+             [(job + [('stage', s)], self.counts[s]['busy']) for s in self.stages]),
+            ('pipeline_stage_failures_total', 'counter', 'Failed snapshots per stage',
+             [(job + [('stage', s)], self.counts[s]['failures']) for s in self.stages]),
+        ]
+
+    def stop(self, *args):
+        self.stopping.set()
+        self.fetched.close()
+
+    def run(self):
+        threads = [
+            threading.Thread(target=self.fetch_loop, name=self.name + '-fetch', daemon=True),
+            threading.Thread(target=self.parse_loop, name=self.name + '-parse'),
+            threading.Thread(target=self.write_loop, name=self.name + '-write'),
+        ]
+        for thread in threads:
+            thread.start()
+        previous = signal.signal(signal.SIGTERM, self.stop)
+        try:
+            while threads[1].is_alive():
+                threads[1].join(1)
+        except KeyboardInterrupt:
+            self.stop()
+            threads[1].join()
+        finally:
+            signal.signal(signal.SIGTERM, previous)
+        # Let the writer drain what was already parsed, a spool keeps it on disk for the next run instead
+        self.normalized.close()
+        if self.spool:
+            self.spool.wake()
+        threads[2].join()
+        for name, stats in self.stats().items():
+            print('[{}] {}: {}'.format(self.name, name, ', '.join(
+                '{} {:.2f}'.format(k, v) if isinstance(v, float) else '{} {}'.format(k, v) for k, v in sorted(stats.items()))))
@@ -0,0 +1,159 @@
+from datetime import timedelta
+from functools import partial
+from itertools import product
+
+import pytz
+from django.conf import settings
+from django.utils import timezone
+
+from core.batch import TransactionBatch
+from core.cache import dimensions
+from core.fetch import Fetcher
+from core.fingerprints import FlightFingerprints
+from core.models import Arrival, Departure
+from core.reference import ReferenceSync
+from core.streaming import batches, iter_flights
+
+HKIA_BASE_URL = getattr(settings, 'HKIA_BASE_URL', 'https://www.hongkongairport.com').rstrip('/')
+STATUS_URL = HKIA_BASE_URL + '/flightinfo-rest/rest/flights?span=2&date={}&lang=en&cargo={}&arrival={}'
+AIRLINE_DATA_URL = HKIA_BASE_URL + '/iwov-resources/custom/json/airline_en.json'
+AIRPORTS_URL = HKIA_BASE_URL + '/flightinfo-rest/rest/airports'
+AIRLINES_URL = HKIA_BASE_URL + '/flightinfo-rest/rest/airlines'
+PERMUTATIONS = list(product(['true', 'false'], ['true', 'false']))
+
+
+def feed_name(cargo, arrival):
+    return '{}_{}'.format('cargo' if cargo == 'true' else 'passenger', 'arrival' if arrival == 'true' else 'departure')
+
+
+def status_date():
+    return (timezone.now().astimezone(pytz.timezone('Asia/Manila')) - timedelta(days=1)).strftime('%Y-%m-%d')
+
+
+def keyed_flights(cargo, arrival, flights):
+    # Keyed per flight so that snapshots waiting for the writer can be merged, newest flight wins
+    return {
+        FlightFingerprints.key(date, arrival == 'true', cargo == 'true', flight): (cargo, arrival, date, flight)
+        for date, flight in flights
+    }
+
+
+def parse_flights(cargo, arrival, r):
+    return keyed_flights(cargo, arrival, iter_flights(r))
+
+
+def fetch_permutations(fetcher, url, date, cycle, archive=None, parse=None):
+    futures = []
+    for cargo, arrival in PERMUTATIONS:
+        feed_parse = parse or partial(parse_flights, cargo, arrival)
+        if archive:
+            feed_parse = archive.recording(feed_parse, 'statuses', feed_name(cargo, arrival), cycle.started)
+        futures.append(fetcher.submit_timed(url.format(date, cargo, arrival), feed_parse))
+    results = []
+    for (cargo, arrival), future in zip(PERMUTATIONS, futures):
+        data, fetch_time, parse_time = future.result()
+        feed = feed_name(cargo, arrival)
+        cycle.time('fetch_' + feed, fetch_time)
+        cycle.time('parse_' + feed, parse_time)
+        results.append((cargo, arrival, data))
+    return results
+
+
+class StatusPoller:
+    name = 'statuses'
+
+    def __init__(self, fingerprints=None, batch_size=0, archive=None):
+        dimensions.enable()
+        self.fingerprints = FlightFingerprints(fingerprints)
+        self.fetcher = Fetcher(retries=3)
+        self.batch_size = batch_size
+        self.archive = archive
+
+    def fetch(self, cycle):
+        return fetch_permutations(self.fetcher, STATUS_URL, status_date(), cycle, self.archive)
+
+    def replay(self, responses):
+        # Archived responses by feed name, parsed the way fetch() parses live ones
+        results = []
+        for cargo, arrival in PERMUTATIONS:
+            r = responses.get(feed_name(cargo, arrival))
+            if r is not None:
+                try:
+                    results.append((cargo, arrival, parse_flights(cargo, arrival, r)))
+                finally:
+                    r.close()
+        return results
+
+    def forget(self, date, arrival, cargo, flights):
+        for flight in flights:
+            self.fingerprints.forget(date, arrival, cargo, flight)
+
+    def normalize(self, results, cycle):
+        flights = {}
+        for _, _, keyed in results:
+            flights.update(keyed)
+        return flights
+
+    def write(self, flights, cycle):
+        permutations = {}
+        for cargo, arrival, date, flight in flights.values():
+            permutations.setdefault((cargo, arrival), {}).setdefault(date, []).append(flight)
+
+        commits = 0
+        for (cargo, arrival), days in permutations.items():
+            cls = Arrival if arrival == 'true' else Departure
+
+            # One transaction per feed permutation, or every batch_size flights
+            with TransactionBatch(self.batch_size, cycle) as batch:
+                for date, day in days.items():
+                    flights = self.fingerprints.changed(date, arrival == 'true', cargo == 'true', day)
+                    cycle.count('flights_skipped', len(day) - len(flights))
+                    for chunk in batches(flights, self.batch_size or len(flights) or 1):
+                        try:
+                            batch.run(cls.bulk_create_or_update_from_json, date, chunk, is_cargo=cargo == 'true', print_it=True,
+                                      units=len(chunk), undo=partial(self.forget, date, arrival == 'true', cargo == 'true', chunk))
+                        except Exception as e:
+                            cycle.error(e)
+                            for flight in chunk:
+                                try:
+                                    batch.run(cls.create_or_update_from_json, date, flight, is_cargo=cargo == 'true', print_it=True,
+                                              undo=partial(self.forget, date, arrival == 'true', cargo == 'true', [flight]))
+                                except Exception as e:
+                                    cycle.error(e)
+                                    self.forget(date, arrival == 'true', cargo == 'true', [flight])
+            commits += batch.commits
+        stats = dimensions.stats()
+        summary = '{} flights processed, {} unchanged, {} commits (dimension cache: {} hits, {} misses)'.format(
+            self.fingerprints.processed, self.fingerprints.skipped, commits, stats['hits'], stats['misses'])
+        self.fingerprints.rotate()
+        return summary
+
+    def process(self, results, cycle):
+        return self.write(self.normalize(results, cycle), cycle)
+
+
+class ReferencePoller:
+    name = 'reference'
+
+    def __init__(self):
+        self.fetcher = Fetcher(max_workers=3)
+
+    def fetch(self, cycle):
+        urls = [('airline_data', AIRLINE_DATA_URL), ('airports', AIRPORTS_URL), ('airlines', AIRLINES_URL)]
+        futures = [self.fetcher.submit_timed(url) for _, url in urls]
+        results = []
+        for (name, _), future in zip(urls, futures):
+            data, fetch_time, parse_time = future.result()
+            cycle.time('fetch_' + name, fetch_time)
+            cycle.time('parse_' + name, parse_time)
+            results.append(data)
+        return results
+
+    def process(self, results, cycle):
+        sync = ReferenceSync()
+        with cycle.timer('sync'):
+            changes = sync.sync(*results)
+        for name, n in changes.items():
+            if n:
+                cycle.count(name, n)
+        return sync.summary()
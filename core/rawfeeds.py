@@ -0,0 +1,231 @@
+import glob
+import hashlib
+import json
+import mmap
+import os
+import threading
+import time
+import zlib
+from datetime import datetime
+
+try:
+    import zstandard
+except ImportError:
+    zstandard = None
+
+from core.pipeline import Closed
+
+READ_SIZE = 64 * 1024
+
+
+def _compressor():
+    if zstandard is not None:
+        return zstandard.ZstdCompressor(level=3).compressobj(), '.zst'
+    return zlib.compressobj(6), '.zz'
+
+
+class Recorder:
+    # Stands in for response.raw, every decoded byte the parser reads is hashed and compressed into the archive
+    def __init__(self, archive, raw, job, feed, fetched):
+        self.archive = archive
+        self.raw = raw
+        self.job = job
+        self.feed = feed
+        self.fetched = fetched
+        self.sha = hashlib.sha256()
+        self.compressor, self.ext = _compressor()
+        self.size = 0
+        self.done = False
+        os.makedirs(os.path.join(archive.root, 'blobs'), exist_ok=True)
+        self.tmp = os.path.join(archive.root, 'blobs', '.{}-{}.tmp'.format(os.getpid(), id(self)))
+        self.file = open(self.tmp, 'wb')
+
+    @property
+    def decode_content(self):
+        return True
+
+    @decode_content.setter
+    def decode_content(self, value):
+        pass
+
+    def __getattr__(self, name):
+        return getattr(self.raw, name)
+
+    def read(self, size=-1, **kwargs):
+        data = self.raw.read(None if size is None or size < 0 else size, decode_content=True)
+        if self.done:
+            return data
+        if data:
+            self.sha.update(data)
+            self.size += len(data)
+            self.file.write(self.compressor.compress(data))
+        elif size != 0:
+            self.finish()
+        return data
+
+    def readinto(self, buffer):
+        # ijson's C backend reads this way, passing it through to the response would bypass the archive
+        data = self.read(len(buffer))
+        buffer[:len(data)] = data
+        return len(data)
+
+    def stream(self, chunk_size=READ_SIZE, decode_content=True):
+        while True:
+            data = self.read(chunk_size)
+            if not data:
+                return
+            yield data
+
+    def finish(self):
+        self.done = True
+        self.file.write(self.compressor.flush())
+        self.file.close()
+        self.archive.add(self.job, self.feed, self.fetched, self.sha.hexdigest(), self.ext, self.size, self.tmp)
+
+    def close(self):
+        # A response closed before its end was reached is not a complete payload and is not kept
+        if not self.done:
+            self.done = True
+            self.file.close()
+            os.remove(self.tmp)
+        self.raw.close()
+
+
+class BlobReader:
+    # Streams a blob out of a memory map, so replaying never copies a whole payload into memory
+    def __init__(self, path):
+        with open(path, 'rb') as f:
+            self.map = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+        if path.endswith('.zst'):
+            if zstandard is None:
+                raise RuntimeError('{} is zstd compressed, install zstandard to read it'.format(path))
+            self.reader = zstandard.ZstdDecompressor().stream_reader(self.map)
+        else:
+            self.reader = None
+            self.decompressor = zlib.decompressobj()
+            self.offset = 0
+            self.buffer = b''
+
+    def read(self, size=-1):
+        if self.reader is not None:
+            return self.reader.read(size)
+        while size < 0 or len(self.buffer) < size:
+            if self.offset >= len(self.map):
+                self.buffer += self.decompressor.flush()
+                break
+            self.buffer += self.decompressor.decompress(self.map[self.offset:self.offset + READ_SIZE])
+            self.offset += READ_SIZE
+        data, self.buffer = (self.buffer, b'') if size < 0 else (self.buffer[:size], self.buffer[size:])
+        return data
+
+    def close(self):
+        if self.reader is not None:
+            self.reader.close()
+        self.map.close()
+
+
+class ArchivedResponse:
+    # Just enough of a requests response for iter_flights and stream_feed_rows
+    def __init__(self, path):
+        self.raw = BlobReader(path)
+        self.raw.decode_content = True
+        self.status_code = 200
+
+    def json(self):
+        return json.loads(self.raw.read())
+
+    def close(self):
+        self.raw.close()
+
+
+class RawFeedArchive:
+    def __init__(self, root):
+        self.root = root
+        self.stored = 0
+        self.deduplicated = 0
+        self._lock = threading.Lock()
+
+    def record(self, response, job, feed, fetched):
+        response.raw = Recorder(self, response.raw, job, feed, fetched)
+        return response
+
+    def recording(self, parse, job, feed, fetched):
+        # A response parser that archives the body it reads on the way
+        return lambda r: parse(self.record(r, job, feed, fetched))
+
+    def _blob(self, sha):
+        for ext in ['.zst', '.zz']:
+            path = os.path.join('blobs', sha[:2], sha + ext)
+            if os.path.exists(os.path.join(self.root, path)):
+                return path
+        return None
+
+    def add(self, job, feed, fetched, sha, ext, size, tmp):
+        with self._lock:
+            blob = self._blob(sha)
+            if blob:
+                # The feed has not changed since it was last stored
+                os.remove(tmp)
+                self.deduplicated += 1
+            else:
+                blob = os.path.join('blobs', sha[:2], sha + ext)
+                os.makedirs(os.path.join(self.root, 'blobs', sha[:2]), exist_ok=True)
+                os.replace(tmp, os.path.join(self.root, blob))
+                self.stored += 1
+            path = os.path.join(self.root, 'index', job, datetime.utcfromtimestamp(fetched).strftime('%Y-%m-%d.jsonl'))
+            os.makedirs(os.path.dirname(path), exist_ok=True)
+            with open(path, 'a') as f:
+                f.write(json.dumps({'fetched': fetched, 'feed': feed, 'blob': blob, 'size': size}) + '\n')
+
+    def cycles(self, job, since=None, until=None):
+        # [(fetched, {feed: blob path})] in fetch order, the responses of one poller cycle share its fetch time
+        cycles = {}
+        for path in sorted(glob.glob(os.path.join(self.root, 'index', job, '*.jsonl'))):
+            with open(path) as f:
+                for line in f:
+                    try:
+                        entry = json.loads(line)
+                    except ValueError:
+                        continue
+                    if (since and entry['fetched'] < since) or (until and entry['fetched'] >= until):
+                        continue
+                    cycles.setdefault(entry['fetched'], {})[entry['feed']] = os.path.join(self.root, entry['blob'])
+        return sorted(cycles.items())
+
+    def summary(self):
+        return '{} stored, {} deduplicated'.format(self.stored, self.deduplicated)
+
+
+class ReplayPoller:
+    # Hands archived cycles to a poller's own normalize/write at speed times the pace they were fetched at
+    def __init__(self, poller, archive, speed=1, since=None, until=None):
+        self.poller = poller
+        self.name = poller.name
+        self.speed = speed
+        cycles = archive.cycles(poller.name, since, until)
+        self.total = len(cycles)
+        self.cycles = iter(cycles)
+        self.first = None
+        self.started = None
+        self.replayed = 0
+
+    def fetch(self, cycle):
+        try:
+            fetched, feeds = next(self.cycles)
+        except StopIteration:
+            raise Closed()
+        if self.first is None:
+            self.first, self.started = fetched, time.monotonic()
+        elif self.speed:
+            wait = (fetched - self.first) / self.speed - (time.monotonic() - self.started)
+            if wait > 0:
+                time.sleep(wait)
+        cycle.set(replayed_from=fetched)
+        self.replayed += 1
+        return self.poller.replay({feed: ArchivedResponse(path) for feed, path in feeds.items()})
+
+    def normalize(self, data, cycle):
+        return self.poller.normalize(data, cycle)
+
+    def write(self, snapshot, cycle):
+        return self.poller.write(snapshot, cycle)
@@ -0,0 +1,218 @@
+from collections import Counter
+
+from django.db import transaction
+from django.utils import timezone
+
+from core.cache import dimensions
+from core.ingest import resolve_names
+from core.models import (
+    Airline, AirlineAisle, AirlineLounge, AirlineTransferDesk, Airport, Aisle, GroundHandling, Lounge, LoungePhone,
+    Terminal, TransferDesk
+)
+
+LOUNGE_MAPPING = {
+    'name': 'name',
+    'opening-hour': 'opening_hours',
+    'location': 'location',
+    'remark': 'remark',
+}
+GROUND_HANDLING_MAPPING = {
+    'name': 'slug',
+    'fullname': 'name',
+}
+AIRLINE_MAPPING = {
+    'icao-3': 'icao',
+    'iata-2': 'iata',
+    'website-url': 'url',
+    'name': 'name',
+}
+
+
+def _text(json, key):
+    return (json.get(key) or '').strip()
+
+
+def _phone(json, key):
+    return ((json.get(key) or [{}])[0] or {}).get('phone')
+
+
+class Table:
+    def __init__(self, model, key):
+        self.model = model
+        self.key = key
+        self.fields = [f.attname for f in model._meta.concrete_fields if not f.primary_key and f.attname != key]
+        self.rows = {}
+        # Lowest pk wins, like the .filter().first() lookups elsewhere
+        for obj in model.objects.order_by('-pk'):
+            self.rows[getattr(obj, key)] = obj
+        self.before = {k: self.values(obj) for k, obj in self.rows.items()}
+        self.created = {}
+
+    def values(self, obj):
+        return tuple(getattr(obj, f) for f in self.fields)
+
+    def get(self, value):
+        obj = self.rows.get(value)
+        if obj is None:
+            obj = self.rows[value] = self.created[value] = self.model(**{self.key: value})
+        return obj
+
+    def save(self, changes):
+        name = self.model._meta.db_table
+        stamped = [f.attname for f in self.model._meta.concrete_fields if getattr(f, 'auto_now', False)]
+        changed = [obj for k, obj in self.rows.items() if k in self.before and self.values(obj) != self.before[k]]
+        if changed:
+            now = timezone.now()
+            for obj in changed:
+                for f in stamped:
+                    setattr(obj, f, now)
+            self.model.objects.bulk_update(changed, self.fields, batch_size=500)
+        if self.created:
+            self.model.objects.bulk_create(self.created.values(), batch_size=500)
+            # MySQL does not hand back ids from bulk inserts
+            for obj in self.model.objects.filter(**{self.key + '__in': list(self.created)}).order_by('-pk'):
+                self.rows[getattr(obj, self.key)] = obj
+        changes[name + '_created'] += len(self.created)
+        changes[name + '_updated'] += len(changed)
+        changes[name + '_unchanged'] += len(self.before) - len(changed)
+
+
+class Links:
+    def __init__(self, model, parent, child, extra=()):
+        self.model = model
+        self.parent = parent
+        self.child = child
+        self.extra = list(extra)
+        self.wanted = {}
+
+    def want(self, parent, child, **extra):
+        self.wanted.setdefault(parent.pk, {})[child] = tuple(extra[f] for f in self.extra)
+
+    def save(self, changes):
+        # Only parents present upstream are reconciled, their links are replaced by the upstream set
+        columns = ['pk', self.parent + '_id', self.child] + self.extra
+        existing = {}
+        stale = []
+        for row in self.model.objects.filter(**{self.parent + '_id__in': list(self.wanted)}).values_list(*columns):
+            pk, parent, child, extra = row[0], row[1], row[2], tuple(row[3:])
+            if self.wanted[parent].get(child) == extra and (parent, child) not in existing:
+                existing[parent, child] = pk
+            else:
+                stale.append(pk)
+        added = [
+            self.model(**dict(zip(self.extra, extra), **{self.parent + '_id': parent, self.child: child}))
+            for parent, children in self.wanted.items() for child, extra in children.items()
+            if (parent, child) not in existing
+        ]
+        if stale:
+            self.model.objects.filter(pk__in=stale).delete()
+        if added:
+            self.model.objects.bulk_create(added, batch_size=500)
+        name = self.model._meta.db_table
+        changes[name + '_added'] += len(added)
+        changes[name + '_removed'] += len(stale)
+
+
+class ReferenceSync:
+    def __init__(self):
+        self.changes = Counter()
+
+    def sync(self, data, airports, airlines):
+        with transaction.atomic():
+            lounges = Table(Lounge, 'external_id')
+            phones = Links(LoungePhone, 'lounge', 'phone', ['is_fax'])
+            for external_id, json in data['airline-lounge'].items():
+                lounge = lounges.get(external_id)
+                for json_k, obj_k in LOUNGE_MAPPING.items():
+                    val = _text(json, json_k)
+                    if val:
+                        setattr(lounge, obj_k, val)
+            lounges.save(self.changes)
+            for external_id, json in data['airline-lounge'].items():
+                lounge = lounges.rows[external_id]
+                for a in json.get('telephone', []):
+                    if a.get('phone'):
+                        phones.want(lounge, a['phone'], is_fax=False)
+                for a in json.get('fax', []):
+                    if a.get('fax'):
+                        phones.want(lounge, a['fax'], is_fax=True)
+                phones.wanted.setdefault(lounge.pk, {})
+            phones.save(self.changes)
+
+            ground_handling = Table(GroundHandling, 'external_id')
+            for external_id, json in data['ground-handling-agent'].items():
+                agent = ground_handling.get(external_id)
+                for json_k, obj_k in GROUND_HANDLING_MAPPING.items():
+                    val = _text(json, json_k)
+                    if val:
+                        setattr(agent, obj_k, val)
+            ground_handling.save(self.changes)
+            by_slug = {}
+            for agent in sorted(ground_handling.rows.values(), key=lambda a: a.pk):
+                by_slug.setdefault(agent.slug, agent)
+
+            airline_data = [json for json in data['airline'].values() if _text(json, 'icao-3')]
+            terminals = resolve_names(Terminal, [json['terminal'] for json in airline_data if json.get('terminal')])
+            aisles = resolve_names(Aisle, [a for json in airline_data for a in json.get('aisle', [])])
+            transfer_desks = resolve_names(TransferDesk, [
+                t for json in airline_data for t in json.get('transfer', []) if t not in ['NA']])
+
+            table = Table(Airline, 'icao')
+            for json in airline_data:
+                airline = table.get(_text(json, 'icao-3'))
+                for json_k, obj_k in AIRLINE_MAPPING.items():
+                    val = _text(json, json_k)
+                    if val:
+                        setattr(airline, obj_k, val)
+                all_names = json.get('all-names', [])
+                if len(all_names) >= 2:
+                    airline.name_traditional = all_names[1].strip()
+                if len(all_names) >= 3:
+                    airline.name_simplified = all_names[2].strip()
+                if _phone(json, 'enquiry'):
+                    airline.phone_enquiry = _phone(json, 'enquiry')
+                if _phone(json, 'reservations'):
+                    airline.phone_reservation = _phone(json, 'reservations')
+                if json.get('terminal'):
+                    airline.terminal = terminals[json['terminal']]
+                slug = json.get('ground-handling-agent', [''])[0]
+                if slug:
+                    airline.ground_handling = by_slug.get(slug)
+            for json in airlines:
+                airline = table.get(json['code'])
+                airline.name, airline.name_traditional, airline.name_simplified = json['description'][:3]
+            table.save(self.changes)
+
+            airline_aisles = Links(AirlineAisle, 'airline', 'aisle_id')
+            airline_transfer_desks = Links(AirlineTransferDesk, 'airline', 'transfer_desk_id')
+            airline_lounges = Links(AirlineLounge, 'airline', 'lounge_id')
+            for json in airline_data:
+                airline = table.rows[_text(json, 'icao-3')]
+                for links in [airline_aisles, airline_transfer_desks, airline_lounges]:
+                    links.wanted.setdefault(airline.pk, {})
+                for a in json.get('aisle', []):
+                    if a:
+                        airline_aisles.want(airline, aisles[a].pk)
+                for t in json.get('transfer', []):
+                    if t and t not in ['NA']:
+                        airline_transfer_desks.want(airline, transfer_desks[t].pk)
+                for l in json.get('airline-lounge', []):
+                    if l in lounges.rows:
+                        airline_lounges.want(airline, lounges.rows[l].pk)
+            for links in [airline_aisles, airline_transfer_desks, airline_lounges]:
+                links.save(self.changes)
+
+            table = Table(Airport, 'iata')
+            for json in airports:
+                airport = table.get(json['code'])
+                airport.country = json.get('country')
+                airport.name, airport.name_traditional, airport.name_simplified = json['description'][:3]
+            table.save(self.changes)
+
+        # bulk_update skips post_save, so cached rows would otherwise keep their old values
+        if dimensions.enabled:
+            dimensions.preload(Airline, Airport)
+        return self.changes
+
+    def summary(self):
+        return ', '.join('{} {}'.format(v, k) for k, v in sorted(self.changes.items()) if v) or 'no changes'
@@ -0,0 +1,117 @@
+import asyncio
+import signal
+from concurrent.futures import ThreadPoolExecutor
+
+from django.db import close_old_connections
+
+from core.metrics import Cycle
+
+
+class Job:
+    def __init__(self, poller, interval):
+        self.poller = poller
+        self.name = poller.name
+        self.interval = interval
+        self.runs = 0
+        self.failures = 0
+        self.missed = 0
+        self.lag = 0
+        self.max_lag = 0
+        self.duration = 0
+
+    def stats(self):
+        return {
+            'runs': self.runs,
+            'failures': self.failures,
+            'missed': self.missed,
+            'lag': self.lag,
+            'max_lag': self.max_lag,
+            'duration': self.duration,
+        }
+
+
+def _in_db_worker(cycle, func, *args):
+    # Worker threads keep their connection between cycles, drop it if it went stale or broke
+    close_old_connections()
+    try:
+        with cycle.activate():
+            return func(*args)
+    finally:
+        close_old_connections()
+
+
+class Scheduler:
+    def __init__(self, db_workers=2, fetch_workers=4, metrics=None):
+        self.jobs = []
+        self.metrics = metrics
+        self.db_workers = db_workers
+        self.fetch_workers = fetch_workers
+
+    def add(self, poller, interval):
+        job = Job(poller, interval)
+        self.jobs.append(job)
+        return job
+
+    def stats(self):
+        return {job.name: job.stats() for job in self.jobs}
+
+    async def run_job(self, job, fetch_pool, db_pool):
+        loop = asyncio.get_event_loop()
+        deadline = loop.time()
+        while True:
+            started = loop.time()
+            job.lag = started - deadline
+            job.max_lag = max(job.max_lag, job.lag)
+            cycle = Cycle(job.name)
+            summary = None
+            try:
+                # Stage names of their own, pollers time their own fetch and process steps inside them
+                with cycle.timer('fetch_stage'):
+                    data = await loop.run_in_executor(fetch_pool, job.poller.fetch, cycle)
+                with cycle.timer('process_stage'):
+                    summary = await loop.run_in_executor(db_pool, _in_db_worker, cycle, job.poller.process, data, cycle)
+            except Exception as e:
+                job.failures += 1
+                cycle.error(e)
+                summary = 'failed: {!r}'.format(e)
+            job.runs += 1
+            job.duration = loop.time() - started
+
+            # Fixed rate: deadlines stay on the grid set by the first run instead of drifting by each cycle's duration.
+            # A cycle that overruns skips the ticks it covered rather than starting overlapping or back-to-back runs.
+            deadline += job.interval
+            now = loop.time()
+            missed = 0
+            if now > deadline:
+                missed = int((now - deadline) // job.interval) + 1
+                job.missed += missed
+                deadline += missed * job.interval
+                print('[{}] {} in {:.2f}s, missed {} tick(s) of {}s'.format(
+                    job.name, summary, job.duration, missed, job.interval))
+            else:
+                print('[{}] {} in {:.2f}s, started {:.3f}s late'.format(job.name, summary, job.duration, job.lag))
+            if self.metrics:
+                cycle.set(duration=job.duration, lag=job.lag, missed=missed, interval=job.interval)
+                self.metrics.record(cycle.as_dict())
+            await asyncio.sleep(deadline - loop.time())
+
+    def run(self):
+        loop = asyncio.new_event_loop()
+        asyncio.set_event_loop(loop)
+        fetch_pool = ThreadPoolExecutor(max_workers=self.fetch_workers)
+        db_pool = ThreadPoolExecutor(max_workers=self.db_workers)
+        tasks = [loop.create_task(self.run_job(job, fetch_pool, db_pool)) for job in self.jobs]
+        for sig in (signal.SIGINT, signal.SIGTERM):
+            try:
+                loop.add_signal_handler(sig, lambda: [t.cancel() for t in tasks])
+            except (NotImplementedError, RuntimeError):
+                pass
+        try:
+            loop.run_until_complete(asyncio.gather(*tasks, return_exceptions=True))
+        finally:
+            fetch_pool.shutdown(wait=False)
+            db_pool.shutdown(wait=True)
+            loop.close()
+            for name, stats in self.stats().items():
+                print('[{}] {runs} runs, {failures} failures, {missed} missed ticks, max lag {max_lag:.3f}s'.format(
+                    name, **stats))
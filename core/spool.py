@@ -0,0 +1,186 @@
+import glob
+import json
+import os
+import struct
+import threading
+import time
+import zlib
+
+# payload length, crc32 of the payload, time the snapshot was fetched
+HEADER = struct.Struct('>IId')
+SEGMENT_BYTES = 16 * 1024 * 1024
+
+
+class Spool:
+    def __init__(self, root, max_bytes=512 * 1024 * 1024, max_age=24 * 60 * 60, segment_bytes=SEGMENT_BYTES, fsync=True):
+        self.root = root
+        self.max_bytes = max_bytes
+        self.max_age = max_age
+        self.segment_bytes = segment_bytes
+        self.fsync = fsync
+        self.dropped = 0
+        self.corrupt = 0
+        self.appended = 0
+        self.replayed = 0
+        self._read_dropped = 0
+        self._cond = threading.Condition()
+        os.makedirs(root, exist_ok=True)
+        self._repair()
+        self.position = self._load_position()
+        self.pending = sum(self._count(segment, offset) for segment, offset in self._unread())
+
+    def _path(self, segment):
+        return os.path.join(self.root, '{:012d}.spool'.format(segment))
+
+    def _segments(self):
+        return sorted(int(os.path.basename(p)[:-6]) for p in glob.glob(os.path.join(self.root, '*.spool')))
+
+    def _load_position(self):
+        try:
+            with open(os.path.join(self.root, '_position.json')) as f:
+                position = json.load(f)
+            return position['segment'], position['offset']
+        except FileNotFoundError:
+            segments = self._segments()
+            return (segments[0] if segments else 0), 0
+
+    def _save_position(self):
+        path = os.path.join(self.root, '_position.json')
+        with open(path + '.tmp', 'w') as f:
+            json.dump({'segment': self.position[0], 'offset': self.position[1]}, f)
+        os.replace(path + '.tmp', path)
+
+    def _repair(self):
+        # A crash in the middle of an append leaves a torn frame, cut it off so later appends stay readable
+        for segment in self._segments():
+            valid = 0
+            for valid, _, _ in self._frames(segment, 0):
+                pass
+            if valid < os.path.getsize(self._path(segment)):
+                with open(self._path(segment), 'r+b') as f:
+                    f.truncate(valid)
+
+    def _unread(self):
+        for segment in self._segments():
+            if segment > self.position[0]:
+                yield segment, 0
+            elif segment == self.position[0]:
+                yield segment, self.position[1]
+
+    def _frames(self, segment, offset):
+        # (offset after the frame, fetched at, payload), stops at a torn or corrupt tail
+        with open(self._path(segment), 'rb') as f:
+            f.seek(offset)
+            while True:
+                header = f.read(HEADER.size)
+                if len(header) < HEADER.size:
+                    if header:
+                        self.corrupt += 1
+                    return
+                length, crc, fetched = HEADER.unpack(header)
+                payload = f.read(length)
+                if len(payload) < length or zlib.crc32(payload) != crc:
+                    self.corrupt += 1
+                    return
+                offset += HEADER.size + length
+                yield offset, fetched, payload
+
+    def _count(self, segment, offset):
+        return sum(1 for _ in self._frames(segment, offset))
+
+    def append(self, fetched, record):
+        payload = zlib.compress(json.dumps(record, separators=(',', ':')).encode(), 3)
+        frame = HEADER.pack(len(payload), zlib.crc32(payload), fetched) + payload
+        with self._cond:
+            segments = self._segments()
+            segment = segments[-1] if segments else self.position[0]
+            if segments and os.path.getsize(self._path(segment)) + len(frame) > self.segment_bytes:
+                segment += 1
+            with open(self._path(segment), 'ab') as f:
+                f.write(frame)
+                f.flush()
+                if self.fsync:
+                    os.fsync(f.fileno())
+            self.appended += 1
+            self.pending += 1
+            self._enforce_bounds()
+            self._cond.notify_all()
+
+    def _enforce_bounds(self):
+        # Whole segments go, oldest first, never the one being appended to
+        segments = self._segments()
+        now = time.time()
+        while len(segments) > 1:
+            sizes = sum(os.path.getsize(self._path(s)) for s in segments)
+            oldest = segments[0]
+            if sizes <= self.max_bytes and now - os.path.getmtime(self._path(oldest)) <= self.max_age:
+                break
+            offset = self.position[1] if oldest == self.position[0] else 0
+            dropped = self._count(oldest, offset) if oldest >= self.position[0] else 0
+            os.remove(self._path(oldest))
+            segments.pop(0)
+            self.dropped += dropped
+            self.pending -= dropped
+            if oldest >= self.position[0]:
+                self.position = (segments[0], 0)
+                self._save_position()
+            print('Spool over its bounds, dropped {} snapshot(s) in segment {}'.format(dropped, oldest))
+
+    def read(self, limit=1):
+        # Oldest unacknowledged records with the position to ack once they are safely written
+        records = []
+        with self._cond:
+            self._read_dropped = self.dropped
+            for segment, offset in self._unread():
+                for end, fetched, payload in self._frames(segment, offset):
+                    records.append(((segment, end), fetched, json.loads(zlib.decompress(payload))))
+                    if len(records) >= limit:
+                        return records
+        return records
+
+    def ack(self, position, count):
+        with self._cond:
+            self.replayed += count
+            if self.dropped != self._read_dropped:
+                # The bounds dropped segments while these were being written and already took the records in them off
+                # pending, count what is left on disk instead of guessing the overlap
+                self.position = max(self.position, position)
+                self._save_position()
+                self.pending = sum(self._count(segment, offset) for segment, offset in self._unread())
+            else:
+                self.pending = max(0, self.pending - count)
+                if position <= self.position:
+                    return
+                self.position = position
+                self._save_position()
+            for segment in self._segments():
+                if segment < self.position[0]:
+                    os.remove(self._path(segment))
+
+    def wait(self, timeout=None):
+        with self._cond:
+            if not self.pending:
+                self._cond.wait(timeout)
+            return self.pending
+
+    def wake(self):
+        with self._cond:
+            self._cond.notify_all()
+
+    def backlog(self):
+        with self._cond:
+            size = 0
+            oldest = None
+            for segment, offset in self._unread():
+                size += os.path.getsize(self._path(segment)) - offset
+                if oldest is None:
+                    for _, fetched, _ in self._frames(segment, offset):
+                        oldest = fetched
+                        break
+            return {
+                'records': self.pending,
+                'bytes': size,
+                'oldest_age': time.time() - oldest if oldest else 0,
+                'dropped': self.dropped,
+                'corrupt': self.corrupt,
+            }
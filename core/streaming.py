@@ -0,0 +1,58 @@
+from itertools import islice
+
+try:
+    import ijson
+except ImportError:
+    ijson = None
+
+
+def batches(iterable, size):
+    iterator = iter(iterable)
+    while True:
+        batch = list(islice(iterator, size))
+        if not batch:
+            return
+        yield batch
+
+
+def iter_flights(response):
+    # (date, flight) pairs from an HKIA /flights response, parsed straight off the socket so neither the body
+    # nor its decoded text is ever held in memory
+    if ijson is None:
+        for d in response.json():
+            for flight in d['list']:
+                yield d['date'], flight
+        return
+
+    response.raw.decode_content = True
+    date = None
+    early = []
+    builder = None
+    for prefix, event, value in ijson.parse(response.raw, use_float=True):
+        if builder is not None:
+            builder.event(event, value)
+            if prefix == 'item.list.item' and event == 'end_map':
+                if date is None:
+                    early.append(builder.value)
+                else:
+                    yield date, builder.value
+                builder = None
+        elif prefix == 'item.list.item' and event == 'start_map':
+            builder = ijson.common.ObjectBuilder()
+            builder.event(event, value)
+        elif prefix == 'item.date':
+            date = value
+            for flight in early:
+                yield date, flight
+            early = []
+        elif prefix == 'item' and event == 'end_map':
+            date = None
+
+
+def read_days(response):
+    days = []
+    for date, flight in iter_flights(response):
+        if not days or days[-1]['date'] != date:
+            days.append({'date': date, 'list': []})
+        days[-1]['list'].append(flight)
+    return days
@@ -1,3 +1,1068 @@
-from django.test import TestCase
+import asyncio
+import io
+import json
+import os
+import re
+import shutil
+import tempfile
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from datetime import date, datetime
+from unittest import mock
 
-# Create your tests here.
+import pyarrow.parquet as pq
+import pytz
+import requests
+from django.contrib.auth.models import User
+from django.core.cache import cache
+from django.core.management import call_command
+from django.core.management.base import CommandError
+from django.db import connection, transaction
+from django.test import TestCase, TransactionTestCase
+from django.test.utils import CaptureQueriesContext
+
+from core import archive as core_archive
+from core.archive import Archive
+from core.batch import TransactionBatch
+from core.cache import dimensions
+from core.display import load_flight_numbers
+from core import events as core_events
+from core.events import get_broker, matches
+from core.metrics import Cycle, Registry
+from core.mockfeeds import MockFeeds, serve
+from core.pipeline import Pipeline, SnapshotQueue
+from core.scheduler import Scheduler
+from core.spool import Spool
+from core import streaming as core_streaming
+from core.fetch import Fetcher
+from core.fingerprints import FlightFingerprints
+from core.management.commands import benchmark_ingest, update_historical
+from core.pollers import StatusPoller, keyed_flights
+from core.streaming import iter_flights, read_days
+from fr.columnar import stream_feed_rows, tracked_feeds
+from fr.models import FEED_FIELDS, FrLog
+from core.ingest import ArrivalIngestor, DepartureIngestor
+from core.models import (
+    Airline, AirlineAisle, AirlineLounge, Airport, Arrival, ArrivalFlightNumber, ArrivalOrigin, ArrivalStatus,
+    BackfillCheckpoint, Departure, DepartureAisle, DepartureDestination, DepartureFlightNumber, DepartureStatus,
+    FlightNumber, Gate, LoungePhone, Terminal
+)
+from core.rawfeeds import ArchivedResponse, RawFeedArchive
+from core.reference import ReferenceSync
+
+DATE = '2018-05-29'
+DEPARTURES = [
+    {'time': '00:05', 'flight': [{'no': 'CX 905', 'airline': 'CPA'}, {'no': 'PR 3005', 'airline': 'PAL'}],
+     'status': 'Dep 00:20', 'statusCode': 'DE', 'destination': ['MNL'], 'terminal': 'T1', 'aisle': 'C', 'gate': '23'},
+    {'time': '09:40', 'flight': [{'no': 'PR 301', 'airline': 'PAL'}],
+     'status': 'Boarding', 'statusCode': 'BO', 'destination': ['MNL'], 'terminal': 'T1', 'aisle': 'K', 'gate': '5'},
+]
+ARRIVALS = [
+    {'time': '05:15', 'flight': [{'no': 'CX 906', 'airline': 'CPA'}],
+     'status': 'At gate 05:20', 'statusCode': 'ON', 'origin': ['MNL'], 'stand': 'N1', 'hall': 'A', 'baggage': '5'},
+]
+
+REFERENCE = [
+    {
+        'airline-lounge': {
+            'cx-pier': {'name': 'The Pier', 'opening-hour': '05:30 - 00:30', 'location': 'Near Gate 63',
+                        'telephone': [{'phone': '2186 8888'}], 'fax': [{'fax': '2186 8889'}]},
+        },
+        'ground-handling-agent': {
+            'hafsl': {'name': 'hafsl', 'fullname': 'Hong Kong Airport Services'},
+        },
+        'airline': {
+            'CPA': {'icao-3': 'CPA', 'iata-2': 'CX', 'name': 'Cathay Pacific', 'all-names': ['Cathay Pacific', 'x', 'y'],
+                    'terminal': 'T1', 'enquiry': [{'phone': '2747 3333'}], 'ground-handling-agent': ['hafsl'],
+                    'aisle': ['C', 'D'], 'transfer': ['E1', 'NA'], 'airline-lounge': ['cx-pier']},
+        },
+    },
+    [{'code': 'MNL', 'description': ['Manila', 'a', 'b'], 'country': 'PH'}],
+    [{'code': 'PAL', 'description': ['Philippine Airlines', 'a', 'b']}],
+]
+
+
+def _access_types(node):
+    if isinstance(node, dict):
+        for k, v in node.items():
+            if k == 'access_type':
+                yield node.get('table_name'), v
+            else:
+                yield from _access_types(v)
+    elif isinstance(node, list):
+        for v in node:
+            yield from _access_types(v)
+
+
+class QueryPlanTestCase(TestCase):
+    @classmethod
+    def setUpTestData(cls):
+        Departure.bulk_create_or_update_from_json(DATE, DEPARTURES)
+        Arrival.bulk_create_or_update_from_json(DATE, ARRIVALS)
+
+    def assertNoFullScan(self, queryset):
+        if connection.vendor == 'mysql':
+            plan = json.loads(queryset.explain(format='json'))
+            scans = ['{} ({})'.format(t, a) for t, a in _access_types(plan) if a in ('ALL', 'index')]
+        elif connection.vendor == 'sqlite':
+            plan = queryset.explain()
+            scans = [line for line in plan.splitlines() if ' SCAN ' in line]
+        else:
+            self.skipTest('No plan checks for {}'.format(connection.vendor))
+        self.assertFalse(scans, 'Full scan in plan:\n{}'.format(plan))
+
+    def test_departure_lookup(self):
+        queryset = DepartureFlightNumber.lookup(DATE, DEPARTURES[0]['flight'][0]).select_related(
+            'departure__latest_status', 'departure__terminal', 'departure__gate')
+        self.assertEqual(queryset.count(), 1)
+        self.assertNoFullScan(queryset)
+
+    def test_arrival_lookup(self):
+        queryset = ArrivalFlightNumber.lookup(DATE, ARRIVALS[0]['flight'][0]).select_related(
+            'arrival__latest_status', 'arrival__hall', 'arrival__stand', 'arrival__baggage_reclaim')
+        self.assertEqual(queryset.count(), 1)
+        self.assertNoFullScan(queryset)
+
+    def test_bulk_departure_lookup(self):
+        ingestor = DepartureIngestor(DATE)
+        keys = [ingestor.key(f['flight'][0]) for f in DEPARTURES]
+        queryset = ingestor.lookup(keys).select_related('departure__latest_status', 'flight_number__airline')
+        self.assertEqual(queryset.count(), 2)
+        self.assertNoFullScan(queryset)
+
+    def test_bulk_arrival_lookup(self):
+        ingestor = ArrivalIngestor(DATE)
+        keys = [ingestor.key(f['flight'][0]) for f in ARRIVALS]
+        queryset = ingestor.lookup(keys).select_related('arrival__latest_status', 'flight_number__airline')
+        self.assertEqual(queryset.count(), 1)
+        self.assertNoFullScan(queryset)
+
+    def test_flight_number_lookup(self):
+        airline = Airline.objects.get(icao='CPA')
+        queryset = FlightNumber.objects.filter(airline=airline, number='905')
+        self.assertEqual(queryset.count(), 1)
+        self.assertNoFullScan(queryset)
+
+    def test_departures_by_date(self):
+        queryset = Departure.objects.filter(schedule_date=DATE)
+        self.assertEqual(queryset.count(), 2)
+        self.assertNoFullScan(queryset)
+
+    def test_arrivals_by_date(self):
+        queryset = Arrival.objects.filter(schedule_date=DATE)
+        self.assertEqual(queryset.count(), 1)
+        self.assertNoFullScan(queryset)
+
+
+class BoardTestCase(TestCase):
+    @classmethod
+    def setUpTestData(cls):
+        Departure.bulk_create_or_update_from_json(DATE, DEPARTURES)
+        Arrival.bulk_create_or_update_from_json(DATE, ARRIVALS)
+
+    def setUp(self):
+        cache.clear()
+
+    def test_departures(self):
+        response = self.client.get('/api/departures/', {'date': DATE})
+        self.assertEqual(response.status_code, 200)
+        flights = response.json()['flights']
+        self.assertEqual([f['flight'] for f in flights], [f['flight'] for f in DEPARTURES])
+        self.assertEqual(flights[0]['destination'], ['MNL'])
+        self.assertEqual(flights[0]['aisle'], 'C')
+        self.assertEqual(flights[0]['statusCode'], 'DE')
+
+    def test_arrivals(self):
+        response = self.client.get('/api/arrivals/', {'date': DATE})
+        flights = response.json()['flights']
+        self.assertEqual(len(flights), 1)
+        self.assertEqual(flights[0]['origin'], ['MNL'])
+        self.assertEqual(flights[0]['baggage'], '5')
+
+    def test_filters(self):
+        self.assertEqual(len(self.client.get('/api/departures/', {'date': DATE, 'airline': 'PAL'}).json()['flights']), 2)
+        self.assertEqual(len(self.client.get('/api/departures/', {'date': DATE, 'airline': 'CX'}).json()['flights']), 1)
+        self.assertEqual(len(self.client.get('/api/departures/', {'date': DATE, 'status': 'BO'}).json()['flights']), 1)
+        self.assertEqual(len(self.client.get('/api/departures/', {'date': DATE, 'terminal': 'T2'}).json()['flights']), 0)
+
+    def test_queries_do_not_grow_with_flights(self):
+        with self.assertNumQueries(5):
+            self.client.get('/api/departures/', {'date': DATE})
+        Departure.bulk_create_or_update_from_json(DATE, [
+            dict(DEPARTURES[1], flight=[{'no': 'PR {}'.format(n), 'airline': 'PAL'}]) for n in range(400, 420)
+        ])
+        cache.clear()
+        with self.assertNumQueries(5):
+            self.client.get('/api/departures/', {'date': DATE})
+
+    def test_cached_and_conditional(self):
+        response = self.client.get('/api/departures/', {'date': DATE})
+        with self.assertNumQueries(0):
+            self.assertEqual(self.client.get('/api/departures/', {'date': DATE}).content, response.content)
+        not_modified = self.client.get('/api/departures/', {'date': DATE}, HTTP_IF_NONE_MATCH=response['ETag'])
+        self.assertEqual(not_modified.status_code, 304)
+        self.assertEqual(not_modified['ETag'], response['ETag'])
+
+    def test_invalid_date(self):
+        self.assertEqual(self.client.get('/api/departures/', {'date': 'nope'}).status_code, 400)
+
+
+class DisplayTestCase(TestCase):
+    @classmethod
+    def setUpTestData(cls):
+        Departure.bulk_create_or_update_from_json(DATE, DEPARTURES)
+        Arrival.bulk_create_or_update_from_json(DATE, ARRIVALS)
+        User.objects.create_superuser('admin', 'admin@example.com', 'admin')
+
+    def setUp(self):
+        self.client.login(username='admin', password='admin')
+
+    def test_str(self):
+        departure = Departure.objects.get(schedule_date=DATE, departureflightnumber__flight_number__number='905')
+        with self.assertNumQueries(1):
+            self.assertEqual(str(departure), 'DEP: 05/28 16:05 CX 905, PR 3005')
+
+    def test_status_str(self):
+        statuses = list(DepartureStatus.objects.select_related('departure'))
+        with self.assertNumQueries(1):
+            load_flight_numbers([s.departure for s in statuses])
+            self.assertEqual(sorted(str(s) for s in statuses), [
+                'DEP: 05/28 16:05 CX 905, PR 3005: Dep 00:20', 'DEP: 05/29 01:40 PR 301: Boarding'])
+
+    def test_changelists(self):
+        for url in ['/admin/core/departure/', '/admin/core/arrival/', '/admin/core/departurestatus/',
+                    '/admin/core/arrivalstatus/', '/admin/fr/frlog/']:
+            self.assertEqual(self.client.get(url).status_code, 200)
+
+    def test_changelist_queries_do_not_grow_with_flights(self):
+        with self.assertNumQueries(5):
+            self.client.get('/admin/core/departure/')
+        Departure.bulk_create_or_update_from_json(DATE, [
+            dict(DEPARTURES[1], flight=[{'no': 'PR {}'.format(n), 'airline': 'PAL'}]) for n in range(400, 420)
+        ])
+        with self.assertNumQueries(5):
+            self.client.get('/admin/core/departure/')
+        with self.assertNumQueries(5):
+            self.client.get('/admin/core/departurestatus/')
+
+
+class StatusStreamTestCase(TransactionTestCase):
+    def setUp(self):
+        self.subscription = get_broker().subscribe()
+
+    def tearDown(self):
+        self.subscription.close()
+
+    def events(self):
+        events = []
+        while True:
+            event = self.subscription.get(timeout=0)
+            if event is None:
+                return events
+            events.append(event)
+
+    def test_bulk_ingest_publishes(self):
+        Departure.bulk_create_or_update_from_json(DATE, DEPARTURES)
+        events = self.events()
+        self.assertEqual([e['flight'] for e in events], [['CX 905', 'PR 3005'], ['PR 301']])
+        self.assertEqual(events[0]['airline'], ['CPA', 'PAL'])
+        self.assertEqual(events[0]['terminal'], 'T1')
+        self.assertEqual(events[0]['statusCode'], 'DE')
+        self.assertEqual([e['id'] for e in events],
+                         ['departure-{}'.format(pk) for pk in DepartureStatus.objects.order_by('pk').values_list('pk', flat=True)])
+        Departure.bulk_create_or_update_from_json(DATE, DEPARTURES)
+        self.assertEqual(self.events(), [])
+
+    def test_single_ingest_publishes(self):
+        Arrival.create_or_update_from_json(DATE, ARRIVALS[0])
+        events = self.events()
+        self.assertEqual(len(events), 1)
+        self.assertEqual(events[0]['direction'], 'arrival')
+        self.assertEqual(events[0]['flight'], ['CX 906'])
+
+    def test_broker_failures_do_not_reach_the_poller(self):
+        class Down:
+            def has_subscribers(self):
+                return True
+
+            def publish(self, event):
+                raise ConnectionError('broker is down')
+
+        cycle = Cycle('statuses')
+        with mock.patch.object(core_events, '_broker', Down()), cycle.activate():
+            Departure.bulk_create_or_update_from_json(DATE, DEPARTURES)
+            Arrival.create_or_update_from_json(DATE, ARRIVALS[0])
+        self.assertEqual(Departure.objects.exclude(latest_status=None).count(), 2)
+        self.assertEqual(cycle.counts['publish_errors'], 2)
+
+    def test_filters(self):
+        Departure.bulk_create_or_update_from_json(DATE, DEPARTURES)
+        events = self.events()
+        self.assertEqual(len([e for e in events if matches(e, {'airline': ['PAL']})]), 2)
+        self.assertEqual(len([e for e in events if matches(e, {'airline': ['CX']})]), 1)
+        self.assertEqual(len([e for e in events if matches(e, {'flight': ['PR 301']})]), 1)
+        self.assertEqual(len([e for e in events if matches(e, {'terminal': ['T2']})]), 0)
+        self.assertEqual(len([e for e in events if matches(e, {'direction': ['arrival']})]), 0)
+
+    def test_stream(self):
+        response = self.client.get('/api/stream/', {'airline': 'CPA'})
+        self.assertEqual(response['Content-Type'], 'text/event-stream')
+        content = iter(response.streaming_content)
+        self.assertEqual(next(content), b'retry: 3000\n\n')
+        Departure.bulk_create_or_update_from_json(DATE, DEPARTURES)
+        message = next(content).decode()
+        status = DepartureStatus.objects.get(departure__departureflightnumber__flight_number__number='905')
+        self.assertTrue(message.startswith('id: departure-{}\n'.format(status.pk)))
+        self.assertEqual(json.loads(message.split('data: ')[1])['flight'], ['CX 905', 'PR 3005'])
+        response.close()
+
+
+class ReferenceSyncTestCase(TestCase):
+    def sync(self, data):
+        sync = ReferenceSync()
+        sync.sync(*json.loads(json.dumps(data)))
+        return sync
+
+    def test_sync(self):
+        self.sync(REFERENCE)
+        cathay = Airline.objects.get(icao='CPA')
+        self.assertEqual((cathay.iata, cathay.terminal.name, cathay.ground_handling.slug), ('CX', 'T1', 'hafsl'))
+        self.assertEqual(sorted(cathay.aisles.values_list('name', flat=True)), ['C', 'D'])
+        self.assertEqual(list(cathay.transfer_desks.values_list('name', flat=True)), ['E1'])
+        self.assertEqual(list(cathay.lounges.values_list('external_id', flat=True)), ['cx-pier'])
+        self.assertEqual(sorted(LoungePhone.objects.values_list('phone', 'is_fax')), [('2186 8888', False), ('2186 8889', True)])
+        self.assertEqual(Airline.objects.get(icao='PAL').name, 'Philippine Airlines')
+        self.assertEqual(Airport.objects.get(iata='MNL').country, 'PH')
+
+    def test_unchanged_sync_does_not_write(self):
+        self.sync(REFERENCE)
+        with self.assertNumQueries(13):
+            sync = self.sync(REFERENCE)
+        self.assertFalse([k for k, v in sync.changes.items() if v and not k.endswith('_unchanged')])
+
+    def test_only_changes_are_written(self):
+        self.sync(REFERENCE)
+        last_updated = Airline.objects.get(icao='PAL').last_updated
+        changed = json.loads(json.dumps(REFERENCE))
+        changed[0]['airline']['CPA']['aisle'] = ['C', 'J']
+        changed[0]['airline']['CPA']['airline-lounge'] = []
+        changed[1][0]['country'] = 'HK'
+        sync = self.sync(changed)
+        self.assertEqual(sync.summary(), '1 airline_aisle_added, 1 airline_aisle_removed, 1 airline_lounge_removed, '
+                                         '2 airline_unchanged, 1 airport_updated, 1 ground_handling_unchanged, '
+                                         '1 lounge_unchanged')
+        self.assertEqual(sorted(AirlineAisle.objects.values_list('aisle__name', flat=True)), ['C', 'J'])
+        self.assertFalse(AirlineLounge.objects.exists())
+        self.assertEqual(Airline.objects.get(icao='PAL').last_updated, last_updated)
+
+
+class TransactionBatchTestCase(TransactionTestCase):
+    def setUp(self):
+        dimensions.enable()
+
+    def tearDown(self):
+        dimensions.disable()
+
+    def test_failed_flight_rolls_back_to_savepoint(self):
+        def fail():
+            Terminal.get_terminal('T9')
+            raise ValueError('bad flight')
+
+        undone = []
+        with TransactionBatch(2) as batch:
+            batch.run(Departure.create_or_update_from_json, DATE, DEPARTURES[0])
+            with self.assertRaises(ValueError):
+                batch.run(fail, undo=lambda: undone.append('fail'))
+            batch.run(Departure.create_or_update_from_json, DATE, DEPARTURES[1])
+            batch.run(Arrival.create_or_update_from_json, DATE, ARRIVALS[0], undo=lambda: undone.append('arrival'))
+        self.assertEqual((batch.commits, batch.rollbacks), (2, 0))
+        self.assertEqual((Departure.objects.count(), Arrival.objects.count()), (2, 1))
+        self.assertFalse(Terminal.objects.filter(name='T9').exists())
+        self.assertEqual(undone, [])
+        # The rolled back terminal must not linger in the dimension cache, the rest of it is kept
+        self.assertIsNone(dimensions.peek(Terminal, ('T9',)))
+        self.assertEqual(dimensions.peek(Terminal, ('T1',)).pk, Terminal.objects.get(name='T1').pk)
+        self.assertTrue(Terminal.objects.filter(pk=Terminal.get_terminal('T9').pk).exists())
+
+    def test_rollback_runs_undo(self):
+        undone = []
+        with self.assertRaises(ValueError):
+            with TransactionBatch() as batch:
+                batch.run(Departure.create_or_update_from_json, DATE, DEPARTURES[0], undo=lambda: undone.append(1))
+                raise ValueError
+        self.assertEqual((batch.commits, batch.rollbacks, undone), (0, 1, [1]))
+        self.assertFalse(Departure.objects.exists())
+        self.assertIsNone(dimensions.peek(Terminal, ('T1',)))
+
+    def test_other_threads_see_cached_rows_once_committed(self):
+        seen = []
+
+        def peek():
+            seen.append(dimensions.peek(Gate, ('60',)))
+
+        with TransactionBatch() as batch:
+            gate = batch.run(Gate.get_gate, '60')
+            thread = threading.Thread(target=peek)
+            thread.start()
+            thread.join()
+            self.assertEqual(dimensions.peek(Gate, ('60',)).pk, gate.pk)
+        thread = threading.Thread(target=peek)
+        thread.start()
+        thread.join()
+        self.assertEqual([g and g.pk for g in seen], [None, gate.pk])
+
+    def test_hits_are_not_shared_instances(self):
+        Gate.get_gate('60')
+        first, second = dimensions.peek(Gate, ('60',)), dimensions.peek(Gate, ('60',))
+        self.assertIsNot(first, second)
+        first.name = '61'
+        self.assertEqual(Gate.get_gate('60').name, '60')
+
+
+def _departure(time, flights, status='', status_code='', **values):
+    flight = {'time': time, 'flight': [{'no': no, 'airline': airline} for no, airline in flights],
+              'status': status, 'statusCode': status_code, 'destination': ['MNL']}
+    flight.update(values)
+    return flight
+
+
+def _arrival(time, flights, status='', status_code='', **values):
+    flight = {'time': time, 'flight': [{'no': no, 'airline': airline} for no, airline in flights],
+              'status': status, 'statusCode': status_code, 'origin': ['MNL']}
+    flight.update(values)
+    return flight
+
+
+INGEST_CYCLES = [
+    (
+        DEPARTURES + [_departure('12:00', [('CX 901', 'CPA')], terminal='T1')],
+        ARRIVALS + [_arrival('10:00', [('PR 300', 'PAL')], 'Estimated 10:05', 'ES', hall='B')],
+    ),
+    (
+        [
+            _departure('00:05', [('CX 905', 'CPA'), ('PR 3005', 'PAL')], 'Dep 00:25', 'DA', gate='24', aisle='CD'),
+            _departure('09:50', [('PR 301', 'PAL')], 'Boarding', 'BO', terminal='T1', aisle='KL', gate='5'),
+            _departure('12:00', [('CX 901', 'CPA')], 'Gate Opens 11:30', '', gate='60'),
+            _departure('13:00', [('KE 100', 'KAL'), ('CX 5100', 'CPA')], 'Scheduled', '', destination=['ICN', 'BKK']),
+            # The same flight twice in one feed, the second status follows the first
+            _departure('09:50', [('PR 301', 'PAL')], 'Final Call', 'FC', terminal='T1', gate='5'),
+        ],
+        [
+            _arrival('05:15', [('CX 906', 'CPA')], 'At gate 05:30', 'ON', stand='N2'),
+            _arrival('10:00', [('PR 300', 'PAL')], 'At gate 10:02', 'ON', stand='N5', baggage='7'),
+        ],
+    ),
+    (
+        [
+            _departure('00:05', [('CX 905', 'CPA'), ('PR 3005', 'PAL')], 'Dep 00:30', 'DA', gate='24'),
+            _departure('09:50', [('PR 301', 'PAL')], 'Gate Closed', 'GC', terminal='T1', gate='5'),
+            _departure('13:00', [('KE 100', 'KAL'), ('CX 5100', 'CPA')], 'Scheduled', '', destination=['ICN', 'BKK']),
+        ],
+        [
+            _arrival('10:00', [('PR 300', 'PAL')], 'Baggage Delivered', 'BD'),
+        ],
+    ),
+]
+
+
+class _Rollback(Exception):
+    pass
+
+
+class IngestTestCase(TestCase):
+    def ingest(self, bulk):
+        for departures, arrivals in INGEST_CYCLES:
+            if bulk:
+                Departure.bulk_create_or_update_from_json(DATE, departures)
+                Arrival.bulk_create_or_update_from_json(DATE, arrivals)
+            else:
+                for flight in departures:
+                    Departure.create_or_update_from_json(DATE, flight)
+                for flight in arrivals:
+                    Arrival.create_or_update_from_json(DATE, flight)
+
+    def state(self):
+        state = {}
+        for model, links, statuses, places, place, dims in [
+            (Departure, DepartureFlightNumber, DepartureStatus, DepartureDestination, 'destination', ['terminal', 'gate']),
+            (Arrival, ArrivalFlightNumber, ArrivalStatus, ArrivalOrigin, 'origin', ['stand', 'hall', 'baggage_reclaim']),
+        ]:
+            fk = model._meta.model_name
+            for parent in model.objects.order_by('pk'):
+                numbers = tuple(links.objects.filter(**{fk: parent}).order_by('order').values_list(
+                    'flight_number__airline__icao', 'flight_number__airline_letters', 'flight_number__number', 'order',
+                    'schedule_date'))
+                history = list(statuses.objects.filter(**{fk: parent}).order_by('pk').values_list('status', 'status_code'))
+                latest = parent.latest_status
+                state[fk, numbers] = {
+                    'schedule': (parent.schedule, parent.schedule_date, parent.is_cargo),
+                    'dimensions': [getattr(parent, d) and getattr(parent, d).name for d in dims],
+                    'places': sorted(places.objects.filter(**{fk: parent}).values_list(place + '__iata', flat=True)),
+                    'aisles': sorted(DepartureAisle.objects.filter(departure=parent).values_list('aisle__name', flat=True))
+                              if model is Departure else [],
+                    'statuses': history,
+                    'latest': latest and (latest.status, latest.status_code),
+                }
+                self.assertEqual(state[fk, numbers]['latest'], history[-1] if history else None)
+        state['flight_numbers'] = sorted(FlightNumber.objects.values_list('airline__icao', 'airline_letters', 'number', 'number_ordering'))
+        state['airports'] = sorted(Airport.objects.values_list('iata', flat=True))
+        return state
+
+    def test_bulk_ingest_matches_flight_by_flight(self):
+        try:
+            with transaction.atomic():
+                self.ingest(bulk=False)
+                one_by_one = self.state()
+                raise _Rollback
+        except _Rollback:
+            pass
+        dimensions.clear()
+        self.assertFalse(Departure.objects.exists())
+
+        self.ingest(bulk=True)
+        self.assertEqual(self.state(), one_by_one)
+        self.assertEqual(len(one_by_one), 8)
+        self.assertEqual(one_by_one['departure', (('PAL', 'PR', '301', 1, date(2018, 5, 29)),)]['statuses'],
+                         [('Boarding', 'BO'), ('Final Call', 'FC'), ('Gate Closed', 'GC')])
+
+    def test_a_status_change_writes_the_flight_once(self):
+        with CaptureQueriesContext(connection) as queries:
+            Departure.create_or_update_from_json(DATE, DEPARTURES[0])
+        writes = [q['sql'].split(' ')[0] for q in queries if q['sql'].startswith(('INSERT INTO "departure"', 'UPDATE "departure"'))]
+        self.assertEqual(writes, ['INSERT', 'UPDATE'])
+
+        with CaptureQueriesContext(connection) as queries:
+            Departure.create_or_update_from_json(DATE, dict(DEPARTURES[0], status='Dep 00:25'))
+        writes = [q['sql'] for q in queries if q['sql'].startswith(('INSERT INTO "departure', 'UPDATE "departure'))]
+        self.assertEqual([w.split('"')[1] for w in writes], ['departure_status', 'departure'])
+        self.assertIn('"latest_status_id"', writes[1])
+
+    def test_new_flights_without_returned_ids_are_saved_one_by_one(self):
+        # MySQL does not hand back the ids of a bulk insert, created flights then cost an INSERT each
+        flights = INGEST_CYCLES[1][0]
+        with mock.patch.object(connection.features, 'can_return_ids_from_bulk_insert', False):
+            with CaptureQueriesContext(connection) as queries:
+                Departure.bulk_create_or_update_from_json(DATE, flights)
+        inserts = [q['sql'] for q in queries if q['sql'].startswith('INSERT INTO "departure"')]
+        self.assertEqual(len(inserts), 4)
+        statuses = [q['sql'] for q in queries if q['sql'].startswith('INSERT INTO "departure_status"')]
+        self.assertEqual(len(statuses), 1)
+        self.assertEqual(Departure.objects.filter(latest_status__isnull=True).count(), 0)
+
+
+class BackfillLatestStatusTestCase(TestCase):
+    def test_stale_missing_and_orphaned_pointers_are_fixed(self):
+        stale, missing = Departure.bulk_create_or_update_from_json(DATE, DEPARTURES)
+        Arrival.bulk_create_or_update_from_json(DATE, ARRIVALS)
+        newer = DepartureStatus.objects.create(departure=stale, status='Dep 00:25', status_code='DE')
+        Departure.objects.filter(pk=missing.pk).update(latest_status=None)
+        orphaned = Departure.objects.create(schedule=stale.schedule, latest_status=newer)
+
+        with self.assertRaisesRegex(CommandError, '3 rows'):
+            call_command('backfill_latest_status', verify=True)
+        call_command('backfill_latest_status')
+        call_command('backfill_latest_status', verify=True)
+
+        latest = dict(Departure.objects.values_list('pk', 'latest_status'))
+        self.assertEqual(latest[stale.pk], newer.pk)
+        self.assertEqual(latest[missing.pk], missing.statuses.get().pk)
+        self.assertIsNone(latest[orphaned.pk])
+
+
+class FlightFingerprintsTestCase(TestCase):
+    def setUp(self):
+        self.root = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, self.root)
+        self.path = os.path.join(self.root, 'fingerprints.json')
+
+    def test_unchanged_flights_are_skipped(self):
+        fingerprints = FlightFingerprints(self.path)
+        self.assertEqual(fingerprints.changed(DATE, False, False, DEPARTURES), DEPARTURES)
+        fingerprints.rotate()
+
+        # A restart picks the last cycle up from disk
+        fingerprints = FlightFingerprints(self.path)
+        changed = [dict(DEPARTURES[1], status='Final Call', statusCode='FC')]
+        self.assertEqual(fingerprints.changed(DATE, False, False, DEPARTURES[:1] + changed), changed)
+        self.assertEqual((fingerprints.processed, fingerprints.skipped), (1, 1))
+        # The same flight on another day, or as an arrival, is another flight
+        self.assertEqual(fingerprints.changed('2018-05-30', False, False, DEPARTURES[:1]), DEPARTURES[:1])
+        self.assertEqual(fingerprints.changed(DATE, True, False, DEPARTURES[:1]), DEPARTURES[:1])
+
+    def test_forgotten_flights_are_retried(self):
+        fingerprints = FlightFingerprints()
+        fingerprints.changed(DATE, False, False, DEPARTURES)
+        fingerprints.forget(DATE, False, False, DEPARTURES[1])
+        fingerprints.rotate()
+        self.assertEqual(fingerprints.changed(DATE, False, False, DEPARTURES), DEPARTURES[1:])
+
+    def test_poller_forgets_flights_that_failed_to_save(self):
+        poller = StatusPoller()
+        self.addCleanup(dimensions.disable)
+        create = Departure.create_or_update_from_json
+
+        def fail_pr_301(date, flight, **kwargs):
+            if flight['flight'][0]['no'] == 'PR 301':
+                raise ValueError('bad flight')
+            return create(date, flight, **kwargs)
+
+        results = [('false', 'false', keyed_flights('false', 'false', ((DATE, f) for f in DEPARTURES)))]
+        with mock.patch.object(Departure, 'bulk_create_or_update_from_json', side_effect=ValueError('bad batch')), \
+                mock.patch.object(Departure, 'create_or_update_from_json', side_effect=fail_pr_301):
+            poller.process(results, Cycle('statuses'))
+        self.assertEqual(Departure.objects.count(), 1)
+
+        cycle = Cycle('statuses')
+        poller.process(results, cycle)
+        self.assertEqual(cycle.counts['flights_skipped'], 1)
+        self.assertEqual(Departure.objects.count(), 2)
+
+
+class BackfillTestCase(TestCase):
+    def setUp(self):
+        server = serve(MockFeeds(flights_per_day=40), port=0)
+        threading.Thread(target=server.serve_forever, daemon=True).start()
+        self.addCleanup(server.server_close)
+        self.addCleanup(server.shutdown)
+        url = 'http://{}:{}/flightinfo-rest/rest/flights?span=1&date={{}}&lang=en&cargo={{}}&arrival={{}}'.format(
+            *server.server_address[:2])
+        for patch in [mock.patch.object(update_historical, 'URL', url),
+                      mock.patch.object(update_historical, 'fetcher', Fetcher(retries=0))]:
+            patch.start()
+            self.addCleanup(patch.stop)
+
+    def test_only_days_without_errors_are_checkpointed(self):
+        date, flights, errors, _, cycle = update_historical.backfill_date(DATE)
+        self.assertEqual((date, flights, errors), (DATE, 40, 0))
+        self.assertEqual(cycle['counts']['commits'], 4)
+        self.assertEqual(BackfillCheckpoint.objects.get().flights, 40)
+
+        def fail(date, flight, **kwargs):
+            raise ValueError('bad flight')
+
+        with mock.patch.object(Arrival, 'bulk_create_or_update_from_json', side_effect=ValueError('bad batch')), \
+                mock.patch.object(Arrival, 'create_or_update_from_json', side_effect=fail):
+            _, flights, errors, _, _ = update_historical.backfill_date('2018-05-30')
+        self.assertEqual(flights, 40)
+        self.assertEqual(errors, 20)
+        self.assertFalse(BackfillCheckpoint.objects.filter(date='2018-05-30').exists())
+
+    def test_unexpected_errors_fail_only_their_day(self):
+        with mock.patch.object(update_historical, 'Cycle', side_effect=[RuntimeError('boom'), Cycle('historical')]):
+            date, flights, errors, _, cycle = update_historical.backfill_date(DATE)
+        self.assertEqual((date, flights, errors), (DATE, 0, 1))
+        self.assertEqual(cycle['errors'], {'RuntimeError': 1})
+        self.assertFalse(BackfillCheckpoint.objects.exists())
+
+
+SAMPLE = re.compile(r'^(hkia_[a-z_]+)(\{[a-z_]+="(?:[^"\\\n]|\\.)*"(?:,[a-z_]+="(?:[^"\\\n]|\\.)*")*\})? (\S+)$')
+
+
+class MetricsTestCase(TestCase):
+    def registry(self):
+        registry = Registry()
+        for missed in [0, 2]:
+            cycle = Cycle('statuses')
+            cycle.count('flights_created', 3)
+            cycle.time('fetch', 0.5)
+            if missed:
+                cycle.error(requests.ConnectionError())
+            cycle.set(duration=1.5, lag=0.25, missed=missed)
+            registry.record(cycle.as_dict())
+        registry.collect(lambda: [('spool_backlog_bytes', 'gauge', 'Unwritten spool', [([('job', 'statuses')], 10)])])
+        registry.collect(lambda: [('spool_backlog_bytes', 'gauge', 'Unwritten spool', [([('job', 'fr')], 20)]),
+                                  ('build_info', 'gauge', 'Build', [([], 1), ([('path', 'C:\\spool "a"\n')], 1)])])
+        return registry
+
+    def test_exposition_format(self):
+        text = self.registry().render()
+        self.assertTrue(text.endswith('\n'))
+        families = []
+        for line in text.splitlines():
+            if line.startswith('# HELP ') or line.startswith('# TYPE '):
+                name = line.split(' ')[2]
+                if line.startswith('# TYPE '):
+                    self.assertIn(line.split(' ')[3], ['counter', 'gauge'])
+                    families.append(name)
+                continue
+            match = SAMPLE.match(line)
+            self.assertTrue(match, line)
+            # Samples follow the TYPE line of their own family
+            self.assertEqual(match.group(1), families[-1])
+            float(match.group(3))
+        self.assertEqual(len(families), len(set(families)))
+
+        lines = text.splitlines()
+        self.assertIn('hkia_cycles_total{job="statuses"} 2.0', lines)
+        self.assertIn('hkia_cycle_missed_ticks_total{job="statuses"} 2.0', lines)
+        self.assertIn('hkia_rows_total{job="statuses",kind="flights_created"} 6.0', lines)
+        self.assertIn('hkia_errors_total{job="statuses",type="ConnectionError"} 1.0', lines)
+        self.assertIn('hkia_last_cycle_overrun{job="statuses"} 1.0', lines)
+        self.assertIn('hkia_last_cycle_stage_seconds{job="statuses",stage="fetch"} 0.5', lines)
+        self.assertIn('hkia_spool_backlog_bytes{job="statuses"} 10.0', lines)
+        self.assertIn('hkia_spool_backlog_bytes{job="fr"} 20.0', lines)
+        self.assertIn('hkia_build_info 1.0', lines)
+        self.assertIn('hkia_build_info{path="C:\\\\spool \\"a\\"\\n"} 1.0', lines)
+
+    def test_served_over_http(self):
+        registry = self.registry()
+        server = registry.serve(0, '127.0.0.1')
+        self.addCleanup(server.server_close)
+        self.addCleanup(server.shutdown)
+        url = 'http://{}:{}'.format(*server.server_address[:2])
+        r = requests.get(url + '/metrics')
+        self.assertEqual(r.headers['Content-Type'], 'text/plain; version=0.0.4')
+        self.assertEqual(r.text, registry.render())
+        self.assertEqual(requests.get(url + '/other').status_code, 404)
+
+
+class _Ticker:
+    name = 'ticker'
+
+    def __init__(self, *durations, fail=()):
+        self.durations = list(durations)
+        self.fail = fail
+        self.starts = []
+
+    def fetch(self, cycle):
+        self.starts.append(time.monotonic())
+        time.sleep(self.durations.pop(0) if self.durations else 0)
+        if len(self.starts) in self.fail:
+            raise requests.ConnectionError('down')
+
+    def process(self, data, cycle):
+        return 'ok'
+
+
+class SchedulerTestCase(TestCase):
+    def run_for(self, seconds, poller, interval):
+        scheduler = Scheduler(metrics=Registry())
+        job = scheduler.add(poller, interval)
+        loop = asyncio.new_event_loop()
+        pool = ThreadPoolExecutor(max_workers=2)
+        try:
+            loop.run_until_complete(asyncio.wait_for(scheduler.run_job(job, pool, pool), seconds))
+        except asyncio.TimeoutError:
+            pass
+        finally:
+            pool.shutdown(wait=True)
+            loop.close()
+        return job, scheduler.metrics, [round(s - poller.starts[0], 1) for s in poller.starts]
+
+    def test_runs_stay_on_the_grid(self):
+        # A drifting scheduler would start every 0.15s and only get 4 runs in
+        job, registry, starts = self.run_for(0.58, _Ticker(*[0.05] * 10, fail=[2]), 0.1)
+        self.assertEqual(starts, [0.0, 0.1, 0.2, 0.3, 0.4, 0.5])
+        self.assertEqual((job.runs, job.failures, job.missed), (6, 1, 0))
+        self.assertLess(job.max_lag, 0.05)
+        self.assertEqual(registry.totals['ticker']['errors'], {'ConnectionError': 1})
+
+    def test_overrun_skips_the_ticks_it_covered(self):
+        job, registry, starts = self.run_for(0.45, _Ticker(0.25), 0.1)
+        self.assertEqual(starts, [0.0, 0.3, 0.4])
+        self.assertEqual((job.runs, job.missed), (3, 2))
+        self.assertEqual(registry.totals['ticker']['missed'], 2)
+        self.assertEqual(registry.last['ticker']['missed'], 0)
+
+
+class SnapshotQueueTestCase(TestCase):
+    def fill(self, overflow):
+        queue = SnapshotQueue('normalized', 1, overflow)
+        queue.put(Cycle('test'), {'CX 905': 'Boarding', 'PR 301': 'Boarding'})
+        queue.put(Cycle('test'), {'CX 905': 'Dep 00:20'})
+        queue.close()
+        return queue
+
+    def test_coalesce_keeps_newest_per_flight(self):
+        queue = self.fill('coalesce')
+        cycle, snapshot = queue.get()
+        self.assertEqual(snapshot, {'CX 905': 'Dep 00:20', 'PR 301': 'Boarding'})
+        self.assertEqual((queue.coalesced, cycle.counts['snapshots_coalesced']), (1, 1))
+
+    def test_drop_oldest(self):
+        queue = self.fill('drop-oldest')
+        self.assertEqual(queue.get()[1], {'CX 905': 'Dep 00:20'})
+        self.assertEqual(queue.dropped, 1)
+
+    def test_block_waits_for_consumer(self):
+        queue = SnapshotQueue('normalized', 1, 'block')
+        queue.put(Cycle('test'), {'CX 905': 'Boarding'})
+        producer = threading.Thread(target=queue.put, args=(Cycle('test'), {'CX 905': 'Dep 00:20'}))
+        producer.start()
+        producer.join(0.1)
+        self.assertTrue(producer.is_alive())
+        self.assertEqual(queue.get()[1], {'CX 905': 'Boarding'})
+        producer.join(1)
+        self.assertEqual(queue.get()[1], {'CX 905': 'Dep 00:20'})
+
+
+class SpoolTestCase(TestCase):
+    def setUp(self):
+        self.root = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, self.root)
+
+    def spool(self, **kwargs):
+        return Spool(self.root, segment_bytes=200, fsync=False, **kwargs)
+
+    def fill(self, spool, n):
+        for i in range(n):
+            spool.append(1527552000 + i, {'snapshot': {'CX 905': i}})
+
+    def test_replay_in_order_after_restart(self):
+        spool = self.spool()
+        self.fill(spool, 6)
+        records = spool.read(2)
+        self.assertEqual([r[2]['snapshot']['CX 905'] for r in records], [0, 1])
+        spool.ack(records[-1][0], len(records))
+
+        spool = self.spool()
+        self.assertEqual(spool.pending, 4)
+        self.assertEqual([r[2]['snapshot']['CX 905'] for r in spool.read(10)], [2, 3, 4, 5])
+
+    def test_torn_tail_is_cut_off(self):
+        spool = self.spool()
+        self.fill(spool, 1)
+        last = sorted(f for f in os.listdir(self.root) if f.endswith('.spool'))[-1]
+        with open(os.path.join(self.root, last), 'ab') as f:
+            f.write(b'\x00\x00\x00\xff partial')
+        spool = self.spool()
+        self.fill(spool, 1)
+        self.assertEqual(spool.corrupt, 1)
+        self.assertEqual(len(spool.read(10)), 2)
+
+    def test_size_bound_drops_oldest_segments(self):
+        spool = self.spool(max_bytes=300)
+        self.fill(spool, 10)
+        backlog = spool.backlog()
+        self.assertLessEqual(backlog['bytes'], 300)
+        self.assertEqual(backlog['records'] + backlog['dropped'], 10)
+        self.assertEqual(spool.read(10)[-1][2]['snapshot']['CX 905'], 9)
+
+    def test_ack_after_a_bounds_drop_keeps_pending_exact(self):
+        spool = self.spool(max_bytes=300)
+        self.fill(spool, 2)
+        records = spool.read(2)
+        # Written while the bounds drop the segment those records came from
+        self.fill(spool, 8)
+        spool.ack(records[-1][0], len(records))
+        self.assertEqual(spool.pending, len(spool.read(100)))
+        self.assertEqual(spool.backlog()['records'], spool.pending)
+
+    def test_drain_replays_every_snapshot_unless_asked_to_merge(self):
+        class Poller:
+            name = 'statuses'
+            written = []
+
+            def write(self, snapshot, cycle):
+                self.written.append(snapshot)
+                return 'written'
+
+        for merge, expected in [(1, [{'CX 905': 0}, {'CX 905': 1}, {'CX 905': 2}]), (3, [{'CX 905': 2}])]:
+            shutil.rmtree(self.root)
+            Poller.written = []
+            spool = self.spool()
+            for i in range(3):
+                spool.append(1527552000 + i, dict(Cycle('statuses').as_dict(), snapshot={'CX 905': i}))
+            Pipeline(Poller(), 0, spool=spool, spool_merge=merge).drain(until_empty=True)
+            self.assertEqual(Poller.written, expected)
+            self.assertEqual(spool.pending, 0)
+
+
+class _Raw(io.BytesIO):
+    def read(self, size=None, decode_content=None):
+        return super().read(size)
+
+
+class _Response:
+    def __init__(self, body):
+        self.raw = _Raw(body)
+
+    def close(self):
+        self.raw.close()
+
+
+class ArchiveTestCase(TestCase):
+    def setUp(self):
+        self.root = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, self.root)
+        Departure.bulk_create_or_update_from_json(DATE, DEPARTURES)
+        Arrival.bulk_create_or_update_from_json(DATE, ARRIVALS)
+        manila = pytz.timezone('Asia/Manila')
+        for i, (day, hour) in enumerate([(29, 0), (29, 23), (30, 1)]):
+            FrLog.objects.create(
+                registration='B-HLA', timestamp=manila.localize(datetime(2018, 5, day, hour)), latitude=22.3,
+                longitude=114.1 + i, altitude=1000 * i, unknown_boolean=False, unknown_boolean_2=False, fingerprint=i)
+
+    def test_export_and_read_back_after_the_watermark(self):
+        archive = Archive(self.root)
+        self.assertIsNone(archive.watermark)
+        self.assertEqual(archive.pending_days(date(2018, 5, 29)), [date(2018, 5, 29)])
+
+        with mock.patch.object(core_archive, 'ROW_GROUP', 1):
+            counts = archive.export_day(date(2018, 5, 29))
+        archive.watermark = date(2018, 5, 29)
+        self.assertEqual(counts, {'flights': 3, 'statuses': 3, 'positions': 2})
+        self.assertEqual(archive.pending_days(date(2018, 5, 30)), [date(2018, 5, 30)])
+
+        departures = archive.flights(direction='departure').sort_by('id').to_pydict()
+        self.assertEqual(departures['flight_numbers'], [['CX 905', 'PR 3005'], ['PR 301']])
+        self.assertEqual(departures['airports'], [['MNL'], ['MNL']])
+        self.assertEqual(departures['status_code'], ['DE', 'BO'])
+        self.assertEqual(departures['gate'], ['23', '5'])
+        self.assertEqual(archive.flights(direction='arrival').to_pydict()['stand'], ['N1'])
+        self.assertEqual(sorted(archive.statuses().to_pydict()['status_code']), ['BO', 'DE', 'ON'])
+        self.assertEqual(archive.positions(columns=['altitude']).to_pydict(), {'altitude': [0, 1000]})
+
+        path = os.path.join(self.root, 'flights', 'direction=departure', 'date=2018-05-29', 'part-0.parquet')
+        self.assertEqual(pq.ParquetFile(path).num_row_groups, 2)
+
+        # An empty day is still written, with the schema
+        self.assertEqual(archive.export_day(date(2018, 5, 28))['flights'], 0)
+        self.assertEqual(archive.flights(end=date(2018, 5, 28)).num_rows, 0)
+        self.assertEqual(archive.positions(start=date(2018, 5, 29)).num_rows, 2)
+
+
+class _Chunked:
+    # A socket that hands out a few bytes at a time, so the parser has to stitch tokens across reads
+    def __init__(self, body, size=7):
+        self.body = io.BytesIO(body)
+        self.size = size
+        self.closed = False
+
+    def read(self, size=-1, decode_content=None):
+        return self.body.read(self.size if size is None or size < 0 else min(size, self.size))
+
+    def readinto(self, buffer):
+        data = self.read(len(buffer))
+        buffer[:len(data)] = data
+        return len(data)
+
+    def close(self):
+        self.closed = True
+
+
+class _ChunkedResponse:
+    def __init__(self, body, size=7):
+        self.raw = _Chunked(body, size)
+        self.body = body
+
+    def json(self):
+        return json.loads(self.body)
+
+    def close(self):
+        self.raw.close()
+
+
+class StreamingTestCase(TestCase):
+    # The first day lists its flights before its date, as the feed sometimes does
+    BODY = json.dumps([
+        {'arrival': False, 'list': DEPARTURES, 'cargo': False, 'date': '2018-05-28'},
+        {'date': '2018-05-29', 'arrival': False, 'cargo': False, 'list': DEPARTURES[:1]},
+    ]).encode()
+
+    def test_iter_flights_streams_early_flights_under_their_date(self):
+        pairs = list(iter_flights(_ChunkedResponse(self.BODY)))
+        self.assertEqual([(d, f['flight'][0]['no']) for d, f in pairs],
+                         [('2018-05-28', 'CX 905'), ('2018-05-28', 'PR 301'), ('2018-05-29', 'CX 905')])
+        self.assertEqual(pairs[0][1], DEPARTURES[0])
+        with mock.patch.object(core_streaming, 'ijson', None):
+            self.assertEqual(list(iter_flights(_ChunkedResponse(self.BODY))), pairs)
+
+    def test_read_days_groups_by_date(self):
+        self.assertEqual(read_days(_ChunkedResponse(self.BODY, 3)), [
+            {'date': '2018-05-28', 'list': DEPARTURES},
+            {'date': '2018-05-29', 'list': DEPARTURES[:1]},
+        ])
+
+    def test_poller_keys_flights_as_they_stream(self):
+        poller = StatusPoller()
+        self.addCleanup(dimensions.disable)
+        results = poller.replay({'passenger_departure': _ChunkedResponse(self.BODY)})
+        flights = poller.normalize(results, Cycle('statuses'))
+        self.assertEqual(len(flights), 3)
+        self.assertEqual(sorted(date for _, _, date, _ in flights.values()), ['2018-05-28', '2018-05-28', '2018-05-29'])
+        self.assertTrue(all((cargo, arrival) == ('false', 'false') for cargo, arrival, _, _ in flights.values()))
+
+
+class RawFeedArchiveTestCase(TestCase):
+    def setUp(self):
+        self.root = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, self.root)
+
+    def test_record_deduplicate_and_replay(self):
+        archive = RawFeedArchive(self.root)
+        body = json.dumps([{'date': '2018-05-29', 'list': [{'time': '00:05', 'flight': [{'no': 'CX 905'}]}]}]).encode()
+        for fetched in [1527552000, 1527552030]:
+            days = read_days(archive.record(_Response(body), 'statuses', 'passenger_arrival', fetched))
+            self.assertEqual(days[0]['list'][0]['flight'][0]['no'], 'CX 905')
+        self.assertEqual((archive.stored, archive.deduplicated), (1, 1))
+
+        cycles = archive.cycles('statuses')
+        self.assertEqual([fetched for fetched, _ in cycles], [1527552000, 1527552030])
+        self.assertEqual(cycles[0][1], cycles[1][1])
+        response = ArchivedResponse(cycles[1][1]['passenger_arrival'])
+        self.assertEqual(read_days(response), json.loads(body))
+        response.close()
+        self.assertEqual(archive.cycles('statuses', since=1527552010), cycles[1:])
+
+    def test_unfinished_response_is_not_kept(self):
+        archive = RawFeedArchive(self.root)
+        archive.record(_Response(b'[{"date": "2018-05-29", "list": []}]'), 'statuses', 'cargo_arrival', 1527552000).close()
+        self.assertEqual(archive.cycles('statuses'), [])
+        self.assertEqual(os.listdir(os.path.join(self.root, 'blobs')), [])
+
+
+class MockFeedsTestCase(TestCase):
+    def test_flights_are_stable_and_churn(self):
+        feeds = MockFeeds(flights_per_day=4000, churn=0.1)
+        now = 1527552000
+        days = feeds.flights('2018-05-29', False, True, span=2, now=now)
+        self.assertEqual([d['date'] for d in days], ['2018-05-29', '2018-05-30'])
+        self.assertEqual(len(days[0]['list']), 1500)
+        self.assertEqual(MockFeeds(flights_per_day=4000, churn=0.1).flights('2018-05-29', False, True, now=now), days[:1])
+
+        later = feeds.flights('2018-05-29', False, True, now=now + 60)[0]['list']
+        changed = sum(a['status'] != b['status'] for a, b in zip(days[0]['list'], later))
+        self.assertAlmostEqual(changed / len(later), 0.1, delta=0.03)
+        self.assertEqual([a['flight'] for a in days[0]['list']], [b['flight'] for b in later])
+
+    def test_feed_rows(self):
+        feed = MockFeeds(aircraft=500).feed(now=1527552000)
+        rows = [v for v in feed.values() if isinstance(v, list)]
+        self.assertEqual(len(rows), 500)
+        self.assertTrue(all(len(r) == len(FEED_FIELDS) for r in rows))
+        self.assertTrue(100 < len(tracked_feeds(rows)) < 500)
+
+    def test_served_over_http(self):
+        server = serve(MockFeeds(flights_per_day=400, aircraft=100), port=0)
+        threading.Thread(target=server.serve_forever, daemon=True).start()
+        self.addCleanup(server.server_close)
+        self.addCleanup(server.shutdown)
+        url = 'http://{}:{}'.format(*server.server_address[:2])
+
+        r = requests.get(url + '/flightinfo-rest/rest/flights?span=2&date=2018-05-29&lang=en&cargo=true&arrival=false', stream=True)
+        self.assertEqual(r.headers['Content-Encoding'], 'gzip')
+        self.assertEqual([len(d['list']) for d in read_days(r)], [50, 50])
+        r = requests.get(url + '/zones/fcgi/feed.js', stream=True)
+        self.assertEqual(len(list(stream_feed_rows(r))), 100)
+        self.assertEqual(requests.get(url + '/unknown').status_code, 404)
+
+
+class BenchmarkFixturesTestCase(TestCase):
+    def test_generated_fixtures_replay_offline(self):
+        root = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, root)
+        self.addCleanup(dimensions.disable)
+        call_command('benchmark_ingest', root, generate=2, flights_per_day=40, aircraft=50)
+        command = benchmark_ingest.Command()
+        fixtures = {source: command.load(root, source) for source in ['statuses', 'fr', 'reference']}
+        self.assertEqual({k: len(v) for k, v in fixtures.items()}, {'statuses': 2, 'fr': 2, 'reference': 1})
+        self.assertNotEqual(fixtures['fr'][0], fixtures['fr'][1])
+
+        for name, (source, _, _, _) in sorted(benchmark_ingest.SCENARIOS.items()):
+            result = command.run(name, fixtures[source])
+            self.assertEqual(result['cycles'], len(fixtures[source]), name)
+            self.assertGreater(result['items'], 0, name)
+        # Two days of 40 flights, left by the last statuses scenario
+        self.assertEqual(Departure.objects.count() + Arrival.objects.count(), 80)
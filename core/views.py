@@ -1,5 +1,99 @@
+import hashlib
+import json
+import time
+from calendar import timegm
+
+from dateutil.parser import parse
+from django.core.cache import cache
+from django.core.serializers.json import DjangoJSONEncoder
+from django.http import HttpResponse, JsonResponse, StreamingHttpResponse
 from django.shortcuts import render
+from django.utils import timezone
+from django.utils.cache import get_conditional_response, patch_cache_control
+from django.utils.http import http_date, quote_etag
+from django.views.decorators.http import require_GET
+
+from core.events import get_broker, matches
+from core.models import Arrival, Departure
+
+# Boards only change once per poll cycle, so every client in a cycle shares one rendered response
+CACHE_SECONDS = 30
+FILTERS = ['terminal', 'airline', 'status']
+STREAM_FILTERS = ['direction', 'flight', 'airline', 'terminal']
+KEEPALIVE_SECONDS = 15
 
 
 def index(request):
     return render(request, 'index.html')
+
+
+def board(request, model):
+    try:
+        date = parse(request.GET['date']).date() if request.GET.get('date') else timezone.localdate()
+    except (ValueError, OverflowError):
+        return JsonResponse({'error': 'Invalid date'}, status=400)
+    filters = {k: request.GET.get(k) or None for k in FILTERS}
+
+    now = time.time()
+    cycle = int(now // CACHE_SECONDS)
+    params = json.dumps([model._meta.model_name, date.isoformat(), filters], sort_keys=True)
+    key = 'board:{}:{}'.format(cycle, hashlib.md5(params.encode()).hexdigest())
+    cached = cache.get(key)
+    if cached is None:
+        flights = [flight.to_json() for flight in model.board(date, **filters)]
+        body = json.dumps({'date': date, 'flights': flights}, cls=DjangoJSONEncoder)
+        last_changed = model.last_changed(date)
+        cached = {
+            'body': body,
+            'etag': quote_etag(hashlib.md5(body.encode()).hexdigest()),
+            'last_modified': timegm(last_changed.utctimetuple()) if last_changed else None,
+        }
+        cache.set(key, cached, CACHE_SECONDS)
+
+    response = get_conditional_response(request, etag=cached['etag'], last_modified=cached['last_modified'])
+    if response is None:
+        response = HttpResponse(cached['body'], content_type='application/json')
+    response['ETag'] = cached['etag']
+    if cached['last_modified']:
+        response['Last-Modified'] = http_date(cached['last_modified'])
+    patch_cache_control(response, public=True, max_age=max(1, int((cycle + 1) * CACHE_SECONDS - now)))
+    return response
+
+
+@require_GET
+def departures(request):
+    return board(request, Departure)
+
+
+@require_GET
+def arrivals(request):
+    return board(request, Arrival)
+
+
+class EventStream:
+    def __init__(self, subscription, filters):
+        self.subscription = subscription
+        self.filters = filters
+
+    def __iter__(self):
+        yield 'retry: 3000\n\n'
+        while True:
+            event = self.subscription.get(timeout=KEEPALIVE_SECONDS)
+            if event is None:
+                yield ': keepalive\n\n'
+            elif matches(event, self.filters):
+                yield 'id: {}\nevent: status\ndata: {}\n\n'.format(event['id'], json.dumps(event, cls=DjangoJSONEncoder))
+
+    def close(self):
+        # Called by the handler when the client goes away
+        self.subscription.close()
+
+
+@require_GET
+def stream(request):
+    filters = {k: [v for v in request.GET.getlist(k) if v] for k in STREAM_FILTERS}
+    # Subscribe before returning so nothing published while the response starts is missed
+    response = StreamingHttpResponse(EventStream(get_broker().subscribe(), filters), content_type='text/event-stream')
+    response['Cache-Control'] = 'no-cache'
+    response['X-Accel-Buffering'] = 'no'
+    return response
@@ -1,3 +1,10 @@
 from django.contrib import admin
 
-# Register your models here.
+from core.admin import LargeTableAdmin
+from fr.models import FrLog
+
+
+@admin.register(FrLog)
+class FrLogAdmin(LargeTableAdmin):
+    list_display = ['id', 'timestamp', 'registration', 'flight', 'callsign', 'origin', 'destination', 'altitude', 'speed']
+    search_fields = ['=registration']
@@ -0,0 +1,98 @@
+try:
+    import numpy as np
+except ImportError:
+    np = None
+
+try:
+    import ijson
+except ImportError:
+    ijson = None
+
+from fr.models import FEED_FIELDS, TRACKED_AIRPORTS, TRACKED_CALLSIGNS, FrLog
+
+COLUMNS = {f: i for i, f in enumerate(FEED_FIELDS)}
+
+
+def feed_rows(data):
+    return [v for v in data.values() if isinstance(v, list)]
+
+
+def feed_items(data):
+    return [(k, v) for k, v in data.items() if isinstance(v, list)]
+
+
+def stream_feed_items(response):
+    # (feed id, aircraft row) one at a time straight off the socket, without the body, its text or the top-level dict
+    try:
+        if ijson is None:
+            yield from feed_items(response.json())
+            return
+        response.raw.decode_content = True
+        for key, value in ijson.kvitems(response.raw, '', use_float=True):
+            if isinstance(value, list):
+                yield key, value
+    finally:
+        response.close()
+
+
+def stream_feed_rows(response):
+    for _, row in stream_feed_items(response):
+        yield row
+
+
+def tracked_items(items):
+    # (feed id, feed) for the tracked rows among (feed id, row) pairs
+    # Short rows cannot be fingerprinted or saved, both paths leave them out
+    if np is None:
+        feeds = ((k, dict(zip(FEED_FIELDS, r))) for k, r in items if len(r) >= len(FEED_FIELDS))
+        return [(k, _) for k, _ in feeds if _safe(FrLog.is_tracked, _)]
+
+    items = [(k, r) for k, r in items if len(r) >= len(FEED_FIELDS)]
+    if not items:
+        return []
+    # Only the filtered columns become arrays, a whole-row array would choke on any nested value
+    origin = np.array([str(r[COLUMNS['origin']]) for _, r in items])
+    destination = np.array([str(r[COLUMNS['destination']]) for _, r in items])
+    callsign = [r[COLUMNS['callsign']] for _, r in items]
+    mask = np.isin(origin, TRACKED_AIRPORTS) | np.isin(destination, TRACKED_AIRPORTS)
+    # Non-string callsigns make the row-by-row filter raise, so they never match
+    is_str = np.fromiter((isinstance(c, str) for c in callsign), dtype=bool, count=len(callsign))
+    callsign = np.array([c if isinstance(c, str) else '' for c in callsign])
+    for prefix in TRACKED_CALLSIGNS:
+        mask |= is_str & np.char.startswith(callsign, prefix)
+    return [(items[i][0], dict(zip(FEED_FIELDS, items[i][1]))) for i in np.flatnonzero(mask)]
+
+
+def tracked_feeds(rows):
+    return [feed for _, feed in tracked_items(enumerate(rows))]
+
+
+def drop_cruising(candidates, last):
+    # Only registrations seen once this cycle can be judged against the state from the start of the cycle
+    if np is None or not candidates:
+        return candidates
+
+    registrations = [feed['registration'] for _, feed in candidates]
+    counts = {}
+    for r in registrations:
+        counts[r] = counts.get(r, 0) + 1
+    known = [counts[r] == 1 and r in last for r in registrations]
+    if not any(known):
+        return candidates
+
+    single = np.array(known, dtype=bool)
+    last_ts = np.array([last[r].timestamp.timestamp() if k else np.nan for r, k in zip(registrations, known)])
+    last_vs = np.array([last[r].vertical_speed if k else None for r, k in zip(registrations, known)], dtype=float)
+    ts = np.array([feed['timestamp'] for _, feed in candidates], dtype=float)
+    vs = np.array([feed['vertical_speed'] for _, feed in candidates], dtype=float)
+    alt = np.array([feed['altitude'] for _, feed in candidates], dtype=float)
+    with np.errstate(invalid='ignore'):
+        cruising = single & (ts - last_ts <= 300) & (np.abs(last_vs - vs) < 100) & (alt > 1000)
+    return [c for c, drop in zip(candidates, cruising) if not drop]
+
+
+def _safe(func, *args):
+    try:
+        return func(*args)
+    except Exception:
+        return False
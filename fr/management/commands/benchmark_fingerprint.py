@@ -0,0 +1,43 @@
+import hashlib
+import random
+import timeit
+
+from django.core.management.base import BaseCommand
+
+from fr.models import FEED_FIELDS, FrLog
+
+
+def legacy_hash_feed(feed):
+    feed = feed.copy()
+    del feed['timestamp']
+    del feed['bearing']
+    del feed['radar']
+    keys = sorted(feed.keys())
+    concatenate = ''
+    for _ in keys:
+        concatenate = concatenate + str(feed[_])
+
+    return hashlib.md5(concatenate.encode('utf-8')).hexdigest()
+
+
+def sample_feed(i):
+    return dict(zip(FEED_FIELDS, [
+        '{:06X}'.format(i), 22.3 + random.random(), 114.1 + random.random(), random.randint(0, 359),
+        random.randint(0, 41000), random.randint(0, 520), '{:04d}'.format(random.randint(0, 7777)), 'T-VHHH1', 'A333',
+        'B-H{:03d}'.format(i % 1000), 1527500000 + i, 'HKG', 'MNL', 'CX{}'.format(i), 0, random.randint(-2000, 2000),
+        'CPA{}'.format(i), 0
+    ]))
+
+
+class Command(BaseCommand):
+    help = 'Compare per-entry cost of the legacy MD5 feed hash with FrLog.fingerprint_feed'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--entries', type=int, default=10000)
+        parser.add_argument('--repeat', type=int, default=5)
+
+    def handle(self, *args, **options):
+        feeds = [sample_feed(i) for i in range(options['entries'])]
+        for name, func in [('md5 hash_feed', legacy_hash_feed), ('xxh3 fingerprint', FrLog.fingerprint_feed)]:
+            best = min(timeit.repeat(lambda: [func(_) for _ in feeds], number=1, repeat=options['repeat']))
+            print('{:<18} {:.3f}us per entry'.format(name, best / len(feeds) * 1e6))
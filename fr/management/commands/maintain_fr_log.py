@@ -0,0 +1,66 @@
+from datetime import datetime, time, timedelta
+
+from django.core.management.base import BaseCommand, CommandError
+from django.db import connection
+from django.utils import timezone
+
+from fr import partitions
+from fr.models import FrLog
+
+
+class Command(BaseCommand):
+    help = 'Partition fr_log by day or month, create partitions ahead of time and drop or archive expired ones'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--granularity', choices=[partitions.DAY, partitions.MONTH],
+                            help='Partition size for --convert (default day), a partitioned table keeps the one it has')
+        parser.add_argument('--ahead', type=int, default=7, help='Days of partitions to keep created in advance')
+        parser.add_argument('--retain-days', type=int, help='Drop partitions that end more than this many days ago')
+        parser.add_argument('--archive', action='store_true',
+                            help='Swap expired partitions out into fr_log_<period> tables instead of dropping them')
+        parser.add_argument('--convert', action='store_true', help='Partition an existing unpartitioned fr_log')
+        parser.add_argument('--batch-size', type=int, default=10000)
+
+    def handle(self, *args, **options):
+        today = timezone.now().date()
+        cutoff = today - timedelta(days=options['retain_days']) if options['retain_days'] is not None else None
+
+        if connection.vendor != 'mysql':
+            if cutoff is None:
+                raise CommandError('Partitioning fr_log requires MySQL')
+            self.delete_before(cutoff, options['batch_size'])
+            return
+
+        if not partitions.is_partitioned():
+            if not options['convert']:
+                raise CommandError('fr_log is not partitioned, run with --convert first')
+            granularity = options['granularity'] or partitions.DAY
+            first = FrLog.objects.order_by('timestamp').values_list('timestamp', flat=True).first()
+            start = first.date() if first else today
+            print('Converting fr_log to {} partitions from {}'.format(granularity, start))
+            partitions.convert(granularity, start, today + timedelta(days=options['ahead']))
+        else:
+            try:
+                granularity = partitions.granularity()
+            except ValueError as e:
+                raise CommandError(str(e))
+            if options['granularity'] and options['granularity'] != granularity:
+                raise CommandError('fr_log is partitioned by {}, not {}'.format(granularity, options['granularity']))
+            added = partitions.add_partitions(granularity, today + timedelta(days=options['ahead']))
+            print('Added {} {} partitions'.format(added, granularity))
+
+        if cutoff is not None:
+            expired = partitions.expire(cutoff, archive=options['archive'])
+            print('{} {} partitions: {}'.format(
+                'Archived' if options['archive'] else 'Dropped', len(expired), ', '.join(expired) or '-'))
+
+    def delete_before(self, cutoff, batch_size):
+        # Without partitions expiry is a plain batched delete
+        deleted = 0
+        before = timezone.make_aware(datetime.combine(cutoff, time()), timezone.utc)
+        while True:
+            pks = list(FrLog.objects.filter(timestamp__lt=before).values_list('pk', flat=True)[:batch_size])
+            if not pks:
+                break
+            deleted += FrLog.objects.filter(pk__in=pks).delete()[0]
+        print('Deleted {} rows older than {}'.format(deleted, cutoff))
@@ -1,76 +1,37 @@
-import time
-
 from django.core.management.base import BaseCommand
-import requests
 
-from fr.models import FrLog
+from core.metrics import Registry
+from core.pipeline import OVERFLOW_POLICIES, Pipeline
+from core.rawfeeds import RawFeedArchive
+from core.spool import Spool
+from fr.pollers import FrPoller
 
 
 class Command(BaseCommand):
-    help = 'Create choose one question'
+    help = 'Poll the FR24 feed every 5s'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--interval', type=float, default=5)
+        parser.add_argument('--queue-size', type=int, default=2, help='Parsed snapshots allowed to wait for the writer')
+        parser.add_argument('--overflow', choices=OVERFLOW_POLICIES, default='coalesce',
+                            help='What to do when the writer falls behind and the queue is full')
+        parser.add_argument('--spool', metavar='DIR', help='Write-ahead spool for snapshots, written to the database from there')
+        parser.add_argument('--spool-max-mb', type=int, default=512)
+        parser.add_argument('--spool-max-age', type=float, default=24, help='Hours')
+        parser.add_argument('--spool-merge', type=int, default=1,
+                            help='Spooled snapshots merged into one write when catching up, 1 writes every snapshot')
+        parser.add_argument('--archive-raw', metavar='DIR', help='Keep every raw response, compressed and deduplicated, for replay_raw_feeds')
+        parser.add_argument('--metrics-file', help='Append per-cycle metrics as JSON lines')
+        parser.add_argument('--metrics-port', type=int, help='Serve Prometheus metrics on this port')
 
     def handle(self, *args, **options):
-        fields = ['mode_s_code',
-                  'latitude',
-                  'longitude',
-                  'bearing',
-                  'altitude',
-                  'speed',
-                  'squawk',
-                  'radar',
-                  'model',
-                  'registration',
-                  'timestamp',
-                  'origin',
-                  'destination',
-                  'flight',
-                  'unknown_boolean',
-                  'vertical_speed',
-                  'callsign',
-                  'unknown_boolean_2']
-
-        found_hashes = set()
-
-        while True:
-            start = time.time()
-            while True:
-                r = requests.get(
-                    'https://data-live.flightradar24.com/zones/fcgi/feed.js?bounds=26.85,2.58,99.27,134.69&faa=1&mlat=1&flarm=1&adsb=1&gnd=1&air=1&vehicles=1&estimated=1&maxage=14400&gliders=1&stats=1',
-                    headers={'accept': 'application/json, text/javascript, */*; q=0.01',
-                             'user-agent': 'Mozilla/5.0 (Macintosh; Intel Mac OS X 10_13_4) AppleWebKit/537.36 (KHTML, like Gecko) Chrome/66.0.3359.181 Safari/537.36',
-                             'referer': 'https://www.flightradar24.com/11.77,117.95/4'})
-                if r.status_code == 200:
-                    data = r.json()
-                    break
-                time.sleep(1)
-                print('Sleeping for a second, problem fetching with status {}'.format(r.status_code))
-
-            to_delete = ['full_count', 'stats', 'version']
-            for _ in to_delete:
-                del data[_]
-
-            data_list = list(data.values())
-            data_list = [dict(zip(fields, _)) for _ in data_list]
-
-            this_set_hash = set()
-
-            ctr = 0
-
-            for _ in data_list:
-                try:
-                    hash = FrLog.hash_feed(_)
-                    this_set_hash.add(hash)
-                    if hash in found_hashes:
-                        continue
-                    fr_log, created = FrLog.create_from_feed(hash, _)
-                    if created:
-                        ctr += 1
-                except:
-                    pass
-
-            found_hashes = this_set_hash
-
-            end = time.time()
-            print('Finished cycle with {} new logs in {}s'.format(ctr, end - start))
-            time.sleep(5 - ((end - start) % 5))
-
+        registry = Registry(options['metrics_file'])
+        if options['metrics_port']:
+            registry.serve(options['metrics_port'])
+        spool = None
+        if options['spool']:
+            spool = Spool(options['spool'], options['spool_max_mb'] * 1024 * 1024, options['spool_max_age'] * 60 * 60)
+            print('Spool has {records} snapshot(s) waiting, {bytes} bytes'.format(**spool.backlog()))
+        archive = RawFeedArchive(options['archive_raw']) if options['archive_raw'] else None
+        Pipeline(FrPoller(archive), options['interval'], options['queue_size'], options['overflow'], metrics=registry, spool=spool,
+                 spool_merge=options['spool_merge']).run()
@@ -0,0 +1,60 @@
+# Generated by Django 2.2.28 on 2026-10-18 10:40
+
+from django.db import migrations, models
+
+import struct
+import xxhash
+
+FINGERPRINT_NUMBERS = ['latitude', 'longitude', 'altitude', 'speed', 'vertical_speed', 'unknown_boolean',
+                       'unknown_boolean_2']
+FINGERPRINT_STRINGS = ['mode_s_code', 'squawk', 'model', 'registration', 'origin', 'destination', 'flight', 'callsign']
+FINGERPRINT_STRUCT = struct.Struct('<ddqqqqq')
+
+
+def fingerprint(values):
+    # Same as FrLog.fingerprint_feed; the feed carries the two flags as 0/1, the table as booleans
+    numbers = tuple(int(v) if isinstance(v, bool) else v for v in values[:len(FINGERPRINT_NUMBERS)])
+    strings = tuple(values[len(FINGERPRINT_NUMBERS):])
+    try:
+        data = FINGERPRINT_STRUCT.pack(*numbers) + '\x1f'.join(strings).encode('utf-8')
+    except (struct.error, TypeError):
+        data = '\x1f'.join(map(str, numbers + strings)).encode('utf-8')
+    h = xxhash.xxh3_64_intdigest(data)
+    return h - (1 << 64) if h >= (1 << 63) else h
+
+
+def populate_fingerprint(apps, schema_editor):
+    FrLog = apps.get_model('fr', 'FrLog')
+    batch = []
+    for pk, *values in FrLog.objects.filter(fingerprint=None).values_list('pk', *(FINGERPRINT_NUMBERS + FINGERPRINT_STRINGS)).iterator():
+        batch.append(FrLog(pk=pk, fingerprint=fingerprint(values)))
+        if len(batch) >= 1000:
+            FrLog.objects.bulk_update(batch, ['fingerprint'])
+            batch = []
+    if batch:
+        FrLog.objects.bulk_update(batch, ['fingerprint'])
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('fr', '0002_auto_20180529_0229'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='frlog',
+            name='fingerprint',
+            field=models.BigIntegerField(null=True),
+        ),
+        migrations.RunPython(populate_fingerprint, migrations.RunPython.noop),
+        migrations.RemoveField(
+            model_name='frlog',
+            name='hash',
+        ),
+        migrations.AlterField(
+            model_name='frlog',
+            name='fingerprint',
+            field=models.BigIntegerField(db_index=True),
+        ),
+    ]
@@ -0,0 +1,53 @@
+# Generated by Django 2.2.28 on 2026-10-18 10:22
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('fr', '0003_frlog_fingerprint'),
+    ]
+
+    operations = [
+        migrations.AlterField(
+            model_name='frlog',
+            name='callsign',
+            field=models.CharField(blank=True, max_length=255, null=True),
+        ),
+        migrations.AlterField(
+            model_name='frlog',
+            name='destination',
+            field=models.CharField(blank=True, max_length=3, null=True),
+        ),
+        migrations.AlterField(
+            model_name='frlog',
+            name='fingerprint',
+            field=models.BigIntegerField(),
+        ),
+        migrations.AlterField(
+            model_name='frlog',
+            name='flight',
+            field=models.CharField(blank=True, max_length=16, null=True),
+        ),
+        migrations.AlterField(
+            model_name='frlog',
+            name='model',
+            field=models.CharField(blank=True, max_length=16, null=True),
+        ),
+        migrations.AlterField(
+            model_name='frlog',
+            name='origin',
+            field=models.CharField(blank=True, max_length=3, null=True),
+        ),
+        migrations.AlterField(
+            model_name='frlog',
+            name='registration',
+            field=models.CharField(blank=True, max_length=64, null=True),
+        ),
+        migrations.AlterField(
+            model_name='frlog',
+            name='squawk',
+            field=models.CharField(blank=True, max_length=255, null=True),
+        ),
+    ]
@@ -1,23 +1,57 @@
 import pytz
-import hashlib
+import struct
+import xxhash
+from operator import itemgetter
 from datetime import datetime, timedelta
 
 from django.db import models
 
+FEED_FIELDS = ['mode_s_code',
+               'latitude',
+               'longitude',
+               'bearing',
+               'altitude',
+               'speed',
+               'squawk',
+               'radar',
+               'model',
+               'registration',
+               'timestamp',
+               'origin',
+               'destination',
+               'flight',
+               'unknown_boolean',
+               'vertical_speed',
+               'callsign',
+               'unknown_boolean_2']
+
+TRACKED_AIRPORTS = ['HKG', 'MNL', 'MFM', 'CEB', 'DVO', 'GES', 'ILO', 'KLO', 'USU', 'ENI']
+TRACKED_CALLSIGNS = ['CPA', 'PAL', 'CEB', 'APG']
+
+# Everything but timestamp, bearing and radar, so an aircraft that has not moved keeps its fingerprint
+FINGERPRINT_NUMBERS = ['latitude', 'longitude', 'altitude', 'speed', 'vertical_speed', 'unknown_boolean',
+                       'unknown_boolean_2']
+FINGERPRINT_STRINGS = ['mode_s_code', 'squawk', 'model', 'registration', 'origin', 'destination', 'flight', 'callsign']
+_fingerprint_numbers = itemgetter(*FINGERPRINT_NUMBERS)
+_fingerprint_strings = itemgetter(*FINGERPRINT_STRINGS)
+_fingerprint_struct = struct.Struct('<ddqqqqq')
+
 
 class FrLog(models.Model):
     class Meta:
         db_table = 'fr_log'
+        # Last positions are read by registration and archives scan by timestamp. fingerprint is deliberately not
+        # indexed: duplicates are caught in memory by FrPoller and FrLogWriter, nothing looks a fingerprint up.
         indexes = [models.Index(fields=['registration', 'timestamp'])]
 
-    flight = models.CharField(max_length=16, blank=True, null=True, db_index=True)
-    registration = models.CharField(max_length=64, blank=True, null=True, db_index=True)
-    model = models.CharField(max_length=16, blank=True, null=True, db_index=True)
-    callsign = models.CharField(max_length=255, blank=True, null=True, db_index=True)
+    flight = models.CharField(max_length=16, blank=True, null=True)
+    registration = models.CharField(max_length=64, blank=True, null=True)
+    model = models.CharField(max_length=16, blank=True, null=True)
+    callsign = models.CharField(max_length=255, blank=True, null=True)
 
     timestamp = models.DateTimeField(db_index=True)
-    origin = models.CharField(max_length=3, blank=True, null=True, db_index=True)
-    destination = models.CharField(max_length=3, blank=True, null=True, db_index=True)
+    origin = models.CharField(max_length=3, blank=True, null=True)
+    destination = models.CharField(max_length=3, blank=True, null=True)
 
     latitude = models.FloatField()
     longitude = models.FloatField()
@@ -28,55 +62,61 @@ class FrLog(models.Model):
     radar = models.CharField(max_length=64, blank=True, null=True)
 
     mode_s_code = models.CharField(max_length=255, blank=True, null=True)
-    squawk = models.CharField(max_length=255, blank=True, null=True, db_index=True)
+    squawk = models.CharField(max_length=255, blank=True, null=True)
 
     unknown_boolean = models.BooleanField()
     unknown_boolean_2 = models.BooleanField()
 
-    hash = models.CharField(max_length=32, db_index=True)
+    fingerprint = models.BigIntegerField()
 
     @classmethod
-    def create_from_feed(cls, hash, feed):
-        if not (
+    def is_tracked(cls, feed):
+        return (
             any(
                 feed['destination'] == _ or feed['origin'] == _
-                for _ in ['HKG', 'MNL', 'MFM', 'CEB', 'DVO', 'GES', 'ILO', 'KLO', 'USU', 'ENI']
+                for _ in TRACKED_AIRPORTS
             ) or
             any(
-                feed['callsign'].startswith(_) for _ in ['CPA', 'PAL', 'CEB', 'APG']
+                feed['callsign'].startswith(_) for _ in TRACKED_CALLSIGNS
             )
-        ):
+        )
+
+    @classmethod
+    def is_cruising(cls, last_log, timestamp, feed):
+        return (
+            (timestamp - last_log.timestamp).total_seconds() <= 300 and
+            abs(last_log.vertical_speed - feed['vertical_speed']) < 100 and  # Cruising
+            feed['altitude'] > 1000  # Above 1000ft
+        )
+
+    @classmethod
+    def create_from_feed(cls, fingerprint, feed):
+        if not cls.is_tracked(feed):
             return None, False
         feed = feed.copy()
         last_log = cls.objects.filter(registration=feed['registration']).order_by('-timestamp').first()
-        if last_log and last_log.hash == hash:
+        if last_log and last_log.fingerprint == fingerprint:
             return last_log, False
 
         feed['timestamp'] = datetime.fromtimestamp(feed['timestamp'], pytz.timezone('Asia/Manila'))
-        if last_log:
-            if (
-                (feed['timestamp'] - last_log.timestamp).total_seconds() <= 300 and
-                abs(last_log.vertical_speed - feed['vertical_speed']) < 100 and  # Cruising
-                feed['altitude'] > 1000  # Above 1000ft
-            ):
-                return last_log, False
+        if last_log and cls.is_cruising(last_log, feed['timestamp'], feed):
+            return last_log, False
 
         log = FrLog()
         for k, v in feed.items():
             setattr(log, k, v)
-        log.hash = hash
+        log.fingerprint = fingerprint
         log.save()
         return log, True
 
     @classmethod
-    def hash_feed(cls, feed):
-        feed = feed.copy()
-        del feed['timestamp']
-        del feed['bearing']
-        del feed['radar']
-        keys = sorted(feed.keys())
-        concatenate = ''
-        for _ in keys:
-            concatenate = concatenate + str(feed[_])
-
-        return hashlib.md5(concatenate.encode('utf-8')).hexdigest()
+    def fingerprint_feed(cls, feed):
+        numbers = _fingerprint_numbers(feed)
+        strings = _fingerprint_strings(feed)
+        try:
+            data = _fingerprint_struct.pack(*numbers) + '\x1f'.join(strings).encode('utf-8')
+        except (struct.error, TypeError):
+            # Missing values, only seen on odd feed entries
+            data = '\x1f'.join(map(str, numbers + strings)).encode('utf-8')
+        h = xxhash.xxh3_64_intdigest(data)
+        return h - (1 << 64) if h >= (1 << 63) else h  # Fit a signed BIGINT
@@ -0,0 +1,98 @@
+from datetime import date, timedelta
+
+from django.db import connection
+
+from fr.models import FrLog
+
+TABLE = FrLog._meta.db_table
+DAY = 'day'
+MONTH = 'month'
+
+
+def period_start(d, granularity):
+    return d if granularity == DAY else d.replace(day=1)
+
+
+def next_period(d, granularity):
+    if granularity == DAY:
+        return d + timedelta(days=1)
+    return (d.replace(day=1) + timedelta(days=32)).replace(day=1)
+
+
+def partition_name(start, granularity):
+    return 'p' + start.strftime('%Y%m%d' if granularity == DAY else '%Y%m')
+
+
+def partition_clause(start, granularity):
+    return 'PARTITION {} VALUES LESS THAN (TO_DAYS(\'{}\'))'.format(
+        partition_name(start, granularity), next_period(start, granularity).isoformat())
+
+
+def partitions():
+    # (name, first day after the partition) for each range partition, oldest first, without the catch-all
+    with connection.cursor() as cursor:
+        cursor.execute(
+            'SELECT PARTITION_NAME, PARTITION_DESCRIPTION FROM information_schema.PARTITIONS '
+            'WHERE TABLE_SCHEMA = DATABASE() AND TABLE_NAME = %s AND PARTITION_NAME IS NOT NULL '
+            'ORDER BY PARTITION_ORDINAL_POSITION',
+            [TABLE]
+        )
+        rows = cursor.fetchall()
+    # TO_DAYS counts from year 0; date.fromordinal counts from year 1
+    return [(name, date.fromordinal(int(bound) - 365)) for name, bound in rows if bound != 'MAXVALUE']
+
+
+def granularity(existing=None):
+    # Read back from the partition names, which are pYYYYMMDD by day and pYYYYMM by month
+    lengths = set(len(name) for name, _ in (partitions() if existing is None else existing))
+    if not lengths:
+        return None
+    if lengths == {9}:
+        return DAY
+    if lengths == {7}:
+        return MONTH
+    raise ValueError('{} mixes day and month partitions'.format(TABLE))
+
+
+def is_partitioned():
+    return connection.vendor == 'mysql' and bool(partitions())
+
+
+def convert(granularity, start, until):
+    # Every unique key of a partitioned table must include the partitioning column
+    clauses = []
+    d = period_start(start, granularity)
+    while d <= until:
+        clauses.append(partition_clause(d, granularity))
+        d = next_period(d, granularity)
+    clauses.append('PARTITION pmax VALUES LESS THAN MAXVALUE')
+    with connection.cursor() as cursor:
+        cursor.execute('ALTER TABLE {} DROP PRIMARY KEY, ADD PRIMARY KEY (id, timestamp)'.format(TABLE))
+        cursor.execute('ALTER TABLE {} PARTITION BY RANGE (TO_DAYS(timestamp)) ({})'.format(TABLE, ', '.join(clauses)))
+
+
+def add_partitions(granularity, until):
+    existing = partitions()
+    d = existing[-1][1] if existing else period_start(date.today(), granularity)
+    clauses = []
+    while d <= until:
+        clauses.append(partition_clause(d, granularity))
+        d = next_period(d, granularity)
+    if clauses:
+        clauses.append('PARTITION pmax VALUES LESS THAN MAXVALUE')
+        with connection.cursor() as cursor:
+            cursor.execute('ALTER TABLE {} REORGANIZE PARTITION pmax INTO ({})'.format(TABLE, ', '.join(clauses)))
+    return len(clauses) - 1 if clauses else 0
+
+
+def expire(before, archive=False):
+    expired = [name for name, end in partitions() if end <= before]
+    with connection.cursor() as cursor:
+        for name in expired:
+            if archive:
+                archive_table = '{}_{}'.format(TABLE, name[1:])
+                cursor.execute('CREATE TABLE {} LIKE {}'.format(archive_table, TABLE))
+                cursor.execute('ALTER TABLE {} REMOVE PARTITIONING'.format(archive_table))
+                cursor.execute('ALTER TABLE {} EXCHANGE PARTITION {} WITH TABLE {}'.format(TABLE, name, archive_table))
+            cursor.execute('ALTER TABLE {} DROP PARTITION {}'.format(TABLE, name))
+    return expired
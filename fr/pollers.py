@@ -0,0 +1,95 @@
+from django.conf import settings
+
+from core.fetch import Fetcher
+from core.streaming import batches
+from fr.columnar import drop_cruising, stream_feed_items, tracked_items
+from fr.models import FrLog
+from fr.writer import FrLogWriter
+
+FR24_BASE_URL = getattr(settings, 'FR24_BASE_URL', 'https://data-live.flightradar24.com').rstrip('/')
+FEED_URL = FR24_BASE_URL + '/zones/fcgi/feed.js?bounds=26.85,2.58,99.27,134.69&faa=1&mlat=1&flarm=1&adsb=1&gnd=1&air=1&vehicles=1&estimated=1&maxage=14400&gliders=1&stats=1'
+FEED_HEADERS = {
+    'accept': 'application/json, text/javascript, */*; q=0.01',
+    'user-agent': 'Mozilla/5.0 (Macintosh; Intel Mac OS X 10_13_4) AppleWebKit/537.36 (KHTML, like Gecko) Chrome/66.0.3359.181 Safari/537.36',
+    'referer': 'https://www.flightradar24.com/11.77,117.95/4',
+}
+BATCH_SIZE = 2000
+
+
+class FrPoller:
+    name = 'fr'
+
+    def __init__(self, archive=None):
+        self.archive = archive
+        self.fetcher = Fetcher(max_workers=1, retries=2, max_backoff=5, headers=FEED_HEADERS)
+        self.found_fingerprints = set()
+        self.writer = FrLogWriter()
+        self.warmed = False
+
+    def fetch(self, cycle):
+        # Bounded retries, a feed that stays down fails this cycle and the next one tries again on schedule
+        retried = self.fetcher.retried
+        try:
+            with cycle.timer('fetch'):
+                r = self.fetcher.get(FEED_URL, stream=True)
+        finally:
+            cycle.count('fetch_retries', self.fetcher.retried - retried)
+        # The body is parsed while it is processed
+        if self.archive:
+            self.archive.record(r, self.name, 'feed', cycle.started)
+        return stream_feed_items(r)
+
+    def replay(self, responses):
+        return stream_feed_items(responses['feed'])
+
+    def normalize(self, items, cycle):
+        # Every tracked row by its FR24 feed id, which follows one aircraft from feed to feed, so only a coalescing
+        # queue ever merges positions and it keeps the newest per aircraft
+        tracked = {}
+        total = 0
+        with cycle.timer('parse_filter'):
+            for batch in batches(items, BATCH_SIZE):
+                total += len(batch)
+                for key, _ in tracked_items(batch):
+                    try:
+                        tracked[key] = (FrLog.fingerprint_feed(_), _)
+                    except Exception as e:
+                        cycle.error(e)
+        cycle.count('feed_rows', total)
+        return tracked
+
+    def write(self, tracked, cycle):
+        if not self.warmed:
+            print('Warmed last positions for {} registrations'.format(self.writer.warm()))
+            self.warmed = True
+
+        this_set_fingerprints = set()
+        candidates = []
+        with cycle.timer('filter'):
+            for fingerprint, _ in tracked.values():
+                this_set_fingerprints.add(fingerprint)
+                if fingerprint not in self.found_fingerprints:
+                    candidates.append((fingerprint, _))
+
+            for fingerprint, _ in drop_cruising(candidates, self.writer.last):
+                try:
+                    self.writer.add(fingerprint, _)
+                except Exception as e:
+                    cycle.error(e)
+
+        try:
+            with cycle.timer('write'):
+                ctr = len(self.writer.flush())
+            self.found_fingerprints = this_set_fingerprints
+        except Exception as e:
+            cycle.error(e)
+            print('Failed writing logs: {!r}'.format(e))
+            ctr = 0
+            self.found_fingerprints = set()
+        cycle.count('tracked', len(tracked))
+        cycle.count('logs_created', ctr)
+        cycle.count('logs_skipped', len(tracked) - ctr)
+        return '{} new logs'.format(ctr)
+
+    def process(self, items, cycle):
+        return self.write(self.normalize(items, cycle), cycle)
@@ -1,3 +1,321 @@
+import asyncio
+import io
+import json
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from datetime import date, datetime
+from importlib import import_module
+from http.server import BaseHTTPRequestHandler, HTTPServer
+from unittest import mock
+
+import pytz
+import requests
+from django.core.management import call_command
+from django.core.management.base import CommandError
+from django.db import DatabaseError, connection
 from django.test import TestCase
 
-# Create your tests here.
+from core.metrics import Cycle, Registry
+from core.pipeline import SnapshotQueue
+from core.scheduler import Scheduler
+from fr import columnar
+from fr.columnar import drop_cruising, feed_items, feed_rows, stream_feed_items, stream_feed_rows, tracked_feeds, tracked_items
+from fr.models import FEED_FIELDS, FINGERPRINT_NUMBERS, FINGERPRINT_STRINGS, FrLog
+from fr import partitions, pollers
+from fr.pollers import FrPoller
+from fr.writer import FrLogWriter, LastPosition
+
+NOW = 1527552000
+
+
+def row(**values):
+    feed = dict(zip(FEED_FIELDS, [
+        '780A3B', 22.3, 114.1, 90, 35000, 450, '1234', 'T-VHHH1', 'A333', 'B-HLA', NOW, 'HKG', 'MNL', 'CX905', 0, 0,
+        'CPA905', 0]))
+    feed.update(values)
+    return [feed[f] for f in FEED_FIELDS]
+
+
+def feed(**values):
+    return dict(zip(FEED_FIELDS, row(**values)))
+
+
+class FrPollerTestCase(TestCase):
+    def test_normalize_keeps_every_tracked_row(self):
+        items = [
+            ('1', row()),
+            # On the ground, so the writer does not take them for the cruising aircraft just logged
+            ('2', row(latitude=22.4, altitude=0)),
+            ('3', row(registration='', callsign='CPA1')),
+            ('4', row(registration='', callsign='CPA2', altitude=0)),
+            ('5', row(origin='LAX', destination='SFO', callsign='UAL1')),
+        ]
+        tracked = FrPoller().normalize(iter(items), Cycle('fr'))
+        self.assertEqual(sorted(tracked), ['1', '2', '3', '4'])
+
+        self.assertEqual(FrPoller().process(iter(items), Cycle('fr')), '4 new logs')
+        self.assertEqual(FrLog.objects.filter(registration='').count(), 2)
+        self.assertEqual(FrLog.objects.filter(registration='B-HLA').count(), 2)
+
+    def test_only_a_coalescing_queue_merges_aircraft(self):
+        poller = FrPoller()
+        first = poller.normalize(iter([('1', row()), ('2', row(registration='B-HLB'))]), Cycle('fr'))
+        second = poller.normalize(iter([('1', row(latitude=22.5))]), Cycle('fr'))
+
+        queue = SnapshotQueue('normalized', 1, 'coalesce')
+        queue.put(Cycle('fr'), first)
+        queue.put(Cycle('fr'), second)
+        _, merged = queue.get()
+        self.assertEqual(sorted(merged), ['1', '2'])
+        self.assertEqual(merged['1'][1]['latitude'], 22.5)
+
+
+class FingerprintMigrationTestCase(TestCase):
+    def test_backfilled_fingerprints_match_the_poller(self):
+        migration = import_module('fr.migrations.0003_frlog_fingerprint')
+        feeds = [
+            feed(),
+            feed(registration='B-HLB', unknown_boolean=1, unknown_boolean_2=1),
+            # Missing values take the string fallback
+            feed(registration='B-HLC', altitude=None, squawk=None),
+        ]
+        for _ in feeds:
+            FrLog.create_from_feed(FrLog.fingerprint_feed(_), _)
+        self.assertEqual(FrLog.objects.count(), 3)
+        for pk, fingerprint, *values in FrLog.objects.order_by('pk').values_list(
+                'pk', 'fingerprint', *(migration.FINGERPRINT_NUMBERS + migration.FINGERPRINT_STRINGS)):
+            self.assertIsInstance(values[migration.FINGERPRINT_NUMBERS.index('unknown_boolean')], bool)
+            self.assertEqual(migration.fingerprint(values), fingerprint)
+        self.assertEqual(migration.FINGERPRINT_NUMBERS, FINGERPRINT_NUMBERS)
+        self.assertEqual(migration.FINGERPRINT_STRINGS, FINGERPRINT_STRINGS)
+
+
+def log(registration='B-HLA', timestamp=NOW, **values):
+    values = dict(dict(latitude=22.3, longitude=114.1, altitude=35000, vertical_speed=0, unknown_boolean=False,
+                       unknown_boolean_2=False, fingerprint=0), **values)
+    return FrLog.objects.create(registration=registration, timestamp=datetime.fromtimestamp(timestamp, pytz.utc), **values)
+
+
+class FrLogWriterTestCase(TestCase):
+    def test_warm_takes_the_latest_position_by_timestamp(self):
+        log(fingerprint=2, timestamp=NOW)
+        # Inserted later but older, like a replayed or backfilled row
+        log(fingerprint=1, timestamp=NOW - 60)
+        log('B-HLB', fingerprint=3)
+        writer = FrLogWriter()
+        self.assertEqual(writer.warm(), 2)
+        self.assertEqual(writer.last['B-HLA'].fingerprint, 2)
+        self.assertEqual(writer.last['B-HLB'].fingerprint, 3)
+
+    def test_cruising_aircraft_are_suppressed(self):
+        writer = FrLogWriter()
+        self.assertIsNotNone(writer.add(1, feed()))
+        self.assertIsNone(writer.add(1, feed(latitude=22.4)))
+        self.assertIsNone(writer.add(2, feed(latitude=22.4, timestamp=NOW + 300, vertical_speed=64)))
+        # Climbing or descending, below 1000ft or five minutes on are logged
+        self.assertIsNotNone(writer.add(3, feed(latitude=22.5, timestamp=NOW + 60, vertical_speed=-1200)))
+        self.assertIsNotNone(writer.add(4, feed(latitude=22.6, timestamp=NOW + 120, vertical_speed=-1200, altitude=900)))
+        self.assertIsNotNone(writer.add(5, feed(latitude=22.7, timestamp=NOW + 421, vertical_speed=-1200, altitude=900)))
+        self.assertEqual(len(writer.flush()), 4)
+
+    def test_failed_flush_restores_last_positions(self):
+        writer = FrLogWriter()
+        writer.add(1, feed())
+        writer.flush()
+        before = dict(writer.last)
+        writer.add(2, feed(vertical_speed=-1200))
+        writer.add(3, feed(registration='B-HLB'))
+        with mock.patch.object(FrLog.objects, 'bulk_create', side_effect=DatabaseError):
+            with self.assertRaises(DatabaseError):
+                writer.flush()
+        self.assertEqual(writer.last, before)
+        self.assertEqual(writer.pending, [])
+        # The same rows are written on the next cycle
+        writer.add(2, feed(vertical_speed=-1200))
+        writer.add(3, feed(registration='B-HLB'))
+        self.assertEqual(len(writer.flush()), 2)
+
+
+class TrackedFeedsTestCase(TestCase):
+    ROWS = [
+        row(),
+        row(origin='LAX', destination='SFO', callsign='UAL1'),
+        row(origin='LAX', destination='SFO', callsign='PAL101'),
+        row(origin=None, destination='MNL', callsign=None),
+        row(origin='LAX', destination=None, callsign=None),
+        row(origin='LAX', destination='SFO', callsign=123),
+        row(origin=5, destination=['HKG'], callsign='UAL2'),
+        row(origin='', destination='', callsign=''),
+        row()[:len(FEED_FIELDS) - 1],
+        row()[:3],
+        [],
+        row(origin='LAX', destination='SFO') + ['extra'],
+    ]
+
+    def expected(self):
+        tracked = []
+        for r in self.ROWS:
+            if len(r) < len(FEED_FIELDS):
+                continue
+            _ = dict(zip(FEED_FIELDS, r))
+            try:
+                if FrLog.is_tracked(_):
+                    tracked.append(_)
+            except Exception:
+                pass
+        return tracked
+
+    def test_matches_is_tracked_row_by_row(self):
+        expected = self.expected()
+        self.assertEqual(len(expected), 4)
+        self.assertEqual(tracked_feeds(self.ROWS), expected)
+        with mock.patch.object(columnar, 'np', None):
+            self.assertEqual(tracked_feeds(self.ROWS), expected)
+
+    def test_keys_follow_their_rows(self):
+        items = [(str(i), r) for i, r in enumerate(self.ROWS)]
+        self.assertEqual([k for k, _ in tracked_items(items)], ['0', '2', '3', '11'])
+
+
+class DropCruisingTestCase(TestCase):
+    def test_only_aircraft_seen_once_are_judged(self):
+        timestamp = datetime.fromtimestamp(NOW - 60, pytz.utc)
+        last = {'B-HLA': LastPosition(1, timestamp, 35000, 0), 'B-HLB': LastPosition(2, timestamp, 35000, 0)}
+        candidates = [
+            (10, feed()),
+            (11, feed(registration='B-HLB')),
+            (12, feed(registration='B-HLB', latitude=22.4)),
+            (13, feed(registration='B-HLC')),
+            (14, feed(registration='B-HLA', vertical_speed=-1200)),
+        ]
+        kept = [fingerprint for fingerprint, _ in drop_cruising(candidates[:1] + candidates[1:4], last)]
+        self.assertEqual(kept, [11, 12, 13])
+        # A registration seen twice this cycle keeps both rows, they are left to the writer
+        kept = [fingerprint for fingerprint, _ in drop_cruising(candidates, last)]
+        self.assertEqual(kept, [10, 11, 12, 13, 14])
+
+
+class _Chunked(io.BytesIO):
+    def read(self, size=-1, decode_content=None):
+        return super().read(5 if size is None or size < 0 else min(size, 5))
+
+    def readinto(self, buffer):
+        data = self.read(len(buffer))
+        buffer[:len(data)] = data
+        return len(data)
+
+
+class _Response:
+    def __init__(self, data):
+        self.body = json.dumps(data).encode()
+        self.raw = _Chunked(self.body)
+        self.closed = False
+
+    def json(self):
+        return json.loads(self.body)
+
+    def close(self):
+        self.closed = True
+
+
+class StreamFeedTestCase(TestCase):
+    DATA = {'full_count': 3, 'version': 4, '1': row(), '2': row(latitude=22.4, bearing=None), '3': row(origin='LAX'),
+            'stats': {'total': {'ads-b': 2}}}
+
+    def test_rows_are_streamed_in_feed_order(self):
+        response = _Response(self.DATA)
+        self.assertEqual(list(stream_feed_items(response)), feed_items(self.DATA))
+        self.assertTrue(response.closed)
+        self.assertEqual(list(stream_feed_rows(_Response(self.DATA))), feed_rows(self.DATA))
+
+    def test_without_ijson(self):
+        with mock.patch.object(columnar, 'ijson', None):
+            self.assertEqual(list(stream_feed_items(_Response(self.DATA))), feed_items(self.DATA))
+
+
+class PartitionsTestCase(TestCase):
+    DAYS = [('p20180528', date(2018, 5, 29)), ('p20180529', date(2018, 5, 30))]
+    MONTHS = [('p201805', date(2018, 6, 1)), ('p201806', date(2018, 7, 1))]
+
+    def test_granularity_is_read_from_partition_names(self):
+        self.assertEqual(partitions.granularity(self.DAYS), partitions.DAY)
+        self.assertEqual(partitions.granularity(self.MONTHS), partitions.MONTH)
+        self.assertIsNone(partitions.granularity([]))
+        with self.assertRaises(ValueError):
+            partitions.granularity(self.DAYS + self.MONTHS)
+
+    def test_maintenance_refuses_another_granularity(self):
+        with mock.patch.object(connection, 'vendor', 'mysql'), \
+                mock.patch.object(partitions, 'partitions', return_value=self.MONTHS), \
+                mock.patch.object(partitions, 'add_partitions', return_value=1) as add_partitions:
+            with self.assertRaisesRegex(CommandError, 'partitioned by month, not day'):
+                call_command('maintain_fr_log', granularity='day')
+            add_partitions.assert_not_called()
+            call_command('maintain_fr_log')
+            self.assertEqual(add_partitions.call_args[0][0], partitions.MONTH)
+
+
+class _Unavailable(BaseHTTPRequestHandler):
+    def log_message(self, *args):
+        pass
+
+    def do_GET(self):
+        if self.path.startswith('/hang'):
+            time.sleep(1)
+        self.send_error(503)
+
+
+class FrFetchTestCase(TestCase):
+    def setUp(self):
+        server = HTTPServer(('127.0.0.1', 0), _Unavailable)
+        threading.Thread(target=server.serve_forever, daemon=True).start()
+        self.addCleanup(server.server_close)
+        self.addCleanup(server.shutdown)
+        self.url = 'http://{}:{}'.format(*server.server_address[:2])
+
+    def test_retries_are_bounded_and_counted(self):
+        poller = FrPoller()
+        poller.fetcher.backoff = poller.fetcher.max_backoff = 0.01
+        cycle = Cycle('fr')
+        with mock.patch.object(pollers, 'FEED_URL', self.url + '/feed.js'):
+            with self.assertRaises(requests.HTTPError):
+                poller.fetch(cycle)
+        self.assertEqual(cycle.counts['fetch_retries'], 2)
+
+    def test_a_hung_feed_times_out(self):
+        poller = FrPoller()
+        poller.fetcher.timeout = 0.2
+        poller.fetcher.retries = 0
+        started = time.monotonic()
+        with mock.patch.object(pollers, 'FEED_URL', self.url + '/hang'):
+            with self.assertRaises(requests.Timeout):
+                poller.fetch(Cycle('fr'))
+        self.assertLess(time.monotonic() - started, 1)
+
+
+class FrSchedulerTestCase(TestCase):
+    def test_fetch_is_timed_once(self):
+        poller = FrPoller()
+
+        def get(*args, **kwargs):
+            time.sleep(0.2)
+            return _Response({'full_count': 1, 'version': 4, '1': row()})
+
+        registry = Registry()
+        scheduler = Scheduler(metrics=registry)
+        job = scheduler.add(poller, 1)
+        loop = asyncio.new_event_loop()
+        pool = ThreadPoolExecutor(max_workers=1)
+        try:
+            with mock.patch.object(poller.fetcher, 'get', get):
+                loop.run_until_complete(asyncio.wait_for(scheduler.run_job(job, pool, pool), 0.5))
+        except asyncio.TimeoutError:
+            pass
+        finally:
+            pool.shutdown(wait=True)
+            loop.close()
+        timings = registry.last['fr']['timings']
+        self.assertAlmostEqual(timings['fetch'], 0.2, delta=0.05)
+        self.assertAlmostEqual(timings['fetch_stage'], 0.2, delta=0.05)
+        self.assertEqual((job.runs, job.failures), (1, 0))
@@ -0,0 +1,67 @@
+from collections import namedtuple
+from datetime import datetime
+from functools import reduce
+from operator import or_
+
+import pytz
+from django.db.models import Max, Q
+
+from core.streaming import batches
+from fr.models import FrLog
+
+WARM_BATCH = 500
+
+LastPosition = namedtuple('LastPosition', ['fingerprint', 'timestamp', 'altitude', 'vertical_speed'])
+
+
+class FrLogWriter:
+    def __init__(self):
+        self.last = {}
+        self.pending = []
+        self._previous = {}
+
+    def warm(self):
+        # The latest position by timestamp, as create_from_feed reads it; rows are not always inserted in time order
+        latest = FrLog.objects.values_list('registration').annotate(latest=Max('timestamp')).order_by()
+        for chunk in batches(latest.iterator(), WARM_BATCH):
+            condition = reduce(or_, (Q(registration=registration, timestamp=timestamp) for registration, timestamp in chunk))
+            logs = FrLog.objects.filter(condition).order_by('pk').values_list(
+                'registration', 'fingerprint', 'timestamp', 'altitude', 'vertical_speed')
+            for registration, *position in logs:
+                self.last[registration] = LastPosition(*position)
+        return len(self.last)
+
+    def add(self, fingerprint, feed):
+        if not FrLog.is_tracked(feed):
+            return None
+        last = self.last.get(feed['registration'])
+        if last and last.fingerprint == fingerprint:
+            return None
+
+        timestamp = datetime.fromtimestamp(feed['timestamp'], pytz.timezone('Asia/Manila'))
+        if last and FrLog.is_cruising(last, timestamp, feed):
+            return None
+
+        log = FrLog()
+        for k, v in feed.items():
+            setattr(log, k, v)
+        log.timestamp = timestamp
+        log.fingerprint = fingerprint
+        self.pending.append(log)
+        self._previous.setdefault(feed['registration'], last)
+        self.last[feed['registration']] = LastPosition(fingerprint, timestamp, log.altitude, log.vertical_speed)
+        return log
+
+    def flush(self):
+        logs, self.pending = self.pending, []
+        previous, self._previous = self._previous, {}
+        try:
+            FrLog.objects.bulk_create(logs)
+        except Exception:
+            for registration, last in previous.items():
+                if last is None:
+                    self.last.pop(registration, None)
+                else:
+                    self.last[registration] = last
+            raise
+        return logs
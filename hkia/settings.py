@@ -137,3 +137,21 @@ STATICFILES_DIRS = (
     os.path.join(BASE_DIR, "static"),
 )
 
+
+# Status change events for /api/stream/. The in-process broker only reaches clients served by the process running
+# the poller, set REDIS_URL whenever they run separately.
+if os.getenv('REDIS_URL'):
+    STATUS_BROKER = {
+        'BACKEND': 'core.events.RedisBroker',
+        'OPTIONS': {'url': os.getenv('REDIS_URL')},
+    }
+else:
+    STATUS_BROKER = {
+        'BACKEND': 'core.events.InProcessBroker',
+        'OPTIONS': {},
+    }
+
+
+# Upstream feeds, point both at `manage.py mock_feeds` to load test the pollers without the internet
+HKIA_BASE_URL = os.getenv('HKIA_BASE_URL', 'https://www.hongkongairport.com')
+FR24_BASE_URL = os.getenv('FR24_BASE_URL', 'https://data-live.flightradar24.com')
@@ -21,4 +21,7 @@ from core import views
 urlpatterns = [
     path('admin/', admin.site.urls),
     path('', views.index),
+    path('api/departures/', views.departures),
+    path('api/arrivals/', views.arrivals),
+    path('api/stream/', views.stream),
 ]